@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+'''
+report the size and decode throughput of the image formats render serves
+
+usage:
+    python benchmarks/image_decode.py [--size 4096] [--repeat 5]
+        [--link-mbps 100 1000 10000]
+
+a smooth image with noise, like a section of tissue, is encoded as png,
+    jpeg and uncompressed tiff and decoded as renderapi.image does.  The
+    time per image to transfer and then decode it is estimated for each
+    link speed, to choose a format per network link.
+'''
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import renderapi  # noqa: E402
+
+
+def section_image(size, dtype):
+    y, x = np.mgrid[:size, :size] / float(size)
+    smooth = 0.5 + 0.25 * np.sin(12 * x) * np.cos(9 * y)
+    noisy = smooth + 0.05 * np.random.randn(size, size)
+    return (np.clip(noisy, 0, 1) * np.iinfo(dtype).max).astype(dtype)
+
+
+def encode(image, fmt):
+    f = io.BytesIO()
+    Image.fromarray(image).save(f, format=fmt)
+    return f.getvalue()
+
+
+def decode_time(decode, content, repeat):
+    best = np.inf
+    for i in range(repeat):
+        start = time.time()
+        decode(content)
+        best = min(best, time.time() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=4096,
+                        help='width and height of image (default 4096)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='decodes to take the best of (default 5)')
+    parser.add_argument('--link-mbps', type=float, nargs='+',
+                        default=[100., 1000., 10000.],
+                        help='link speeds in Mbit/s to estimate for')
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    decoders = [
+        ('renderapi', renderapi.image._decode_image),
+        ('PIL', lambda c: np.asarray(Image.open(io.BytesIO(c))))]
+    print('{:>6} {:>5} {:>10} {:>10} {:>9} {}'.format(
+        'dtype', 'fmt', 'decoder', 'MB', 'MB/s', ' '.join(
+            '{:>9}'.format('{:g}Mb/s'.format(m)) for m in args.link_mbps)))
+    for dtype, formats in [(np.uint8, ['png', 'jpeg', 'tiff']),
+                           (np.uint16, ['png', 'tiff'])]:
+        image = section_image(args.size, dtype)
+        for fmt in formats:
+            content = encode(image, fmt)
+            for name, decode in decoders:
+                if name == 'PIL' and fmt != 'tiff':
+                    continue  # renderapi decodes these with PIL too
+                elapsed = decode_time(decode, content, args.repeat)
+                # seconds per image to transfer and decode
+                totals = [len(content) * 8 / (mbps * 1e6) + elapsed
+                          for mbps in args.link_mbps]
+                print('{:>6} {:>5} {:>10} {:>10.2f} {:>9.0f} {}'.format(
+                    np.dtype(dtype).name, fmt, name, len(content) / 1e6,
+                    image.nbytes / 1e6 / elapsed, ' '.join(
+                        '{:>8.3f}s'.format(t) for t in totals)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+'''
+report the memory held per TileSpec when a large stack is loaded
+
+usage:
+    python benchmarks/tilespec_memory.py [--tiles 1000000]
+
+the tilespecs in test/test_files/tilespecs.json are replicated (with
+    unique tileIds and z values) to the requested number of tiles, which
+    are loaded as TileSpec objects.  Bytes per tile is estimated from the
+    growth of the peak resident set size of the process.
+'''
+import argparse
+import copy
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import renderapi  # noqa: E402
+
+TILESPECS_FILE = os.path.join(
+    os.path.dirname(__file__), '..', 'test', 'test_files', 'tilespecs.json')
+
+
+def maxrss_bytes():
+    # ru_maxrss is in kilobytes on linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def replicated_tilespecs(tilespecs, n):
+    '''yield n tilespec dictionaries cycling through tilespecs'''
+    for i in range(n):
+        d = copy.copy(tilespecs[i % len(tilespecs)])
+        d['tileId'] = '{}.{}'.format(d['tileId'], i)
+        d['z'] = float(i // len(tilespecs))
+        yield d
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--tiles', type=int, default=1000000,
+                        help='number of tiles to load (default 1000000)')
+    args = parser.parse_args()
+
+    with open(TILESPECS_FILE, 'r') as f:
+        tilespecs = json.load(f)
+
+    before = maxrss_bytes()
+    start = time.time()
+    loaded = [renderapi.tilespec.TileSpec(json=d)
+              for d in replicated_tilespecs(tilespecs, args.tiles)]
+    elapsed = time.time() - start
+    after = maxrss_bytes()
+
+    print('loaded {} tiles in {:.1f} s'.format(len(loaded), elapsed))
+    print('peak rss growth: {:.1f} MB'.format((after - before) / 1e6))
+    print('bytes per tile: {:.0f}'.format(float(after - before) / len(loaded)))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,9 +9,15 @@ from . import image
 from . import transform
 from . import pointmatch
 from . import coordinate
+from . import aio
+from . import cache
+from . import store
+from . import ransac
+from . import volume
 from .render import connect
 from .render import Render
 
 __all__ = ['render', 'client', 'tilespec', 'errors',
            'stack', 'image', 'pointmatch', 'coordinate',
-           'connect', 'transform', 'Render']
+           'connect', 'transform', 'Render', 'aio', 'cache',
+           'store', 'ransac', 'volume']
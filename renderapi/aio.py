@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+'''
+asynchronous versions of the render web api calls
+
+Each function in this module takes the same arguments as its counterpart
+in the render, stack, tilespec, image, coordinate and pointmatch modules,
+but returns immediately with an AsyncResult.  AsyncResult.get() waits for
+the request and returns what the synchronous call returns, or raises what
+it raises.
+
+Requests run on a pool of threads shared by the whole process, so many
+requests can be in flight at once without the memory cost of a process
+pool.  Set the number of threads with set_poolsize and create the render
+object with at least as many pooled connections, e.g.
+    render = renderapi.connect(pool_maxsize=64, ...)
+    renderapi.aio.set_poolsize(64)
+    results = [renderapi.aio.get_tile_specs_from_z(stack, z, render=render)
+               for z in zvalues]
+    tilespecs = renderapi.aio.gather(results)
+'''
+import logging
+import os
+from functools import wraps
+from multiprocessing.pool import ThreadPool
+from . import render as _render
+from . import stack as _stack
+from . import tilespec as _tilespec
+from . import image as _image
+from . import coordinate as _coordinate
+from . import pointmatch as _pointmatch
+from .utils import NullHandler
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+DEFAULT_POOLSIZE = 10
+
+_pool = {'pid': None, 'pool': None, 'poolsize': DEFAULT_POOLSIZE}
+
+
+def get_pool():
+    '''
+    get the thread pool which runs asynchronous requests.  The pool is
+        created on first use in each process.
+    '''
+    if _pool['pid'] != os.getpid():
+        _pool['pool'] = ThreadPool(_pool['poolsize'])
+        _pool['pid'] = os.getpid()
+    return _pool['pool']
+
+
+def set_poolsize(poolsize):
+    '''
+    set the number of threads issuing asynchronous requests.
+        Requests already submitted run to completion on the old pool.
+    input:
+        poolsize -- int number of threads
+    '''
+    if _pool['pid'] == os.getpid():
+        _pool['pool'].close()
+    _pool['pid'] = None
+    _pool['pool'] = None
+    _pool['poolsize'] = poolsize
+
+
+def asynchronous(f):
+    '''
+    decorator turning a blocking render api call into one that returns
+        an AsyncResult from the shared thread pool
+    '''
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return get_pool().apply_async(f, args, kwargs)
+    return wrapper
+
+
+def gather(results, timeout=None):
+    '''
+    wait for a list of AsyncResults
+    input:
+        results -- iterable of AsyncResult objects
+    keyword arguments:
+        timeout -- float seconds to wait for each result (default None)
+    returns:
+        list of results in the same order
+    raises:
+        the first exception raised by any of the calls
+    '''
+    return [result.get(timeout) for result in results]
+
+
+# render
+get_owners = asynchronous(_render.get_owners)
+get_stack_metadata_by_owner = asynchronous(
+    _render.get_stack_metadata_by_owner)
+get_projects_by_owner = asynchronous(_render.get_projects_by_owner)
+get_stacks_by_owner_project = asynchronous(
+    _render.get_stacks_by_owner_project)
+
+# stack
+set_stack_metadata = asynchronous(_stack.set_stack_metadata)
+get_stack_metadata = asynchronous(_stack.get_stack_metadata)
+set_stack_state = asynchronous(_stack.set_stack_state)
+likelyUniqueId = asynchronous(_stack.likelyUniqueId)
+delete_stack = asynchronous(_stack.delete_stack)
+delete_section = asynchronous(_stack.delete_section)
+delete_tile = asynchronous(_stack.delete_tile)
+create_stack = asynchronous(_stack.create_stack)
+clone_stack = asynchronous(_stack.clone_stack)
+get_z_values_for_stack = asynchronous(_stack.get_z_values_for_stack)
+get_bounds_from_z = asynchronous(_stack.get_bounds_from_z)
+get_stack_bounds = asynchronous(_stack.get_stack_bounds)
+get_sectionId_for_z = asynchronous(_stack.get_sectionId_for_z)
+get_stack_sectionData = asynchronous(_stack.get_stack_sectionData)
+get_section_z_value = asynchronous(_stack.get_section_z_value)
+get_stack_tileIds = asynchronous(_stack.get_stack_tileIds)
+
+# tilespec
+get_tile_spec = asynchronous(_tilespec.get_tile_spec)
+get_tile_spec_raw = asynchronous(_tilespec.get_tile_spec_raw)
+get_tile_specs_from_minmax_box = asynchronous(
+    _tilespec.get_tile_specs_from_minmax_box)
+get_tile_specs_from_box = asynchronous(_tilespec.get_tile_specs_from_box)
+get_tile_specs_from_z = asynchronous(_tilespec.get_tile_specs_from_z)
+get_tile_specs_from_stack = asynchronous(_tilespec.get_tile_specs_from_stack)
+
+# image
+get_bb_image = asynchronous(_image.get_bb_image)
+get_tile_image_data = asynchronous(_image.get_tile_image_data)
+get_section_image = asynchronous(_image.get_section_image)
+
+# coordinate
+world_to_local_coordinates = asynchronous(
+    _coordinate.world_to_local_coordinates)
+local_to_world_coordinates = asynchronous(
+    _coordinate.local_to_world_coordinates)
+world_to_local_coordinates_batch = asynchronous(
+    _coordinate.world_to_local_coordinates_batch)
+local_to_world_coordinates_batch = asynchronous(
+    _coordinate.local_to_world_coordinates_batch)
+world_to_local_coordinates_array = asynchronous(
+    _coordinate.world_to_local_coordinates_array)
+local_to_world_coordinates_array = asynchronous(
+    _coordinate.local_to_world_coordinates_array)
+
+# pointmatch
+get_matchcollection_owners = asynchronous(
+    _pointmatch.get_matchcollection_owners)
+get_matchcollections = asynchronous(_pointmatch.get_matchcollections)
+get_match_groupIds = asynchronous(_pointmatch.get_match_groupIds)
+get_matches_outside_group = asynchronous(
+    _pointmatch.get_matches_outside_group)
+get_matches_within_group = asynchronous(_pointmatch.get_matches_within_group)
+get_matches_from_group_to_group = asynchronous(
+    _pointmatch.get_matches_from_group_to_group)
+get_matches_from_tile_to_tile = asynchronous(
+    _pointmatch.get_matches_from_tile_to_tile)
+get_matches_with_group = asynchronous(_pointmatch.get_matches_with_group)
+get_match_groupIds_from_only = asynchronous(
+    _pointmatch.get_match_groupIds_from_only)
+get_match_groupIds_to_only = asynchronous(
+    _pointmatch.get_match_groupIds_to_only)
+get_matches_involving_tile = asynchronous(
+    _pointmatch.get_matches_involving_tile)
+delete_point_matches_between_groups = asynchronous(
+    _pointmatch.delete_point_matches_between_groups)
+import_matches = asynchronous(_pointmatch.import_matches)
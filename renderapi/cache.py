@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+'''
+caches for render-ws responses
+'''
+import hashlib
+import json
+import logging
+import os
+import shelve
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from .utils import NullHandler
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+# stack states in which render-ws will not change a stack
+IMMUTABLE_STACK_STATES = ['COMPLETE', 'READ_ONLY']
+
+
+class ResponseCache(object):
+    '''
+    in-memory LRU cache of stack metadata responses, optionally backed by
+        an on-disk store.  Attach to a Render object (Render(cache=...)) to
+        have metadata calls made through that object read through it.
+
+    Entries are grouped by stack: stackkey is a (host, port, owner,
+        project, stack) tuple and key identifies the endpoint and its
+        arguments.  Responses for stacks in an immutable state (COMPLETE or
+        READ_ONLY) are kept until evicted or invalidated; responses for
+        other stacks expire after ttl seconds.  Only immutable responses
+        are written to disk.  Responses may be stored with the version of
+        their stack (its creation and last modification timestamps), so
+        that they are dropped once the stack is deleted and recreated or
+        modified, including by other processes between runs.
+
+    init:
+        maxsize -- int maximum number of responses held in memory
+            (default 1024)
+        ttl -- float seconds after which responses for mutable stacks
+            expire (default 60.)
+        path -- string path of a shelve database persisting responses for
+            immutable stacks across processes (default None, memory only)
+    '''
+    def __init__(self, maxsize=1024, ttl=60., path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._shelf = None if path is None else shelve.open(path)
+
+    @staticmethod
+    def _format_key(k):
+        return json.dumps(k)
+
+    # the on-disk store holds one entry per response and the version of
+    #   each stack, so that storing a response does not rewrite the others
+    @staticmethod
+    def _version_key(sk):
+        return 'version {}'.format(sk)
+
+    @staticmethod
+    def _entry_key(sk, k=''):
+        return 'entry {} {}'.format(sk, k)
+
+    def _drop_stored(self, sk):
+        prefix = self._entry_key(sk)
+        for shelfkey in [key for key in self._shelf
+                         if key.startswith(prefix)]:
+            del self._shelf[shelfkey]
+        self._shelf.pop(self._version_key(sk), None)
+        self._shelf.sync()
+
+    def _get_stored(self, sk, k, version):
+        storedversion = self._shelf.get(self._version_key(sk))
+        if (version is not None and storedversion != version and
+                self._version_key(sk) in self._shelf):
+            logger.debug('dropping stored responses for {} version '
+                         '{}'.format(sk, storedversion))
+            self._drop_stored(sk)
+            return False, None
+        try:
+            value = self._shelf[self._entry_key(sk, k)]
+        except KeyError:
+            return False, None
+        return True, (None, storedversion, value)
+
+    def get(self, stackkey, key, version=None):
+        '''
+        look up a response
+        input:
+            stackkey -- (host, port, owner, project, stack) tuple
+            key -- json serializable tuple identifying endpoint and arguments
+        keyword arguments:
+            version -- json serializable version of the stack the response
+                must have been stored with (default None, any version).
+                Responses stored with another version are dropped.
+        returns:
+            tuple of (boolean whether the response was found, response)
+        '''
+        sk, k = self._format_key(stackkey), self._format_key(key)
+        with self._lock:
+            try:
+                entry = self._entries.pop((sk, k))
+            except KeyError:
+                if self._shelf is None:
+                    return False, None
+                found, entry = self._get_stored(sk, k, version)
+                if not found:
+                    return False, None
+            expires, entryversion, value = entry
+            if expires is not None and expires < time.time():
+                return False, None
+            if version is not None and entryversion != version:
+                return False, None
+            self._entries[(sk, k)] = entry
+            return True, value
+
+    def set(self, stackkey, key, value, immutable=False, version=None):
+        '''
+        store a response
+        input:
+            stackkey -- (host, port, owner, project, stack) tuple
+            key -- json serializable tuple identifying endpoint and arguments
+            value -- response to store
+        keyword arguments:
+            immutable -- boolean whether the stack is in an immutable
+                state, so the response never expires (default False)
+            version -- json serializable version of the stack the
+                response was read from (default None)
+        '''
+        sk, k = self._format_key(stackkey), self._format_key(key)
+        expires = None if immutable else time.time() + self.ttl
+        with self._lock:
+            self._entries.pop((sk, k), None)
+            self._entries[(sk, k)] = (expires, version, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            if immutable and self._shelf is not None:
+                versionkey = self._version_key(sk)
+                if versionkey not in self._shelf:
+                    self._shelf[versionkey] = version
+                elif self._shelf[versionkey] != version:
+                    self._drop_stored(sk)
+                    self._shelf[versionkey] = version
+                self._shelf[self._entry_key(sk, k)] = value
+                self._shelf.sync()
+
+    def invalidate(self, stackkey):
+        '''
+        drop all responses for a stack
+        input:
+            stackkey -- (host, port, owner, project, stack) tuple
+        '''
+        sk = self._format_key(stackkey)
+        logger.debug('invalidating cached responses for {}'.format(sk))
+        with self._lock:
+            for entrykey in [ek for ek in self._entries if ek[0] == sk]:
+                del self._entries[entrykey]
+            if self._shelf is not None:
+                self._drop_stored(sk)
+
+    def clear(self):
+        '''drop all responses'''
+        with self._lock:
+            self._entries.clear()
+            if self._shelf is not None:
+                self._shelf.clear()
+                self._shelf.sync()
+
+    def close(self):
+        '''close the on-disk store'''
+        with self._lock:
+            if self._shelf is not None:
+                self._shelf.close()
+                self._shelf = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # copies in other processes (e.g. pool workers) start empty and
+        # stay in memory rather than share the on-disk store
+        return {'maxsize': self.maxsize, 'ttl': self.ttl}
+
+    def __setstate__(self, d):
+        self.__init__(**d)
+
+
+class ImageCache(object):
+    '''
+    size-capped on-disk LRU cache of rendered image responses.  Attach
+        to a Render object (Render(image_cache=...)) to have the image
+        functions of renderapi.image read through it.  Images are only
+        cached for stacks in an immutable state (COMPLETE or READ_ONLY);
+        requests for other stacks bypass the cache.  The state of a stack
+        is trusted for ttl seconds.
+
+    Images are stored as encoded by render in one directory per stack and
+        stack version (its creation and last modification timestamps), so
+        a cache directory can be shared by several processes and reused
+        across runs without returning images of a stack which has since
+        been deleted and recreated or modified.  Least recently used
+        images are removed once their total size exceeds maxbytes.
+
+    init:
+        path -- string path of the cache directory (created if missing)
+        maxbytes -- int maximum total size in bytes of stored images
+            (default 1 GB)
+        ttl -- float seconds for which stack states are cached
+            (default 60.)
+    '''
+    def __init__(self, path, maxbytes=2 ** 30, ttl=60.):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.states = ResponseCache(ttl=ttl)
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        # resume the recency order of a previous run from access times
+        found = []
+        for stackdir in self._listdirs(path):
+            for versiondir in self._listdirs(os.path.join(path, stackdir)):
+                reldir = os.path.join(stackdir, versiondir)
+                for name in os.listdir(os.path.join(path, reldir)):
+                    if name.startswith('.'):
+                        continue
+                    st = os.stat(os.path.join(path, reldir, name))
+                    found.append((st.st_mtime, os.path.join(reldir, name),
+                                  st.st_size))
+        for mtime, relpath, size in sorted(found):
+            self._entries[relpath] = size
+            self.nbytes += size
+        self._evict()
+
+    @staticmethod
+    def _digest(k):
+        return hashlib.sha1(
+            json.dumps(k, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _listdirs(path):
+        return [d for d in os.listdir(path)
+                if os.path.isdir(os.path.join(path, d))]
+
+    def _relpath(self, stackkey, key, version):
+        return os.path.join(self._digest(stackkey), self._digest(version),
+                            self._digest(key))
+
+    def _forget(self, reldir):
+        # drop the entries of a directory and remove it
+        with self._lock:
+            for relpath in [r for r in self._entries
+                            if r.startswith(reldir + os.sep)]:
+                self.nbytes -= self._entries.pop(relpath)
+            shutil.rmtree(os.path.join(self.path, reldir),
+                          ignore_errors=True)
+
+    def _evict(self):
+        with self._lock:
+            while self.nbytes > self.maxbytes and self._entries:
+                relpath, size = self._entries.popitem(last=False)
+                self.nbytes -= size
+                try:
+                    os.remove(os.path.join(self.path, relpath))
+                except OSError:
+                    pass
+
+    def get(self, stackkey, key, version=None):
+        '''
+        look up an image
+        input:
+            stackkey -- (host, port, owner, project, stack) tuple
+            key -- json serializable object identifying the request
+        keyword arguments:
+            version -- json serializable version of the stack the image
+                must have been stored with (default None)
+        returns:
+            bytes of the image response, or None if not stored
+        '''
+        relpath = self._relpath(stackkey, key, version)
+        filepath = os.path.join(self.path, relpath)
+        try:
+            with open(filepath, 'rb') as f:
+                content = f.read()
+            os.utime(filepath, None)
+        except (IOError, OSError):
+            with self._lock:
+                self.nbytes -= self._entries.pop(relpath, 0)
+            return None
+        with self._lock:
+            # the file may have been written by another process
+            self.nbytes -= self._entries.pop(relpath, 0)
+            self._entries[relpath] = len(content)
+            self.nbytes += len(content)
+        return content
+
+    def set(self, stackkey, key, content, version=None):
+        '''
+        store an image, removing those stored with other versions of
+            its stack
+        input:
+            stackkey -- (host, port, owner, project, stack) tuple
+            key -- json serializable object identifying the request
+            content -- bytes of the image response
+        keyword arguments:
+            version -- json serializable version of the stack the image
+                was rendered from (default None)
+        '''
+        if len(content) > self.maxbytes:
+            return
+        relpath = self._relpath(stackkey, key, version)
+        stackdir, versiondir = os.path.split(os.path.dirname(relpath))
+        versionpath = os.path.join(self.path, stackdir, versiondir)
+        with self._lock:
+            # switch versions under the lock so that concurrent writers
+            #   never remove the directory another is writing into
+            if not os.path.isdir(versionpath):
+                if os.path.isdir(os.path.join(self.path, stackdir)):
+                    for d in self._listdirs(
+                            os.path.join(self.path, stackdir)):
+                        if d == versiondir:
+                            continue
+                        logger.debug('dropping cached images of {} '
+                                     'version {}'.format(stackkey, d))
+                        self._forget(os.path.join(stackdir, d))
+                try:
+                    os.makedirs(versionpath)
+                except OSError:
+                    pass
+        # write to a temporary file so readers never see partial images
+        try:
+            fd, tmp = tempfile.mkstemp(dir=versionpath, prefix='.')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(content)
+                os.rename(tmp, os.path.join(self.path, relpath))
+            except (IOError, OSError):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+        except (IOError, OSError) as e:
+            # e.g. the directory was removed by another process
+            logger.debug('could not cache image {}: {}'.format(relpath, e))
+            return
+        with self._lock:
+            self.nbytes -= self._entries.pop(relpath, 0)
+            self._entries[relpath] = len(content)
+            self.nbytes += len(content)
+        self._evict()
+
+    def invalidate(self, stackkey):
+        '''
+        drop all images and the cached state of a stack
+        input:
+            stackkey -- (host, port, owner, project, stack) tuple
+        '''
+        logger.debug('invalidating cached images for {}'.format(stackkey))
+        self.states.invalidate(stackkey)
+        self._forget(self._digest(stackkey))
+
+    def clear(self):
+        '''drop all images'''
+        self.states.clear()
+        with self._lock:
+            for stackdir in os.listdir(self.path):
+                shutil.rmtree(os.path.join(self.path, stackdir),
+                              ignore_errors=True)
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # copies in other processes share the directory
+        return {'path': self.path, 'maxbytes': self.maxbytes,
+                'ttl': self.ttl}
+
+    def __setstate__(self, d):
+        self.__init__(**d)
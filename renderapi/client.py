@@ -11,7 +11,8 @@ import tempfile
 from .errors import ClientScriptError
 from .utils import NullHandler, renderdump_temp
 from .render import RenderClient, renderaccess
-from .stack import set_stack_state, make_stack_params
+from .stack import (set_stack_state, make_stack_params,
+                    invalidate_stack_cache)
 from pathos.multiprocessing import ProcessingPool as Pool
 
 # setup logger
@@ -58,6 +59,7 @@ def import_single_json_file(stack, jsonfile, transformFile=None,
     logger.debug(cmd)
     proc = subprocess.Popen(cmd, env=my_env, stdout=subprocess.PIPE)
     proc.wait()
+    invalidate_stack_cache(stack, host, port, owner, project, render)
     logger.debug(proc.stdout.read())
 
 
@@ -84,6 +86,7 @@ def import_jsonfiles_and_transforms_parallel_by_z(
                              port=port, owner=owner, project=project)
     with WithPool(poolsize) as pool:
         pool.map(partial_import, jsonfiles, transformfiles)
+    invalidate_stack_cache(stack, host, port, owner, project, render)
 
     if close_stack:
         set_stack_state(stack, 'COMPLETE', host, port, owner, project)
@@ -112,6 +115,7 @@ def import_jsonfiles_parallel(
                              project=project)
     with WithPool(poolsize) as pool:
         pool.map(partial_import, jsonfiles)
+    invalidate_stack_cache(stack, host, port, owner, project, render)
 
     if close_stack:
         set_stack_state(stack, 'COMPLETE', host, port, owner, project)
@@ -144,6 +148,7 @@ def import_jsonfiles(stack, jsonfiles, transformFile=None,
     logger.debug(cmd)
     proc = subprocess.Popen(cmd, env=my_env, stdout=subprocess.PIPE)
     proc.wait()
+    invalidate_stack_cache(stack, host, port, owner, project, render)
     logger.debug(proc.stdout.read())
     if close_stack:
         set_stack_state(stack, 'COMPLETE', host, port, owner, project)
@@ -185,6 +190,7 @@ def import_jsonfiles_validate_client(stack, jsonfiles,
     logger.debug(cmd)
 
     subprocess.call(cmd, env=my_env)
+    invalidate_stack_cache(stack, host, port, owner, project, render)
 
     '''
     proc = subprocess.Popen(cmd, env=my_env, stdout=subprocess.PIPE)
@@ -216,7 +222,8 @@ def import_tilespecs(stack, tilespecs, sharedTransforms=None,
                          trjson if sharedTransforms is not None else None),
                      subprocess_mode=subprocess_mode, host=host, port=port,
                      owner=owner, project=project,
-                     client_script=client_script, memGB=memGB)
+                     client_script=client_script, memGB=memGB,
+                     render=render)
 
     os.remove(tsjson)
     if sharedTransforms is not None:
@@ -251,6 +258,7 @@ def import_tilespecs_parallel(stack, tilespecs, sharedTransforms=None,
     tilespec_groups = [tilespecs[i::poolsize] for i in xrange(poolsize)]
     with WithPool(poolsize) as pool:
         pool.map(partial_import, tilespec_groups)
+    invalidate_stack_cache(stack, host, port, owner, project, render)
     if close_stack:
         set_stack_state(stack, 'COMPLETE', host, port, owner, project)
 
@@ -348,6 +356,7 @@ def importJsonClient(stack, tileFiles=None, transformFile=None,
     call_run_ws_client('org.janelia.render.client.ImportJsonClient',
                        add_args=argvs, subprocess_mode=subprocess_mode,
                        client_script=client_script, memGB=memGB)
+    invalidate_stack_cache(stack, host, port, owner, project, render)
 
 
 @renderaccess
@@ -436,6 +445,10 @@ def importTransformChangesClient(stack, targetStack, transformFile,
         'org.janelia.render.client.ImportTransformChangesClient', memGB=memGB,
         client_script=client_script, subprocess_mode=subprocess_mode,
         add_args=argvs)
+    invalidate_stack_cache(targetStack, host, port,
+                           (owner if targetOwner is None else targetOwner),
+                           (project if targetProject is None
+                            else targetProject), render)
     if close_stack:
         set_stack_state(stack, 'COMPLETE', host, port, owner, project)
 
@@ -521,3 +534,7 @@ def transformSectionClient(stack, transformId, transformClass, transformData,
     call_run_ws_client('org.janelia.render.client.TransformSectionClient',
                        memGB=memGB, client_script=client_script,
                        subprocess_mode=subprocess_mode, add_args=argvs)
+    invalidate_stack_cache((stack if targetStack is None else targetStack),
+                           host, port, owner,
+                           (project if targetProject is None
+                            else targetProject), render)
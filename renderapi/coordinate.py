@@ -6,7 +6,8 @@ from .render import format_preamble, renderaccess
 from .utils import NullHandler
 from .client import coordinateClient
 from .errors import RenderError
-import requests
+from .tilespec import get_tile_specs_from_z
+from .transform import TransformList
 import json
 import numpy as np
 import logging
@@ -20,7 +21,7 @@ logger.addHandler(NullHandler())
 @renderaccess
 def world_to_local_coordinates(stack, z, x, y, host=None,
                                port=None, owner=None, project=None,
-                               session=requests.session(),
+                               session=None,
                                render=None, **kwargs):
     ''''''
     request_url = format_preamble(
@@ -37,7 +38,7 @@ def world_to_local_coordinates(stack, z, x, y, host=None,
 @renderaccess
 def local_to_world_coordinates(stack, tileId, x, y,
                                host=None, port=None, owner=None, project=None,
-                               session=requests.session(),
+                               session=None,
                                render=None, **kwargs):
     ''''''
     request_url = format_preamble(
@@ -55,12 +56,25 @@ def local_to_world_coordinates(stack, tileId, x, y,
 def world_to_local_coordinates_batch(stack, d, z, host=None,
                                      port=None, owner=None, project=None,
                                      execute_local=False,
-                                     session=requests.session(),
+                                     session=None,
                                      render=None, **kwargs):
 
-    ''''''
-    if (execute_local is True):
-        raise NotImplementedError("local execution not yet implemented")
+    '''
+    map world coordinates to the local coordinates of the tiles at z
+    input:
+        stack -- string render stack
+        d -- list of {'world': [x, y]} dictionaries
+        z -- render z
+    keyword arguments:
+        execute_local -- map with a CoordinateMapper built from the
+            tilespecs of z instead of on the server (default False)
+    returns:
+        list of lists of {'tileId', 'local'} dictionaries
+    '''
+    if execute_local:
+        return get_coordinate_mapper(
+            stack, z, host=host, port=port, owner=owner, project=project,
+            session=session).world_to_local_batch(d)
 
     request_url = format_preamble(
         host, port, owner, project, stack) + \
@@ -73,8 +87,26 @@ def world_to_local_coordinates_batch(stack, d, z, host=None,
 @renderaccess
 def local_to_world_coordinates_batch(stack, d, z, host=None,
                                      port=None, owner=None, project=None,
-                                     session=requests.session(),
-                                     render=None, **kwargs):
+                                     session=None,
+                                     render=None, execute_local=False,
+                                     **kwargs):
+    '''
+    map local tile coordinates to world coordinates
+    input:
+        stack -- string render stack
+        d -- list of {'tileId', 'local': [x, y]} dictionaries
+        z -- render z
+    keyword arguments:
+        execute_local -- map with a CoordinateMapper built from the
+            tilespecs of z instead of on the server (default False)
+    returns:
+        list of {'tileId', 'world'} dictionaries
+    '''
+    if execute_local:
+        return get_coordinate_mapper(
+            stack, z, host=host, port=port, owner=owner, project=project,
+            session=session).local_to_world_batch(d)
+
     request_url = format_preamble(
         host, port, owner, project, stack) + \
         "/z/%s/local-to-world-coordinates" % (str(z))
@@ -113,7 +145,7 @@ def unpackage_world_to_local_point_match_from_json(json_answer, tileId):
 # def old_world_to_local_coordinates_array(stack, dataarray, tileId, z=0,
 #                                          host=None, port=None,
 #                                          owner=None, project=None,
-#                                          session=requests.session(),
+#                                          session=None,
 #                                          render=None, **kwargs):
 #     ''''''
 
@@ -158,8 +190,19 @@ def world_to_local_coordinates_array(stack, dataarray, tileId, z,
                                      owner=None, project=None,
                                      client_script=None,
                                      doClientSide=False, number_of_threads=20,
-                                     session=requests.session(), **kwargs):
-    ''''''
+                                     session=None, execute_local=False,
+                                     **kwargs):
+    '''
+    keyword arguments:
+        execute_local -- map with a CoordinateMapper built from the
+            tilespecs of z instead of on the server or client
+            (default False).  To map many arrays at one z, build a
+            mapper once with get_coordinate_mapper.
+    '''
+    if execute_local:
+        return get_coordinate_mapper(
+            stack, z, host=host, port=port, owner=owner, project=project,
+            session=session).world_to_local_array(dataarray, tileId)
     jsondata = package_point_match_data_into_json(dataarray, tileId, 'world')
     if doClientSide:
         json_answer = world_to_local_coordinates_clientside(
@@ -177,7 +220,7 @@ def world_to_local_coordinates_array(stack, dataarray, tileId, z,
 # def old_local_to_world_coordinates_array(stack, dataarray, tileId, z=0,
 #                                          host=None, port=None,
 #                                          owner=None, project=None,
-#                                          session=requests.session(),
+#                                          session=None,
 #                                          render=None, **kwargs):
 #     ''''''
 #     request_url = format_preamble(
@@ -213,8 +256,19 @@ def local_to_world_coordinates_array(stack, dataarray, tileId, z,
                                      owner=None, project=None,
                                      client_script=None,
                                      doClientSide=False, number_of_threads=20,
-                                     session=requests.session(), **kwargs):
-    ''''''
+                                     session=None, execute_local=False,
+                                     **kwargs):
+    '''
+    keyword arguments:
+        execute_local -- map with a CoordinateMapper built from the
+            tilespecs of z instead of on the server or client
+            (default False).  To map many arrays at one z, build a
+            mapper once with get_coordinate_mapper.
+    '''
+    if execute_local:
+        return get_coordinate_mapper(
+            stack, z, host=host, port=port, owner=owner, project=project,
+            session=session).local_to_world_array(dataarray, tileId)
     jsondata = package_point_match_data_into_json(dataarray, tileId, 'local')
     if doClientSide:
         json_answer = local_to_world_coordinates_clientside(
@@ -268,7 +322,7 @@ def world_to_local_coordinates_clientside(stack, jsondata, z,
                                           host=None, port=None, owner=None,
                                           project=None, client_script=None,
                                           number_of_threads=20,
-                                          session=requests.session(),
+                                          session=None,
                                           render=None, **kwargs):
 
     return map_coordinates_clientside(stack, jsondata, z,
@@ -284,7 +338,7 @@ def local_to_world_coordinates_clientside(stack, jsondata, z,
                                           host=None, port=None, owner=None,
                                           project=None, client_script=None,
                                           number_of_threads=20,
-                                          session=requests.session(),
+                                          session=None,
                                           render=None, **kwargs):
     return map_coordinates_clientside(stack, jsondata, z,
                                       host=host, port=port, owner=owner,
@@ -292,3 +346,208 @@ def local_to_world_coordinates_clientside(stack, jsondata, z,
                                       client_script=client_script,
                                       isLocalToWorld=True,
                                       number_of_threads=number_of_threads)
+
+
+class CoordinateMapper(object):
+    '''
+    maps coordinates between world and local tile coordinates of a z
+        layer without contacting render, using the tilespecs of the layer.
+        Every tile must only use transforms which transform.py can apply
+        (and invert, for world to local mapping).
+    init:
+        tilespecs -- list of TileSpec objects
+        cellsize -- size in world units of the cells of the grid used to
+            look up the tiles at a point (default median tile bbox width)
+    '''
+    def __init__(self, tilespecs, cellsize=None):
+        self.tilespecs = list(tilespecs)
+        self.tileIds = [ts.tileId for ts in self.tilespecs]
+        self.index = {tileId: i for i, tileId in enumerate(self.tileIds)}
+        self.tforms = [TransformList(tforms=ts.tforms)
+                       for ts in self.tilespecs]
+        self.bboxes = np.array([self._bbox(ts, tl) for ts, tl in zip(
+            self.tilespecs, self.tforms)], dtype=float).reshape(-1, 4)
+
+        if cellsize is None:
+            widths = self.bboxes[:, 2] - self.bboxes[:, 0]
+            cellsize = np.median(widths) if len(widths) else 1.
+        self.cellsize = max(float(cellsize), 1e-9)
+        self.origin = (self.bboxes[:, :2].min(axis=0) if len(self.bboxes)
+                       else np.zeros(2))
+        self.grid = {}
+        lo = self._cells(self.bboxes[:, :2])
+        hi = self._cells(self.bboxes[:, 2:])
+        for i in range(len(self.tilespecs)):
+            for cx in range(lo[i, 0], hi[i, 0] + 1):
+                for cy in range(lo[i, 1], hi[i, 1] + 1):
+                    self.grid.setdefault((cx, cy), []).append(i)
+
+    @staticmethod
+    def _bbox(ts, tformlist, samples=16):
+        box = (getattr(ts, 'minX', None), getattr(ts, 'minY', None),
+               getattr(ts, 'maxX', None), getattr(ts, 'maxY', None))
+        if all(v is not None for v in box):
+            return box
+        # transform points along the tile boundary
+        xs = np.linspace(0, ts.width, samples)
+        ys = np.linspace(0, ts.height, samples)
+        edge = np.concatenate([
+            np.column_stack([xs, np.zeros(samples)]),
+            np.column_stack([xs, np.full(samples, ts.height)]),
+            np.column_stack([np.zeros(samples), ys]),
+            np.column_stack([np.full(samples, ts.width), ys])])
+        world = tformlist.tform(edge)
+        return tuple(world.min(axis=0)) + tuple(world.max(axis=0))
+
+    def _cells(self, points):
+        return np.floor((points - self.origin) / self.cellsize).astype(int)
+
+    def tiles_at(self, points):
+        '''
+        find the tiles whose bounding boxes contain world points
+        input:
+            points -- Nx2 numpy array of world coordinates
+        returns:
+            tuple of integer arrays (point indices, tile indices) of
+                every point-tile pair, ordered by point
+        '''
+        points = np.asarray(points, dtype=float)
+        pointidx, tileidx = [], []
+        if len(points):
+            # group points by cell using a scalar key per cell
+            cells = self._cells(points).astype(np.int64)
+            lo = cells.min(axis=0)
+            ny = cells[:, 1].max() - lo[1] + 1
+            keys = (cells[:, 0] - lo[0]) * ny + (cells[:, 1] - lo[1])
+            order = np.argsort(keys, kind='mergesort')
+            starts = np.flatnonzero(np.diff(keys[order])) + 1
+            groups = np.split(order, starts)
+            cells = cells[order[np.concatenate([[0], starts])]]
+        else:
+            cells, groups = [], []
+        for cell, members in zip(map(tuple, cells), groups):
+            for t in self.grid.get(cell, []):
+                minX, minY, maxX, maxY = self.bboxes[t]
+                p = points[members]
+                inside = members[(p[:, 0] >= minX) & (p[:, 0] <= maxX) &
+                                 (p[:, 1] >= minY) & (p[:, 1] <= maxY)]
+                pointidx.append(inside)
+                tileidx.append(np.full(len(inside), t, dtype=int))
+        if not pointidx:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        pointidx = np.concatenate(pointidx)
+        tileidx = np.concatenate(tileidx)
+        order = np.lexsort((tileidx, pointidx))
+        return pointidx[order], tileidx[order]
+
+    def local_to_world_array(self, points, tileId):
+        '''
+        input:
+            points -- Nx2 numpy array of local coordinates in a tile
+            tileId -- tileId of the tile
+        returns:
+            Nx2 numpy array of world coordinates
+        '''
+        return self.tforms[self.index[tileId]].tform(
+            np.asarray(points, dtype=float))
+
+    def world_to_local_array(self, points, tileId):
+        '''
+        input:
+            points -- Nx2 numpy array of world coordinates
+            tileId -- tileId of the tile
+        returns:
+            Nx2 numpy array of local coordinates in that tile
+        '''
+        return self.tforms[self.index[tileId]].inverse_tform(
+            np.asarray(points, dtype=float))
+
+    def world_to_local_pairs(self, points):
+        '''
+        map world points to local coordinates of every tile containing them
+        input:
+            points -- Nx2 numpy array of world coordinates
+        returns:
+            tuple of (point indices, tile indices, Mx2 numpy array of local
+                coordinates) for each of the M point-tile pairs found,
+                ordered by point.  tileIds[tile index] gives the tileId.
+        '''
+        points = np.asarray(points, dtype=float)
+        pointidx, tileidx = self.tiles_at(points)
+        local = np.zeros((len(pointidx), 2))
+        inside = np.ones(len(pointidx), dtype=bool)
+        for t in np.unique(tileidx):
+            sel = np.flatnonzero(tileidx == t)
+            local[sel] = self.tforms[t].inverse_tform(points[pointidx[sel]])
+            ts = self.tilespecs[t]
+            if ts.width is not None and ts.height is not None:
+                inside[sel] = ((local[sel, 0] >= 0) &
+                               (local[sel, 0] <= ts.width) &
+                               (local[sel, 1] >= 0) &
+                               (local[sel, 1] <= ts.height))
+        return pointidx[inside], tileidx[inside], local[inside]
+
+    def world_to_local(self, points):
+        '''
+        map world points to local coordinates of every tile containing them
+        input:
+            points -- Nx2 numpy array of world coordinates
+        returns:
+            list of N lists of {'tileId', 'local'} dictionaries, as
+                returned by render's world-to-local-coordinates
+        '''
+        pointidx, tileidx, local = self.world_to_local_pairs(points)
+        results = [[] for i in range(len(points))]
+        for i, t, xy in zip(pointidx.tolist(), tileidx.tolist(),
+                            local.tolist()):
+            results[i].append({'tileId': self.tileIds[t], 'local': xy})
+        return results
+
+    def world_to_local_batch(self, d):
+        '''
+        input:
+            d -- list of {'world': [x, y]} dictionaries
+        returns:
+            list of lists of {'tileId', 'local'} dictionaries
+        '''
+        return self.world_to_local(
+            np.array([p['world'][:2] for p in d], dtype=float).reshape(-1, 2))
+
+    def local_to_world_batch(self, d):
+        '''
+        input:
+            d -- list of {'tileId', 'local': [x, y]} dictionaries
+        returns:
+            list of {'tileId', 'world'} dictionaries
+        '''
+        results = [None] * len(d)
+        bytile = {}
+        for i, p in enumerate(d):
+            bytile.setdefault(p['tileId'], []).append(i)
+        for tileId, members in bytile.items():
+            world = self.local_to_world_array(
+                [d[i]['local'][:2] for i in members], tileId)
+            for i, xy in zip(members, world.tolist()):
+                results[i] = {'tileId': tileId, 'world': xy}
+        return results
+
+
+@renderaccess
+def get_coordinate_mapper(stack, z, cellsize=None, host=None, port=None,
+                          owner=None, project=None, session=None,
+                          render=None, **kwargs):
+    '''
+    build a CoordinateMapper for a z layer of a stack
+    input:
+        stack -- string render stack
+        z -- render z
+    keyword arguments:
+        cellsize -- grid cell size of the tile lookup (see CoordinateMapper)
+        render -- render connect object (or host, port, owner, project)
+        session -- requests.session (default pooled session)
+    returns:
+        CoordinateMapper
+    '''
+    return CoordinateMapper(get_tile_specs_from_z(
+        stack, z, host=host, port=port, owner=owner, project=project,
+        session=session) or [], cellsize=cellsize)
@@ -22,3 +22,7 @@ class EstimationError(RenderError):
 
 class SpecError(RenderError):
     pass
+
+
+class StaleDataError(RenderError):
+    pass
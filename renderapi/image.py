@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 
 import io
-import requests
+import struct
+from fractions import Fraction
 from PIL import Image
 import numpy as np
 import logging
 from .render import format_preamble, renderaccess
 from .errors import RenderError
-from .utils import NullHandler, jbool
+from .stack import _stack_status
+from .utils import NullHandler, jbool, imap_bounded
 
 logger = logging.getLogger(__name__)
 logger.addHandler(NullHandler())
@@ -23,14 +25,182 @@ IMAGE_FORMATS = {'png': 'png-image',
                  'tiff': 'tiff-image',
                  None: 'png-image'}  # Default to png
 
+# tiff header byte order marks, SampleFormat values and IFD entry types
+_TIFF_BYTEORDERS = {b'II': '<', b'MM': '>'}
+_TIFF_SAMPLEFORMATS = {1: 'u', 2: 'i', 3: 'f'}
+_TIFF_TYPES = {3: 'H', 4: 'I'}
+
+
+def _read_into(r, buffer):
+    '''
+    read a streamed response into a bytearray and return a uint8 numpy
+        array viewing the bytes read
+    '''
+    n = 0
+    for chunk in r.iter_content(chunk_size=2 ** 16):
+        if n + len(chunk) > len(buffer):
+            raise RenderError(
+                'image response exceeds buffer of {} bytes'.format(
+                    len(buffer)))
+        buffer[n:n + len(chunk)] = chunk
+        n += len(chunk)
+    return np.frombuffer(buffer, dtype=np.uint8, count=n)
+
+
+def _get_image(stack, request_url, qparams, host, port, owner, project,
+               session, render, buffer=None):
+    '''
+    get the content of an image response, reading through the image cache
+        of the render object (see renderapi.cache.ImageCache) for stacks
+        which are COMPLETE or READ_ONLY, keyed by the version of the
+        stack.  A successful response fetched
+        from render is streamed into buffer if given.
+    '''
+    def fetch():
+        if buffer is None:
+            r = session.get(request_url, params=qparams)
+            return r.status_code, r.content
+        r = session.get(request_url, params=qparams, stream=True)
+        try:
+            return r.status_code, (_read_into(r, buffer)
+                                   if r.status_code == 200 else r.content)
+        finally:
+            r.close()
+
+    cache = getattr(render, 'image_cache', None)
+    if cache is not None:
+        stackkey = (host, port, owner, project, stack)
+        immutable, version = _stack_status(cache.states, *stackkey,
+                                           session=session)
+        if immutable:
+            key = (request_url, sorted(qparams.items()))
+            content = cache.get(stackkey, key, version=version)
+            if content is None:
+                status_code, content = fetch()
+                if status_code == 200:
+                    cache.set(stackkey, key, (
+                        content.tobytes() if isinstance(content, np.ndarray)
+                        else content), version=version)
+            return content
+    return fetch()[1]
+
+
+def _parse_tiff(content):
+    '''
+    view the first image of an uncompressed tiff made of consecutive strips
+        as a numpy array, without copying or decoding the pixels.  The
+        dtype keeps the byte order of the file.
+    input:
+        content -- bytes or uint8 numpy array of the tiff file
+    returns:
+        numpy array of shape (rows, columns[, samples]), or None for
+            images this cannot view (not tiff, compressed, tiled, planar,
+            palette or bilevel images, ...)
+    '''
+    try:
+        byteorder = _TIFF_BYTEORDERS.get(
+            struct.unpack_from('2s', content, 0)[0])
+        if byteorder is None:
+            return None
+        magic, ifd = struct.unpack_from(byteorder + 'HI', content, 2)
+        if magic != 42:
+            return None
+        tags = {}
+        for i in range(struct.unpack_from(byteorder + 'H', content, ifd)[0]):
+            entry = ifd + 2 + 12 * i
+            tag, fieldtype, count = struct.unpack_from(
+                byteorder + 'HHI', content, entry)
+            fmt = _TIFF_TYPES.get(fieldtype)
+            if fmt is None:
+                continue
+            # values of up to 4 bytes are held in the entry itself
+            offset = (entry + 8 if struct.calcsize(fmt) * count <= 4 else
+                      struct.unpack_from(byteorder + 'I', content,
+                                         entry + 8)[0])
+            tags[tag] = struct.unpack_from(
+                '{}{}{}'.format(byteorder, count, fmt), content, offset)
+
+        width, height = tags[256][0], tags[257][0]
+        offsets, counts = tags[273], tags[279]
+        samples = tags.get(277, (1, ))[0]
+        bits = set(tags.get(258, (1, )))
+        if (tags.get(259, (1, ))[0] != 1 or  # compression
+                tags.get(262, (1, ))[0] not in (1, 2) or  # photometric
+                tags.get(284, (1, ))[0] != 1 or  # planar configuration
+                tags.get(317, (1, ))[0] != 1 or  # predictor
+                322 in tags or  # tile width
+                len(bits) != 1 or bits.pop() not in (8, 16, 32, 64)):
+            return None
+        dtype = np.dtype('{}{}{}'.format(
+            byteorder, _TIFF_SAMPLEFORMATS[tags.get(339, (1, ))[0]],
+            tags[258][0] // 8))
+    except (struct.error, KeyError, TypeError):
+        return None
+
+    nbytes = width * height * samples * dtype.itemsize
+    if (len(offsets) != len(counts) or
+            any(o + c != nexto for o, c, nexto in zip(
+                offsets, counts, offsets[1:])) or
+            sum(counts) < nbytes or offsets[0] + nbytes > len(content)):
+        return None
+    if not isinstance(content, np.ndarray):
+        content = np.frombuffer(content, dtype=np.uint8)
+    image = content[offsets[0]:offsets[0] + nbytes].view(dtype)
+    return image.reshape((height, width) if samples == 1 else
+                         (height, width, samples))
+
+
+def _decode_image(content):
+    '''
+    decode an image response into a numpy array, viewing uncompressed
+        tiffs in place and decoding other images with PIL
+    '''
+    image = _parse_tiff(content)
+    if image is not None:
+        return image
+    if isinstance(content, np.ndarray):
+        content = content.tobytes()
+    return np.asarray(Image.open(io.BytesIO(content)))
+
+
+def _bb_image_shape(width, height, scale):
+    '''(rows, columns) of the image render makes of a box'''
+    return int(height * scale + 0.5), int(width * scale + 0.5)
+
+
+def _bb_tiles(x, y, width, height, scale, tilesize):
+    '''
+    split a box into sub-boxes whose world extents are whole multiples of
+        the denominator of scale, so that each sub-box starts on a whole
+        output pixel
+    yields:
+        ((x, y, width, height) of sub-box,
+         (row slice, column slice) of the output image it covers)
+    '''
+    denominator = Fraction(scale).limit_denominator(10000).denominator
+    step = max(denominator,
+               int(tilesize / scale) // denominator * denominator)
+    rows, cols = _bb_image_shape(width, height, scale)
+    for ty in range(0, height, step):
+        th = min(step, height - ty)
+        r0, r1 = int(ty * scale + 0.5), min(rows, int((ty + th) * scale + 0.5))
+        for tx in range(0, width, step):
+            tw = min(step, width - tx)
+            c0, c1 = (int(tx * scale + 0.5),
+                      min(cols, int((tx + tw) * scale + 0.5)))
+            if r1 > r0 and c1 > c0:
+                yield ((x + tx, y + ty, tw, th),
+                       (slice(r0, r1), slice(c0, c1)))
+
 
 @renderaccess
 def get_bb_image(stack, z, x, y, width, height, scale=1.0,
                  minIntensity=None, maxIntensity=None, binaryMask=None,
                  filter=None, maxTileSpecsToRender=None,
                  host=None, port=None, owner=None, project=None,
-                 img_format=None, session=requests.session(),
-                 render=None, **kwargs):
+                 img_format=None, session=None,
+                 render=None, tilesize=None, poolsize=None, out=None,
+                 memmap=None, buffer=None, **kwargs):
     '''
     render image from a bounding box defined in xy and return numpy array:
         z: layer
@@ -41,16 +211,37 @@ def get_bb_image(stack, z, x, y, width, height, scale=1.0,
         binaryMask: optional, boolean whether to treat maskimage as binary
         maxTileSpecsToRender: optional, int number of tilespecs to render
         filter: optional, boolean whether to use Khaled's preferred filter
+        tilesize: optional, int maximum width and height in output pixels
+            of sub-boxes to render separately and concurrently.  Each is
+            copied into its slice of a single output array: png (and
+            other compressed) tiles are first decoded into a temporary
+            array, while uncompressed tiff tiles (img_format='tiff') are
+            copied straight from the response.  By default the box is
+            rendered in a single request.
+        poolsize: optional, int number of sub-boxes requested at once
+            (default 10).  The session should keep at least this many
+            connections (see renderapi.connect(pool_maxsize=...))
+        out: optional, numpy array (e.g. a np.memmap) of shape
+            (int(height * scale + 0.5), int(width * scale + 0.5)[, bands])
+            and of the dtype of the rendered image to render into when
+            tiled
+        memmap: optional, path of a np.memmap file to create and render
+            into when tiled and out is not given
+        buffer: optional, bytearray into which the response is read when
+            not tiled.  Uncompressed tiff images (img_format='tiff') are
+            returned as views of it, so a buffer reused between calls
+            avoids allocating and copying each image.
+    raises (when tiled):
+        RenderError if a sub-box cannot be rendered
+        ValueError if out does not match the shape or dtype of the image
     '''
     try:
         image_ext = IMAGE_FORMATS[img_format]
     except KeyError as e:  # pragma: no cover
         raise ValueError('{} is not a valid render image format!'.format(e))
+    if tilesize is not None and buffer is not None:
+        raise ValueError('a buffer cannot be shared by concurrent tiles')
 
-    request_url = format_preamble(
-        host, port, owner, project, stack) + \
-        "/z/%d/box/%d,%d,%d,%d,%f/%s" % (
-                      z, x, y, width, height, scale, image_ext)
     qparams = {}
     if minIntensity is not None:
         qparams['minIntensity'] = minIntensity
@@ -63,14 +254,65 @@ def get_bb_image(stack, z, x, y, width, height, scale=1.0,
     if maxTileSpecsToRender is not None:
         qparams['maxTileSpecsToRender'] = maxTileSpecsToRender
 
-    r = session.get(request_url, params=qparams)
-    try:
-        image = np.asarray(Image.open(io.BytesIO(r.content)))
-        return image
-    except Exception as e:
-        logger.error(e)
-        logger.error(r.text)
-        return RenderError(r.text)
+    def box_url(x, y, width, height):
+        return format_preamble(
+            host, port, owner, project, stack) + \
+            "/z/%d/box/%d,%d,%d,%d,%f/%s" % (
+                          z, x, y, width, height, scale, image_ext)
+
+    if tilesize is None:
+        content = _get_image(stack, box_url(x, y, width, height), qparams,
+                             host, port, owner, project, session, render,
+                             buffer=buffer)
+        try:
+            image = _decode_image(content)
+            return image
+        except Exception as e:
+            logger.error(e)
+            logger.error(content)
+            return RenderError(content)
+
+    def get_tile(tile):
+        box, index = tile
+        content = _get_image(stack, box_url(*box), qparams,
+                             host, port, owner, project, session, render)
+        try:
+            return _decode_image(content)
+        except Exception as e:
+            logger.error(e)
+            logger.error(content)
+            raise RenderError('cannot render box {}: {}'.format(
+                box, content))
+
+    x, y, width, height = int(x), int(y), int(width), int(height)
+    shape = _bb_image_shape(width, height, scale)
+    if out is not None and tuple(out.shape[:2]) != shape:
+        raise ValueError('out has shape {} -- expected {} rows and '
+                         'columns'.format(out.shape, shape))
+    tiles = list(_bb_tiles(x, y, width, height, scale, tilesize))
+    logger.debug('rendering {} box {} in {} tiles'.format(
+        shape, (x, y, width, height), len(tiles)))
+    for (box, index), tile_image in imap_bounded(
+            get_tile, tiles, poolsize=poolsize, ordered=False):
+        if out is None:
+            fullshape = shape + tile_image.shape[2:]
+            out = (np.zeros(fullshape, dtype=tile_image.dtype)
+                   if memmap is None else
+                   np.memmap(memmap, dtype=tile_image.dtype, mode='w+',
+                             shape=fullshape))
+        elif (out.dtype != tile_image.dtype or
+                out.shape[2:] != tile_image.shape[2:]):
+            raise ValueError(
+                'out has shape {} and dtype {} -- rendered tiles have {} '
+                'bands and dtype {}'.format(
+                    out.shape, out.dtype, tile_image.shape[2:],
+                    tile_image.dtype))
+        rows, cols = index
+        h = min(rows.stop - rows.start, tile_image.shape[0])
+        w = min(cols.stop - cols.start, tile_image.shape[1])
+        out[rows.start:rows.start + h, cols.start:cols.start + w] = \
+            tile_image[:h, :w]
+    return out
 
 
 @renderaccess
@@ -78,9 +320,11 @@ def get_tile_image_data(stack, tileId, normalizeForMatching=True,
                         removeAllOption=False, scale=None,
                         filter=None, host=None, port=None, owner=None,
                         project=None, img_format=None,
-                        session=requests.session(), render=None, **kwargs):
+                        session=None, render=None, buffer=None, **kwargs):
     '''
     render image from a tile with all transforms and return numpy array
+        buffer: optional, bytearray into which the response is read
+            (see get_bb_image)
     '''
     try:
         image_ext = IMAGE_FORMATS[img_format]
@@ -102,29 +346,88 @@ def get_tile_image_data(stack, tileId, normalizeForMatching=True,
         qparams['removeAllOption'] = jbool(removeAllOption)
     logger.debug(request_url)
 
-    r = session.get(request_url, params=qparams)
+    content = _get_image(stack, request_url, qparams,
+                         host, port, owner, project, session, render,
+                         buffer=buffer)
     try:
-        img = Image.open(io.BytesIO(r.content))
-        array = np.asarray(img)
-        return array
+        return _decode_image(content)
     except Exception as e:
         logger.error(e)
-        logger.error(r.text)
-        return RenderError(r.text)
+        logger.error(content)
+        return RenderError(content)
+
+
+@renderaccess
+def get_tile_images(stack, tileIds, normalizeForMatching=True,
+                    removeAllOption=False, scale=None, filter=None,
+                    poolsize=None, readahead=None, ordered=False,
+                    errors=None, host=None, port=None, owner=None,
+                    project=None, img_format=None, session=None,
+                    render=None, **kwargs):
+    '''
+    render images of many tiles concurrently (see get_tile_image_data),
+        yielding each as it arrives.  At most readahead images are
+        requested but not yet consumed, so memory does not grow with the
+        number of tiles.
+    input:
+        stack -- string render stack
+        tileIds -- iterable of tileIds to render
+    keyword arguments:
+        normalizeForMatching, removeAllOption, scale, filter, img_format --
+            see get_tile_image_data
+        poolsize -- int number of tiles requested at once (default 10).
+            The session should keep at least this many connections
+            (see renderapi.connect(pool_maxsize=...))
+        readahead -- int maximum number of tiles requested but not yet
+            yielded (default 2 * poolsize)
+        ordered -- boolean whether to yield tiles in the order of tileIds
+            (default False) rather than as soon as they are rendered
+        errors -- optional dictionary in which the RenderError of each
+            tile that cannot be rendered is stored by tileId.  Such tiles
+            are skipped.  By default the first error is raised.
+        render -- render connect object (or host, port, owner, project)
+        session -- requests.session (default pooled session)
+    yields:
+        (tileId, numpy array) tuples
+    raises:
+        RenderError if a tile cannot be rendered and errors is None
+    '''
+    def get_tile(tileId):
+        try:
+            image = get_tile_image_data(
+                stack, tileId, normalizeForMatching=normalizeForMatching,
+                removeAllOption=removeAllOption, scale=scale, filter=filter,
+                img_format=img_format, host=host, port=port, owner=owner,
+                project=project, session=session, render=render)
+        except Exception as e:
+            image = e if isinstance(e, RenderError) else RenderError(
+                'cannot render tile {}: {}'.format(tileId, e))
+        return image
+
+    for tileId, image in imap_bounded(get_tile, tileIds, poolsize=poolsize,
+                                      readahead=readahead, ordered=ordered):
+        if isinstance(image, RenderError):
+            if errors is None:
+                raise image
+            logger.debug('cannot render tile {}: {}'.format(tileId, image))
+            errors[tileId] = image
+            continue
+        yield tileId, image
 
 
 @renderaccess
 def get_section_image(stack, z, scale=1.0, filter=False,
                       maxTileSpecsToRender=None, img_format=None,
                       host=None, port=None, owner=None, project=None,
-                      session=requests.session(),
-                      render=None, **kwargs):
+                      session=None,
+                      render=None, buffer=None, **kwargs):
     '''
     z: layer Z
     scale: float -- linear scale at which to render image (e.g. 0.5)
     filter: boolean -- whether or not to apply Khaled's preferred filter
     maxTileSpecsToRender: int -- maximum number of tile specs in rendering
     img_format: string -- format defined by IMAGE_FORMATS
+    buffer: bytearray -- read the response into buffer (see get_bb_image)
     '''
     try:
         image_ext = IMAGE_FORMATS[img_format]
@@ -136,5 +439,6 @@ def get_section_image(stack, z, scale=1.0, filter=False,
     qparams = {'scale': scale, 'filter': jbool(filter)}
     if maxTileSpecsToRender is not None:
         qparams.update({'maxTileSpecsToRender': maxTileSpecsToRender})
-    r = session.get(request_url, params=qparams)
-    return np.asarray(Image.open(io.BytesIO(r.content)))
+    return _decode_image(_get_image(stack, request_url, qparams,
+                                    host, port, owner, project, session,
+                                    render, buffer=buffer))
@@ -2,7 +2,6 @@
 '''
 Point Match APIs
 '''
-import requests
 import logging
 from .render import format_baseurl, renderaccess
 from .errors import RenderError
@@ -14,7 +13,7 @@ logger.addHandler(NullHandler())
 
 @renderaccess
 def get_matchcollection_owners(host=None, port=None,
-                               session=requests.session(),
+                               session=None,
                                render=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/matchCollectionOwners"
@@ -29,7 +28,7 @@ def get_matchcollection_owners(host=None, port=None,
 
 @renderaccess
 def get_matchcollections(owner=None, host=None, port=None,
-                         session=requests.session(), render=None, **kwargs):
+                         session=None, render=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/%s/matchCollections" % owner
     r = session.get(request_url)
@@ -43,7 +42,7 @@ def get_matchcollections(owner=None, host=None, port=None,
 
 @renderaccess
 def get_match_groupIds(matchCollection, owner=None, host=None,
-                       port=None, session=requests.session(),
+                       port=None, session=None,
                        render=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/%s/matchCollection/%s/groupIds" % (owner, matchCollection)
@@ -58,7 +57,7 @@ def get_match_groupIds(matchCollection, owner=None, host=None,
 
 @renderaccess
 def get_matches_outside_group(matchCollection, groupId, owner=None, host=None,
-                              port=None, session=requests.session(),
+                              port=None, session=None,
                               render=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/%s/matchCollection/%s/group/%s/matchesOutsideGroup" % (
@@ -74,7 +73,7 @@ def get_matches_outside_group(matchCollection, groupId, owner=None, host=None,
 
 @renderaccess
 def get_matches_within_group(matchCollection, groupId, owner=None,
-                             host=None, port=None, session=requests.session(),
+                             host=None, port=None, session=None,
                              render=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/%s/matchCollection/%s/group/%s/matchesWithinGroup" % (
@@ -92,7 +91,7 @@ def get_matches_within_group(matchCollection, groupId, owner=None,
 def get_matches_from_group_to_group(matchCollection, pgroup, qgroup,
                                     render=None, owner=None, host=None,
                                     port=None,
-                                    session=requests.session(), **kwargs):
+                                    session=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/%s/matchCollection/%s/group/%s/matchesWith/%s" % (
             owner, matchCollection, pgroup, qgroup)
@@ -109,7 +108,7 @@ def get_matches_from_group_to_group(matchCollection, pgroup, qgroup,
 def get_matches_from_tile_to_tile(matchCollection, pgroup, pid,
                                   qgroup, qid, render=None, owner=None,
                                   host=None, port=None,
-                                  session=requests.session(), **kwargs):
+                                  session=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         ("/owner/%s/matchCollection/%s/group/%s/id/%s/"
          "matchesWith/%s/id/%s" % (
@@ -126,7 +125,7 @@ def get_matches_from_tile_to_tile(matchCollection, pgroup, pid,
 @renderaccess
 def get_matches_with_group(matchCollection, pgroup, render=None, owner=None,
                            host=None, port=None,
-                           session=requests.session(), **kwargs):
+                           session=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/%s/matchCollection/%s/pGroup/%s/matches/" % (
             owner, matchCollection, pgroup)
@@ -142,7 +141,7 @@ def get_matches_with_group(matchCollection, pgroup, render=None, owner=None,
 @renderaccess
 def get_match_groupIds_from_only(matchCollection, render=None, owner=None,
                                  host=None, port=None,
-                                 session=requests.session(), **kwargs):
+                                 session=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/%s/matchCollection/%s/pGroupIds" % (owner, matchCollection)
     r = session.get(request_url)
@@ -157,7 +156,7 @@ def get_match_groupIds_from_only(matchCollection, render=None, owner=None,
 @renderaccess
 def get_match_groupIds_to_only(matchCollection, render=None, owner=None,
                                host=None, port=None,
-                               session=requests.session(), **kwargs):
+                               session=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/%s/matchCollection/%s/qGroupIds" % (owner, matchCollection)
     r = session.get(request_url)
@@ -172,7 +171,7 @@ def get_match_groupIds_to_only(matchCollection, render=None, owner=None,
 @renderaccess
 def get_matches_involving_tile(matchCollection, pGroupId, pTileId,
                                owner=None, host=None, port=None,
-                               session=requests.session(), **kwargs):
+                               session=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/{}/matchCollection/{}/group/{}/id/{}/".format(
             owner, matchCollection, pGroupId, pTileId)
@@ -188,7 +187,7 @@ def get_matches_involving_tile(matchCollection, pGroupId, pTileId,
 @renderaccess
 def delete_point_matches_between_groups(matchCollection, pGroupId, qGroupId,
                                         render=None, owner=None, host=None,
-                                        port=None, session=requests.session(),
+                                        port=None, session=None,
                                         **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/{}/matchCollection/{}/group/{}/matchesWith/{}".format(
@@ -205,7 +204,7 @@ def delete_point_matches_between_groups(matchCollection, pGroupId, qGroupId,
 
 @renderaccess
 def import_matches(matchCollection, data, owner=None, host=None, port=None,
-                   session=requests.session(), render=None, **kwargs):
+                   session=None, render=None, **kwargs):
     request_url = format_baseurl(host, port) + \
         "/owner/%s/matchCollection/%s/matches" % (owner, matchCollection)
     logger.debug(request_url)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+'''
+robust (RANSAC) estimation of transforms from point correspondences,
+    evaluating batches of hypotheses against all points at once
+'''
+import copy
+import logging
+import numpy as np
+from .errors import EstimationError
+from .transform import (AffineModel, TranslationModel, RigidModel,
+                        SimilarityModel, Polynomial2DTransform)
+from .utils import NullHandler
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+
+def _homogeneous(linear, translation):
+    K = linear.shape[0]
+    M = np.zeros((K, 3, 3))
+    M[:, :2, :2] = linear
+    M[:, :2, 2] = translation
+    M[:, 2, 2] = 1.
+    return M
+
+
+def _fit_translation(src, dst, order):
+    return _homogeneous(np.tile(np.identity(2), (src.shape[0], 1, 1)),
+                        (dst - src).mean(axis=1))
+
+
+def _fit_similarity(src, dst, order, rigid=False):
+    # least squares similarity of centered points as complex numbers:
+    #     dst = z * src with z = s * exp(i * theta)
+    a = src - src.mean(axis=1)[:, np.newaxis]
+    b = dst - dst.mean(axis=1)[:, np.newaxis]
+    a = a[..., 0] + 1j * a[..., 1]
+    b = b[..., 0] + 1j * b[..., 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (np.conj(a) * b).sum(axis=1) / (np.abs(a) ** 2).sum(axis=1)
+        if rigid:
+            z = z / np.abs(z)
+    linear = np.stack([np.stack([z.real, -z.imag], axis=-1),
+                       np.stack([z.imag, z.real], axis=-1)], axis=1)
+    translation = dst.mean(axis=1) - np.einsum(
+        'kij,kj->ki', linear, src.mean(axis=1))
+    return _homogeneous(linear, translation)
+
+
+def _fit_rigid(src, dst, order):
+    return _fit_similarity(src, dst, order, rigid=True)
+
+
+def _fit_affine(src, dst, order):
+    return AffineModel.fit_batch(src, dst)
+
+
+def _fit_polynomial(src, dst, order):
+    basis = np.stack([Polynomial2DTransform._monomial_basis(
+        s[:, 0], s[:, 1], order) for s in src])
+    return np.matmul(np.linalg.pinv(basis), dst)
+
+
+def _apply_matrices(M, src, order):
+    return (np.einsum('kij,nj->kni', M[:, :2, :2], src) +
+            M[:, np.newaxis, :2, 2])
+
+
+def _apply_polynomial(params, src, order):
+    basis = Polynomial2DTransform._monomial_basis(src[:, 0], src[:, 1], order)
+    return np.einsum('nt,kti->kni', basis, params)
+
+
+# className: (points per hypothesis given order, batch fit, batch apply)
+_MODELS = {
+    TranslationModel.className: (
+        lambda order: 1, _fit_translation, _apply_matrices),
+    RigidModel.className: (
+        lambda order: 2, _fit_rigid, _apply_matrices),
+    SimilarityModel.className: (
+        lambda order: 2, _fit_similarity, _apply_matrices),
+    AffineModel.className: (
+        lambda order: 3, _fit_affine, _apply_matrices),
+    Polynomial2DTransform.className: (
+        lambda order: (order + 1) * (order + 2) // 2, _fit_polynomial,
+        _apply_polynomial)}
+
+
+def ransac(src, dst, model=AffineModel, max_error=20., min_inliers=None,
+           iterations=1000, batchsize=100, confidence=0.99, order=2,
+           seed=None):
+    '''
+    robustly estimate a transform mapping src to dst
+    input:
+        src -- Nx2 numpy array of source points
+        dst -- Nx2 numpy array of destination points
+    keyword arguments:
+        model -- transform class to estimate: AffineModel (default),
+            TranslationModel, RigidModel, SimilarityModel or
+            Polynomial2DTransform
+        max_error -- maximum distance between a transformed source point
+            and its destination for it to be an inlier (default 20.)
+        min_inliers -- minimum number of inliers of an acceptable model
+            (default the number of points in a hypothesis)
+        iterations -- maximum number of hypotheses (default 1000)
+        batchsize -- number of hypotheses evaluated at once (default 100)
+        confidence -- stop once the probability that a better hypothesis
+            remains unsampled falls below 1 - confidence (default 0.99)
+        order -- order of Polynomial2DTransform models (default 2)
+        seed -- seed for the random sampling of hypotheses
+    returns:
+        tuple of (model instance refit to the inliers,
+                  boolean numpy array marking inliers)
+    raises:
+        EstimationError if no hypothesis, or the model refit to the
+            inliers of the best, has min_inliers inliers
+    '''
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    if src.shape != dst.shape or src.ndim != 2 or src.shape[1] != 2:
+        raise EstimationError(
+            'shape mismatch! src shape: {}, dst shape {}'.format(
+                src.shape, dst.shape))
+    try:
+        nsample, fit_batch, apply_batch = _MODELS[model.className]
+    except (AttributeError, KeyError):
+        raise EstimationError(
+            'RANSAC not implemented for model {}'.format(model))
+    nsample = nsample(order)
+    N = src.shape[0]
+    min_inliers = nsample if min_inliers is None else min_inliers
+    if N < max(nsample, min_inliers):
+        raise EstimationError(
+            '{} points are too few to estimate {}'.format(N, model.className))
+
+    fitsrc = src
+    if model.className == Polynomial2DTransform.className and order >= 3:
+        # fit and evaluate hypotheses on normalized source coordinates,
+        #     as Polynomial2DTransform.fit does, to keep pinv well conditioned
+        offset = src.mean(axis=0)
+        fitsrc = (src - offset) / (np.abs(src - offset).max() or 1.)
+
+    random = np.random.RandomState(seed)
+    best_count, best_error, best_params = -1, np.inf, None
+    needed = iterations
+    tried = 0
+    while tried < min(iterations, needed):
+        K = min(batchsize, iterations - tried)
+        # each row draws nsample distinct points
+        samples = (np.tile(np.arange(N), (K, 1)) if nsample == N else
+                   np.argpartition(random.rand(K, N), nsample,
+                                   axis=1)[:, :nsample])
+        with np.errstate(invalid='ignore', over='ignore'):
+            params = fit_batch(fitsrc[samples], dst[samples], order)
+            errors = np.sqrt(((apply_batch(params, fitsrc, order) - dst) ** 2
+                              ).sum(axis=-1))
+            inliers = errors < max_error
+        counts = inliers.sum(axis=1)
+        inlier_error = np.where(inliers, errors, 0.).sum(axis=1)
+        best = np.lexsort((inlier_error, -counts))[0]
+        if (counts[best] > best_count or (
+                counts[best] == best_count and
+                inlier_error[best] < best_error)):
+            best_count, best_error = counts[best], inlier_error[best]
+            best_params = params[best:best + 1]
+            # probability that a hypothesis is drawn from inliers only
+            p = (float(best_count) / N) ** nsample
+            if p >= 1.:
+                needed = 0
+            elif p > 0.:
+                # log1p keeps small p from rounding the log to zero
+                with np.errstate(divide='ignore'):
+                    needed = int(min(iterations, np.ceil(
+                        np.log(1. - confidence) / np.log1p(-p))))
+        tried += K
+
+    logger.debug('best of {} hypotheses has {} of {} inliers'.format(
+        tried, best_count, N))
+    if best_count < min_inliers:
+        raise EstimationError(
+            'best {} has {} inliers, fewer than {}'.format(
+                model.className, best_count, min_inliers))
+
+    inliers = np.sqrt(((apply_batch(best_params, fitsrc, order)[0] - dst) ** 2
+                       ).sum(axis=-1)) < max_error
+    tform = model()
+    if model.className == Polynomial2DTransform.className:
+        tform.estimate(src[inliers], dst[inliers], order=order,
+                       test_coords=False, return_params=False)
+    else:
+        tform.estimate(src[inliers], dst[inliers], return_params=False)
+    inliers = np.sqrt(((tform.tform(src) - dst) ** 2).sum(axis=1)) < max_error
+    if inliers.sum() < min_inliers:
+        raise EstimationError(
+            '{} refit to the inliers has {} inliers, fewer than {}'.format(
+                model.className, inliers.sum(), min_inliers))
+    return tform, inliers
+
+
+def filter_matches(matches, model=AffineModel, max_error=20.,
+                   min_inliers=None, drop_empty=True, **kwargs):
+    '''
+    remove outlier point matches from render point match dictionaries
+        (as returned by, e.g., pointmatch.get_matches_within_group)
+    input:
+        matches -- list of point match dictionaries
+    keyword arguments:
+        model -- transform class mapping p to q points (default AffineModel)
+        max_error -- maximum distance of an inlier (default 20.)
+        min_inliers -- minimum inliers for a pair to be kept
+            (default the number of points in a hypothesis)
+        drop_empty -- whether to omit pairs without an acceptable model
+            (default True) rather than return them with no matches
+        kwargs -- further keyword arguments to ransac
+    returns:
+        list of point match dictionaries holding only inliers
+    '''
+    filtered = []
+    for match in matches:
+        m = match['matches']
+        p = np.array(m['p'], dtype=np.float64).T.reshape(-1, 2)
+        q = np.array(m['q'], dtype=np.float64).T.reshape(-1, 2)
+        try:
+            tform, inliers = ransac(p, q, model=model, max_error=max_error,
+                                    min_inliers=min_inliers, **kwargs)
+        except EstimationError as e:
+            logger.debug('no model for {} {}: {}'.format(
+                match.get('pId'), match.get('qId'), e))
+            if drop_empty:
+                continue
+            inliers = np.zeros(p.shape[0], dtype=bool)
+        newmatch = copy.copy(match)
+        newmatch['matches'] = {
+            'p': p[inliers].T.tolist(),
+            'q': q[inliers].T.tolist(),
+            'w': np.asarray(m['w'])[inliers].tolist()}
+        filtered.append(newmatch)
+    return filtered
@@ -1,27 +1,119 @@
 #!/usr/bin/env python
+import inspect
 import logging
 import os
 from functools import wraps
 import requests
-from .utils import defaultifNone, NullHandler, fitargspec
+from requests.adapters import HTTPAdapter
+from .utils import defaultifNone, NullHandler, fitargspec, unwrap
 from .errors import ClientScriptError, RenderError
 
 logger = logging.getLogger(__name__)
 logger.addHandler(NullHandler())
 
+# urllib3 default -- raise pool_maxsize to the number of concurrent requests
+DEFAULT_POOL_MAXSIZE = 10
+
+
+class RenderSession(requests.Session):
+    '''
+    requests Session which applies a default timeout to every request
+        that does not specify one
+    '''
+    def __init__(self, timeout=None):
+        super(RenderSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(RenderSession, self).request(*args, **kwargs)
+
+
+def make_session(pool_maxsize=None, timeout=None, keep_alive=True,
+                 max_retries=None):
+    '''
+    build a pooled session for talking to render-ws
+    keyword arguments:
+        pool_maxsize -- int maximum number of connections kept open
+            per host (default DEFAULT_POOL_MAXSIZE)
+        timeout -- float or (connect, read) tuple of seconds applied to
+            requests that do not specify a timeout (default None, no timeout)
+        keep_alive -- boolean whether to reuse connections between requests
+        max_retries -- int number of retries for failed connections
+            (default 0)
+    returns:
+        RenderSession object
+    '''
+    session = RenderSession(timeout=timeout)
+    adapter = HTTPAdapter(
+        pool_maxsize=defaultifNone(pool_maxsize, DEFAULT_POOL_MAXSIZE),
+        max_retries=defaultifNone(max_retries, 0))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+_default_session = {'pid': None, 'session': None}
+
+
+def get_default_session():
+    '''
+    get the pooled session used by render api calls made without
+        a render object or session.  A new session is built
+        the first time this is called in each process, so forked pool
+        workers do not share connections with their parent.
+    '''
+    if _default_session['pid'] != os.getpid():
+        _default_session['session'] = make_session()
+        _default_session['pid'] = os.getpid()
+    return _default_session['session']
+
 
 class Render(object):
     '''
     Render object to store connection settings for render server
+    keyword arguments:
+        host -- string hostname for target render server
+        port -- string, int, or None port for target render server
+        owner -- string owner for render-ws
+        project -- string project for render webservice
+        client_scripts -- string directory path for
+            render-ws-java-client scripts
+        pool_maxsize -- int maximum number of connections kept open to
+            the render server (see make_session)
+        timeout -- default timeout in seconds for requests (see make_session)
+        keep_alive -- boolean whether to reuse connections (see make_session)
+        max_retries -- int number of retries for failed connections
+            (see make_session)
+        cache -- renderapi.cache.ResponseCache through which stack
+            metadata requested with this render object is read
+            (default None, no caching)
+        image_cache -- renderapi.cache.ImageCache through which images
+            rendered with this render object are read
+            (default None, no caching)
     '''
     def __init__(self, host=None, port=None, owner=None, project=None,
-                 client_scripts=None):
+                 client_scripts=None, pool_maxsize=None, timeout=None,
+                 keep_alive=True, max_retries=None, cache=None,
+                 image_cache=None):
         self.DEFAULT_HOST = host
         self.DEFAULT_PORT = port
         self.DEFAULT_PROJECT = project
         self.DEFAULT_OWNER = owner
         self.DEFAULT_CLIENT_SCRIPTS = client_scripts
 
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.max_retries = max_retries
+        self.cache = cache
+        self.image_cache = image_cache
+        self._session = None
+        self._session_pid = None
+
         logger.debug('Render object created with '
                      'host={h}, port={p}, project={pr}, '
                      'owner={o}, scripts={s}'.format(
@@ -29,6 +121,28 @@ class Render(object):
                           pr=self.DEFAULT_PROJECT, o=self.DEFAULT_OWNER,
                           s=self.DEFAULT_CLIENT_SCRIPTS))
 
+    @property
+    def session(self):
+        '''
+        pooled requests session owned by this render object.  Injected by
+            renderaccess into calls that do not specify a session.
+            Rebuilt on first access in a new process, so forked
+            pool workers get their own connections.
+        '''
+        if self._session is None or self._session_pid != os.getpid():
+            self._session = make_session(
+                pool_maxsize=self.pool_maxsize, timeout=self.timeout,
+                keep_alive=self.keep_alive, max_retries=self.max_retries)
+            self._session_pid = os.getpid()
+        return self._session
+
+    def __getstate__(self):
+        # sessions hold open sockets -- workers build their own
+        d = self.__dict__.copy()
+        d['_session'] = None
+        d['_session_pid'] = None
+        return d
+
     @property
     def DEFAULT_KWARGS(self):
         '''
@@ -103,7 +217,9 @@ class RenderClient(Render):
 
 def connect(host=None, port=None, owner=None, project=None,
             client_scripts=None, client_script=None, memGB=None,
-            force_http=True, validate_client=True, web_only=False, **kwargs):
+            force_http=True, validate_client=True, web_only=False,
+            pool_maxsize=None, timeout=None, keep_alive=True,
+            max_retries=None, cache=None, image_cache=None, **kwargs):
     '''
     helper function to connect to a render instance
         can default to using environment variables if not specified in call.
@@ -133,6 +249,14 @@ def connect(host=None, port=None, owner=None, project=None,
             validate existence of RenderClient run_ws_client.sh script
         web_only -- boolean whether to check environment variables/prompt user
             for client_scripts directory if not in arguments
+        pool_maxsize -- int maximum number of connections the render
+            object keeps open to the server, set this to at least the
+            number of threads issuing requests concurrently
+        timeout -- default timeout in seconds for requests
+        keep_alive -- boolean whether to reuse connections between requests
+        max_retries -- int number of retries for failed connections
+        cache -- renderapi.cache.ResponseCache for stack metadata
+        image_cache -- renderapi.cache.ImageCache for rendered images
     returns:
         RenderClient or Render object
     '''
@@ -200,37 +324,51 @@ def connect(host=None, port=None, owner=None, project=None,
         else:
             memGB = str(os.environ['RENDER_CLIENT_HEAP'])
 
+    session_kwargs = {'pool_maxsize': pool_maxsize, 'timeout': timeout,
+                      'keep_alive': keep_alive, 'max_retries': max_retries,
+                      'cache': cache, 'image_cache': image_cache}
     try:
         return RenderClient(client_script=client_script, memGB=memGB,
                             host=host, port=port,
                             owner=owner, project=project,
                             client_scripts=client_scripts,
-                            validate_client=validate_client)
+                            validate_client=validate_client,
+                            **session_kwargs)
     except ClientScriptError as e:
         logger.info(e)
         logger.warning(
             'Could not initiate render Client -- falling back to web')
         return Render(host=host, port=port, owner=owner, project=project,
-                      client_scripts=client_scripts)
+                      client_scripts=client_scripts, **session_kwargs)
 
 
 def renderaccess(f):
     '''
     decorator allowing functions asking for host, port, owner, project
-        to default to a connection defined by a render object kwarg
+        to default to a connection defined by a render object kwarg.
+        Functions taking a session keyword get the render object's pooled
+        session (or the process-wide default session if there is no
+        render object) unless one is passed explicitly.
     '''
+    takes_session = 'session' in inspect.getargspec(unwrap(f))[0]
+
     @wraps(f)
     def wrapper(*args, **kwargs):
         args, kwargs = fitargspec(f, args, kwargs)
         render = kwargs.get('render')
         if render is not None:
             if isinstance(render, Render):
-                return f(*args, **render.make_kwargs(**kwargs))
+                kwargs = render.make_kwargs(**kwargs)
+                if takes_session and kwargs.get('session') is None:
+                    kwargs['session'] = render.session
+                return f(*args, **kwargs)
             else:
                 raise ValueError(
                     'invalid Render object type {} specified!'.format(
                         type(render)))
         else:
+            if takes_session and kwargs.get('session') is None:
+                kwargs['session'] = get_default_session()
             return f(*args, **kwargs)
     return wrapper
 
@@ -253,7 +391,7 @@ def format_preamble(host, port, owner, project, stack):
 
 
 @renderaccess
-def get_owners(host=None, port=None, session=requests.session(),
+def get_owners(host=None, port=None, session=None,
                render=None, **kwargs):
     '''
     return list of owners across all Projects and Stacks for a render server
@@ -270,7 +408,7 @@ def get_owners(host=None, port=None, session=requests.session(),
 
 @renderaccess
 def get_stack_metadata_by_owner(owner=None, host=None, port=None,
-                                session=requests.session(),
+                                session=None,
                                 render=None, **kwargs):
     '''
     return metadata for all stacks belonging to particular
@@ -291,7 +429,7 @@ def get_stack_metadata_by_owner(owner=None, host=None, port=None,
 
 @renderaccess
 def get_projects_by_owner(owner=None, host=None, port=None,
-                          session=requests.session(), render=None, **kwargs):
+                          session=None, render=None, **kwargs):
     '''return list of projects belonging to a single owner for render stack'''
     metadata = get_stack_metadata_by_owner(owner=owner, host=host,
                                            port=port, session=session)
@@ -301,7 +439,7 @@ def get_projects_by_owner(owner=None, host=None, port=None,
 
 @renderaccess
 def get_stacks_by_owner_project(owner=None, project=None, host=None,
-                                port=None, session=requests.session(),
+                                port=None, session=None,
                                 render=None, **kwargs):
     '''
     return list of stacks belonging to an owner's project on render server
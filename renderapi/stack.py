@@ -1,11 +1,14 @@
 #!/usr/bin/env python
+import copy
+import inspect
 import logging
+from functools import wraps
 from time import strftime
-import requests
 from .errors import RenderError
 from .utils import jbool, NullHandler, post_json, put_json
 from .render import (format_baseurl, format_preamble,
                      renderaccess)
+from .cache import IMMUTABLE_STACK_STATES
 import json
 
 logger = logging.getLogger(__name__)
@@ -79,9 +82,86 @@ class StackVersion:
         self.__dict__.update({k: v for k, v in d.items()})
 
 
+def cachedmetadata(f):
+    '''
+    decorator reading stack metadata calls through the ResponseCache of
+        the render object used for the call (see renderapi.cache).
+        Apply beneath renderaccess.  Responses are cached per stack,
+        function and required arguments, and never expire while the stack
+        is COMPLETE or READ_ONLY and keeps its creation and last
+        modification timestamps.
+    '''
+    argspec = inspect.getargspec(f)
+    required = argspec.args[:len(argspec.args) - len(argspec.defaults)]
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        cache = getattr(kwargs.get('render'), 'cache', None)
+        if cache is None:
+            return f(*args, **kwargs)
+        callargs = inspect.getcallargs(f, *args, **kwargs)
+        stackkey = tuple(callargs[k] for k in [
+            'host', 'port', 'owner', 'project', 'stack'])
+        key = (f.__name__, ) + tuple(
+            callargs[k] for k in required if k != 'stack')
+        immutable, version = _stack_status(
+            cache, *stackkey, session=callargs['session'])
+        found, value = cache.get(stackkey, key, version=version)
+        if not found:
+            value = f(*args, **kwargs)
+            cache.set(stackkey, key, value, immutable=immutable,
+                      version=version)
+        return copy.deepcopy(value)
+    wrapper.__wrapped__ = f
+    return wrapper
+
+
+def _stack_status(cache, host, port, owner, project, stack, session=None):
+    '''
+    check whether a stack is in an immutable state and get its version
+        ([createTimestamp, lastModifiedTimestamp]), caching them until the
+        cache ttl expires
+    '''
+    key = ('get_stack_status', )
+    found, status = cache.get((host, port, owner, project, stack), key)
+    if not found:
+        request_url = format_preamble(host, port, owner, project, stack)
+        logger.debug(request_url)
+        r = session.get(request_url)
+        try:
+            d = r.json()
+            status = [d['state'] in IMMUTABLE_STACK_STATES, [
+                d.get('currentVersion', {}).get('createTimestamp'),
+                d.get('lastModifiedTimestamp')]]
+        except Exception as e:
+            logger.error(e)
+            logger.error(r.text)
+            raise RenderError(r.text)
+        cache.set((host, port, owner, project, stack), key, status)
+    return status
+
+
+def invalidate_stack_cache(stack, host=None, port=None, owner=None,
+                           project=None, render=None):
+    '''
+    drop cached responses (and images) for a stack from the caches of a
+        render object.  Called by api functions which change a stack.
+    input:
+        stack -- stack whose responses to drop
+    keyword arguments:
+        host, port, owner, project -- fully specified stack location
+            (as passed through renderaccess)
+        render -- render connect object which may hold caches
+    '''
+    for attr in ['cache', 'image_cache']:
+        cache = getattr(render, attr, None)
+        if cache is not None:
+            cache.invalidate((host, port, owner, project, stack))
+
+
 @renderaccess
 def set_stack_metadata(stack, sv, host=None, port=None, owner=None,
-                       project=None, session=requests.session(),
+                       project=None, session=None,
                        render=None, **kwargs):
     ''' set_stack_metadata
     inputs:
@@ -89,22 +169,24 @@ def set_stack_metadata(stack, sv, host=None, port=None, owner=None,
         sv -- StackVersion to set the metadata to
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- requests.session (default start a new one)
+        session -- requests.session (default pooled session)
     '''
     request_url = format_preamble(host, port, owner, project, stack)
     logger.debug(request_url)
-    return post_json(session, request_url, sv.to_dict())
+    r = post_json(session, request_url, sv.to_dict())
+    invalidate_stack_cache(stack, host, port, owner, project, render)
+    return r
 
 
 @renderaccess
 def get_stack_metadata(stack, host=None, port=None, owner=None, project=None,
-                       session=requests.session(), render=None, **kwargs):
+                       session=None, render=None, **kwargs):
     ''' get_stack_metadata
     inputs:
         stack -- render stack to get metadata from
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- requests.session (default start a new one)
+        session -- requests.session (default pooled session)
     outputs:
         StackVersion object of the metadata of the stack
     raises: RenderError
@@ -123,10 +205,35 @@ def get_stack_metadata(stack, host=None, port=None, owner=None, project=None,
         raise RenderError(r.text)
 
 
+@renderaccess
+def get_stack_state(stack, host=None, port=None, owner=None, project=None,
+                    session=None, render=None, **kwargs):
+    ''' get_stack_state
+    inputs:
+        stack -- render stack to get the state of
+    keyword arguments:
+        render -- render connect object (or host, port, owner, project)
+        session -- requests.session (default pooled session)
+    outputs:
+        string state of the stack (LOADING, COMPLETE, OFFLINE or READ_ONLY)
+    raises: RenderError
+    '''
+    request_url = format_preamble(host, port, owner, project, stack)
+
+    logger.debug(request_url)
+    r = session.get(request_url)
+    try:
+        return r.json()['state']
+    except Exception as e:
+        logger.error(e)
+        logger.error(r.text)
+        raise RenderError(r.text)
+
+
 @renderaccess
 def set_stack_state(stack, state='LOADING', host=None, port=None,
                     owner=None, project=None,
-                    session=requests.session(), render=None, **kwargs):
+                    session=None, render=None, **kwargs):
     '''
     set state of selected stack.  Acceptable states are listed below:
         LOADING: stack is accepting additional information.
@@ -139,7 +246,7 @@ def set_stack_state(stack, state='LOADING', host=None, port=None,
         --state: state to qset the stack
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- requests.session (default start a new one)
+        session -- requests.session (default pooled session)
     outputs:
         session.response object
     raises:
@@ -153,6 +260,7 @@ def set_stack_state(stack, state='LOADING', host=None, port=None,
     logger.debug(request_url)
     r = session.put(request_url, data=None,
                     headers={"content-type": "application/json"})
+    invalidate_stack_cache(stack, host, port, owner, project, render)
     if (r.status_code != 201):
         logger.error(r.text)
         raise RenderError(r.text)
@@ -161,11 +269,11 @@ def set_stack_state(stack, state='LOADING', host=None, port=None,
 
 @renderaccess
 def likelyUniqueId(host=None, port=None,
-                   session=requests.session(), render=None, **kwargs):
+                   session=None, render=None, **kwargs):
     '''return hex-code nearly-unique id from render server
       keyword arguments:
         render -- render connect object (or host, port)
-        session -- requests.session (default start a new one)
+        session -- requests.session (default pooled session)
      returns:
         string representation of hex-code
     '''
@@ -189,26 +297,27 @@ def make_stack_params(host, port, owner, project, stack):
 
 @renderaccess
 def delete_stack(stack, host=None, port=None, owner=None,
-                 project=None, session=requests.session(),
+                 project=None, session=None,
                  render=None, **kwargs):
     '''deletes a stack from render
     inputs:
         stack -- render stack to delete
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- requests.session (default start a new one)
+        session -- requests.session (default pooled session)
     outputs:
         r -- response object of response from server
     '''
     request_url = format_preamble(host, port, owner, project, stack)
     r = session.delete(request_url)
+    invalidate_stack_cache(stack, host, port, owner, project, render)
     logger.debug(r.text)
     return r
 
 
 @renderaccess
 def delete_section(stack, z, host=None, port=None, owner=None,
-                   project=None, session=requests.session(),
+                   project=None, session=None,
                    render=None, **kwargs):
     '''removes a single z from a stack
     inputs:
@@ -216,20 +325,21 @@ def delete_section(stack, z, host=None, port=None, owner=None,
         z -- z value to remove
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- requests.session (default start a new one)
+        session -- requests.session (default pooled session)
     outputs:
         r -- response object from server
     '''
     request_url = '{}/z/{}'.format(
         format_preamble(host, port, owner, project, stack), z)
     r = session.delete(request_url)
+    invalidate_stack_cache(stack, host, port, owner, project, render)
     logger.debug(r.text)
     return r
 
 
 @renderaccess
 def delete_tile(stack, tileId, host=None, port=None, owner=None,
-                project=None, session=requests.session(),
+                project=None, session=None,
                 render=None, **kwargs):
     '''
     removes a tile from a stack
@@ -242,6 +352,7 @@ def delete_tile(stack, tileId, host=None, port=None, owner=None,
     request_url = '{}/tile/{}'.format(
         format_preamble(host, port, owner, project, stack), tileId)
     r = session.delete(request_url)
+    invalidate_stack_cache(stack, host, port, owner, project, render)
     logger.debug(r.text)
     return r
 
@@ -251,7 +362,7 @@ def create_stack(stack, cycleNumber=None, cycleStepNumber=None,
                  stackResolutionX=None, stackResolutionY=None,
                  stackResolutionZ=None, force_resolution=True,
                  host=None, port=None, owner=None, project=None,
-                 session=requests.session(), render=None, **kwargs):
+                 session=None, render=None, **kwargs):
     '''creates a new stack
     inputs:
         stack -- stack name to create
@@ -264,7 +375,7 @@ def create_stack(stack, cycleNumber=None, cycleStepNumber=None,
         force_resolution -- fill in resolution of 1.0 for missing
             resolutions (default True)
         render -- render connect object (or host, port, owner, project)
-        session -- requests.session (default start a new one)
+        session -- requests.session (default pooled session)
     returns:
         r -- reponse object from server
     raises:
@@ -284,6 +395,7 @@ def create_stack(stack, cycleNumber=None, cycleStepNumber=None,
     request_url = format_preamble(host, port, owner, project, stack)
     logger.debug("stack version {} {}".format(request_url, sv.to_dict()))
     r = post_json(session, request_url, sv.to_dict())
+    invalidate_stack_cache(stack, host, port, owner, project, render)
     try:
         return r
     except Exception as e:
@@ -308,11 +420,10 @@ def clone_stack(inputstack, outputstack, skipTransforms=False, toProject=None,
         zs -- optional, list of selected z values to clone into stack
         close_stack -- boolean, whether to set stack to COMPLETE when finished
         render -- render connect object (or host, port, owner, project)
-        session -- optional, requests.session (default start a new one)
+        session -- optional, requests.session (default pooled session)
     outputs:
         r -- reponse object from server
     '''
-    session = requests.session() if session is None else session
     sv = StackVersion(**kwargs)
     newstack_project = project
     qparams = {}
@@ -329,23 +440,26 @@ def clone_stack(inputstack, outputstack, skipTransforms=False, toProject=None,
 
     logger.debug(request_url)
     r = put_json(session, request_url, sv.to_dict(), params=qparams)
+    invalidate_stack_cache(outputstack, host, port, owner,
+                           newstack_project, render)
 
     if close_stack:
         set_stack_state(outputstack, 'COMPLETE', host, port, owner,
-                        newstack_project)
+                        newstack_project, render=render)
     return r
 
 
 @renderaccess
+@cachedmetadata
 def get_z_values_for_stack(stack, project=None, host=None, port=None,
-                           owner=None, session=requests.session(),
+                           owner=None, session=None,
                            render=None, **kwargs):
     '''get a list of z values for which there are tiles in the stack
     inputs:
         stack -- stack to get z values for
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- optional, requests.session (default start a new one)
+        session -- optional, requests.session (default pooled session)
     returns:
         list of z values
     raises:
@@ -371,7 +485,7 @@ def get_z_value_for_section(stack, sectionId, **kwargs):
         sectionId -- string of sectionId to find z value
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- optional, requests.session (default start a new one)
+        session -- optional, requests.session (default pooled session)
     returns:
         list of z values
     raises:
@@ -381,20 +495,42 @@ def get_z_value_for_section(stack, sectionId, **kwargs):
     return get_section_z_value(stack, sectionId, **kwargs)
 
 
-# haven't fully supported this yet
-# @renderaccess
-# def put_resolved_tilespecs(stack, json_dict, host=None, port=None,
-#                            owner=None, project=None,
-#                            session=requests.session(), render=None, **kwargs):
-#     request_url = format_preamble(
-#         host, port, owner, project, stack) + "/resolvedTiles"
-#     r = post_json(session, request_url, json_dict)
-#     return r
+@renderaccess
+def put_resolved_tilespecs(stack, resolved, host=None, port=None,
+                           owner=None, project=None,
+                           session=None, render=None, **kwargs):
+    '''
+    save tilespecs and the shared transforms they reference to a stack
+        in a single request
+    input:
+        stack -- stack to save to (should be in LOADING state)
+        resolved -- tilespec.ResolvedTileSpecCollection (or
+            ResolvedTileSpecMap), or a dictionary with tileIdToSpecMap and
+            transformIdToSpecMap
+    keyword arguments:
+        render -- render connect object (or host, port, owner, project)
+        session -- requests.session (default pooled session)
+    returns:
+        response object from server
+    raises:
+        RenderError if the server rejects the tilespecs
+    '''
+    request_url = format_preamble(
+        host, port, owner, project, stack) + "/resolvedTiles"
+    json_dict = (resolved.to_map_dict() if hasattr(resolved, 'to_map_dict')
+                 else resolved)
+    r = put_json(session, request_url, json_dict)
+    invalidate_stack_cache(stack, host, port, owner, project, render)
+    if r.status_code >= 400:
+        logger.error(r.text)
+        raise RenderError(r.text)
+    return r
 
 
 @renderaccess
+@cachedmetadata
 def get_bounds_from_z(stack, z, host=None, port=None, owner=None,
-                      project=None, session=requests.session(),
+                      project=None, session=None,
                       render=None, **kwargs):
     '''get a bounds dictionary for a specific z
     inputs:
@@ -402,7 +538,7 @@ def get_bounds_from_z(stack, z, host=None, port=None, owner=None,
         z -- z values (float) to get bounds from
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- optional, requests.session (default start a new one)
+        session -- optional, requests.session (default pooled session)
     outputs:
         dictionary of bounds with keys minY,minY,maxX,maxY
     '''
@@ -419,14 +555,15 @@ def get_bounds_from_z(stack, z, host=None, port=None, owner=None,
 
 
 @renderaccess
+@cachedmetadata
 def get_stack_bounds(stack, host=None, port=None, owner=None, project=None,
-                     session=requests.session(), render=None, **kwargs):
+                     session=None, render=None, **kwargs):
     '''get bounds of a whole stack
     inputs:
         stack -- stack to get bounds from
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- optional, requests.session (default start a new one)
+        session -- optional, requests.session (default pooled session)
     outputs:
         dictionary of bounds with keys minY,minY,maxX,maxY,minZ,maxZ
     raises:
@@ -445,7 +582,7 @@ def get_stack_bounds(stack, host=None, port=None, owner=None, project=None,
 
 @renderaccess
 def get_sectionId_for_z(stack, z, host=None, port=None, owner=None,
-                        project=None, session=requests.session(),
+                        project=None, session=None,
                         render=None, **kwargs):
     '''returns the sectionId associated with a particular z value
     inputs:
@@ -456,7 +593,8 @@ def get_sectionId_for_z(stack, z, host=None, port=None, owner=None,
     returns:
         z values that have that has sectionId
     '''
-    sectionData=get_stack_sectionData(stack,host,port,owner,project,session)
+    sectionData=get_stack_sectionData(stack,host,port,owner,project,session,
+                                      render=render)
     try:
         return next(sd['sectionId'] for sd in sectionData if sd['z']==z)
     except:
@@ -464,15 +602,16 @@ def get_sectionId_for_z(stack, z, host=None, port=None, owner=None,
         
     
 @renderaccess
+@cachedmetadata
 def get_stack_sectionData(stack, host=None, port=None, owner=None,
-                          project=None, session=requests.session(),
+                          project=None, session=None,
                           render=None, **kwargs):
     '''returns information about the sectionIds of each slice in stack
     inputs:
         stack -- name of stack to get data about
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- optional, requests.session (default start a new one)
+        session -- optional, requests.session (default pooled session)
     returns:
         list of dictionaries containing sectionData as below
         [{
@@ -499,8 +638,9 @@ def get_stack_sectionData(stack, host=None, port=None, owner=None,
 
 
 @renderaccess
+@cachedmetadata
 def get_section_z_value(stack, sectionId, host=None, port=None,
-                        owner=None, project=None, session=requests.session(),
+                        owner=None, project=None, session=None,
                         render=None, **kwargs):
     '''get the z value for a specific sectionId (string)
     inputs:
@@ -508,7 +648,7 @@ def get_section_z_value(stack, sectionId, host=None, port=None,
         sectionId -- string of sectionId to find z value
     keyword arguments:
         render -- render connect object (or host, port, owner, project)
-        session -- optional, requests.session (default start a new one)
+        session -- optional, requests.session (default pooled session)
     returns:
         list of z values
     raises:
@@ -526,8 +666,9 @@ def get_section_z_value(stack, sectionId, host=None, port=None,
 
 
 @renderaccess
+@cachedmetadata
 def get_stack_tileIds(stack, host=None, port=None, owner=None, project=None,
-                      session=requests.session(), render=None, **kwargs):
+                      session=None, render=None, **kwargs):
     '''get tileIds for a stack'''
     request_url = '{}/tileIds'.format(
         format_preamble(host, port, owner, project, stack))
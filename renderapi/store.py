@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+'''
+local on-disk mirror of the tilespecs of a render stack
+'''
+import json
+import logging
+import sqlite3
+from .render import format_preamble, renderaccess
+from .stack import StackVersion, get_z_values_for_stack
+from .tilespec import TileSpec, _get_tile_spec_jsons_from_z
+from .cache import IMMUTABLE_STACK_STATES
+from .errors import RenderError, StaleDataError
+from .utils import NullHandler, imap_bounded
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+
+class TileSpecStore(object):
+    '''
+    sqlite database holding the tilespec json of a single stack,
+        keyed by tileId and z.  Use mirror_stack to fill a store from render
+        and open_store to reopen one after checking that it still matches
+        the stack on the server.
+    init:
+        path -- path of the sqlite database file (created if missing)
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS metadata '
+                '(key TEXT PRIMARY KEY, value TEXT)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS tilespecs '
+                '(tileId TEXT PRIMARY KEY, z REAL, json TEXT)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS tilespecs_z ON tilespecs (z)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS zvalues (z REAL PRIMARY KEY)')
+
+    def _get_metadata(self, key):
+        row = self.connection.execute(
+            'SELECT value FROM metadata WHERE key = ?', (key, )).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    @property
+    def stackId(self):
+        '''dictionary of host, port, owner, project and stack mirrored'''
+        return self._get_metadata('stackId')
+
+    @property
+    def stackVersion(self):
+        '''dictionary of the StackVersion of the mirrored stack'''
+        return self._get_metadata('stackVersion')
+
+    @property
+    def lastModifiedTimestamp(self):
+        '''lastModifiedTimestamp of the mirrored stack'''
+        return self._get_metadata('lastModifiedTimestamp')
+
+    def reset(self, stackId, stackVersion, lastModifiedTimestamp=None):
+        '''
+        remove all tilespecs and record the stack they will be mirrored from
+        input:
+            stackId -- dictionary of host, port, owner, project and stack
+            stackVersion -- StackVersion dictionary of the stack
+        keyword arguments:
+            lastModifiedTimestamp -- lastModifiedTimestamp of the stack
+                (default None)
+        '''
+        with self.connection:
+            self.connection.execute('DELETE FROM tilespecs')
+            self.connection.execute('DELETE FROM zvalues')
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?)', [
+                    ('stackId', json.dumps(stackId)),
+                    ('stackVersion', json.dumps(stackVersion)),
+                    ('lastModifiedTimestamp',
+                     json.dumps(lastModifiedTimestamp))])
+
+    def matches(self, stackId, stackVersion, lastModifiedTimestamp=None):
+        '''
+        check whether this store mirrors a given stack version, that is
+            whether the stack has neither been recreated nor modified
+            since it was mirrored
+        input:
+            stackId -- dictionary of host, port, owner, project and stack
+            stackVersion -- StackVersion dictionary of the stack
+        keyword arguments:
+            lastModifiedTimestamp -- lastModifiedTimestamp of the stack
+                (default None)
+        returns:
+            boolean
+        '''
+        version = self.stackVersion
+        return (self.stackId == stackId and version is not None and
+                version.get('createTimestamp') ==
+                stackVersion.get('createTimestamp') and
+                self.lastModifiedTimestamp == lastModifiedTimestamp)
+
+    def put_z(self, z, tilespec_jsons):
+        '''
+        store the tilespecs of a z layer, replacing any stored for that z
+        input:
+            z -- z value of the layer
+            tilespec_jsons -- list of tilespec dictionaries
+        '''
+        with self.connection:
+            self.connection.execute('DELETE FROM tilespecs WHERE z = ?', (z, ))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO tilespecs VALUES (?, ?, ?)',
+                [(d['tileId'], z, json.dumps(d)) for d in tilespec_jsons])
+            self.connection.execute(
+                'INSERT OR REPLACE INTO zvalues VALUES (?)', (z, ))
+
+    def get_z_values(self):
+        '''returns sorted list of z values stored'''
+        return [row[0] for row in self.connection.execute(
+            'SELECT z FROM zvalues ORDER BY z')]
+
+    def get_tile_specs_from_z(self, z, lazy=False):
+        '''
+        input:
+            z -- z value of layer
+        keyword arguments:
+            lazy -- parse layouts, mipmapLevels and transforms only when
+                accessed (default False, see TileSpec)
+        returns:
+            list of TileSpec objects at that z
+        '''
+        return [TileSpec(json=json.loads(row[0]), lazy=lazy)
+                for row in self.connection.execute(
+                    'SELECT json FROM tilespecs WHERE z = ? ORDER BY tileId',
+                    (z, ))]
+
+    def get_tile_spec(self, tileId):
+        '''
+        input:
+            tileId -- tileId of tilespec
+        returns:
+            TileSpec object
+        raises:
+            RenderError if the tile is not in the store
+        '''
+        row = self.connection.execute(
+            'SELECT json FROM tilespecs WHERE tileId = ?',
+            (tileId, )).fetchone()
+        if row is None:
+            raise RenderError('tile {} not in store {}'.format(
+                tileId, self.path))
+        return TileSpec(json=json.loads(row[0]))
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM tilespecs').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def _get_stack_version(stack, host, port, owner, project, session):
+    '''
+    check stack is immutable and return its id and version dictionaries
+        and lastModifiedTimestamp
+    '''
+    request_url = format_preamble(host, port, owner, project, stack)
+    logger.debug(request_url)
+    r = session.get(request_url)
+    try:
+        d = r.json()
+        state = d['state']
+        sv = StackVersion()
+        sv.from_dict(d['currentVersion'])
+    except Exception as e:
+        logger.error(e)
+        logger.error(r.text)
+        raise RenderError(r.text)
+    if state not in IMMUTABLE_STACK_STATES:
+        raise StaleDataError(
+            'stack {} is {} -- only stacks in states {} can be '
+            'stored locally'.format(stack, state, IMMUTABLE_STACK_STATES))
+    stackId = {'host': host, 'port': port, 'owner': owner,
+               'project': project, 'stack': stack}
+    return stackId, sv.to_dict(), d.get('lastModifiedTimestamp')
+
+
+@renderaccess
+def mirror_stack(stack, path, zValues=None, poolsize=None, host=None,
+                 port=None, owner=None, project=None, session=None,
+                 render=None, **kwargs):
+    '''
+    copy the tilespecs of a COMPLETE or READ_ONLY stack into a local store.
+        Layers already mirrored from the same stack version are skipped,
+        so an interrupted mirror can be resumed.  A store holding another
+        stack or version is emptied first.
+    input:
+        stack -- render stack to mirror
+        path -- path of sqlite database file
+    keyword arguments:
+        zValues -- list of z values to mirror (default all in stack)
+        poolsize -- number of layers to fetch concurrently (default 10)
+        render -- render connect object (or host, port, owner, project)
+        session -- requests.session (default pooled session)
+    returns:
+        TileSpecStore
+    raises:
+        StaleDataError if the stack is not COMPLETE or READ_ONLY
+    '''
+    stackId, stackVersion, lastModified = _get_stack_version(
+        stack, host, port, owner, project, session)
+    store = TileSpecStore(path)
+    if not store.matches(stackId, stackVersion, lastModified):
+        store.reset(stackId, stackVersion, lastModified)
+
+    if zValues is None:
+        zValues = get_z_values_for_stack(stack, host=host, port=port,
+                                         owner=owner, project=project,
+                                         session=session)
+    stored = set(store.get_z_values())
+    missing = [z for z in zValues if z not in stored]
+    logger.debug('mirroring {} of {} z values of {}'.format(
+        len(missing), len(zValues), stack))
+
+    def get_layer(z):
+        return _get_tile_spec_jsons_from_z(
+            stack, z, host, port, owner, project, session)
+
+    for z, tilespec_jsons in imap_bounded(get_layer, missing,
+                                          poolsize=poolsize, ordered=False):
+        store.put_z(z, tilespec_jsons)
+    return store
+
+
+@renderaccess
+def open_store(stack, path, host=None, port=None, owner=None, project=None,
+               session=None, render=None, **kwargs):
+    '''
+    open a local store after checking that it mirrors the current version
+        of a stack
+    input:
+        stack -- render stack mirrored in the store
+        path -- path of sqlite database file
+    keyword arguments:
+        render -- render connect object (or host, port, owner, project)
+        session -- requests.session (default pooled session)
+    returns:
+        TileSpecStore
+    raises:
+        StaleDataError if the stack is no longer COMPLETE or READ_ONLY or
+            its createTimestamp or lastModifiedTimestamp differs from the
+            one stored
+    '''
+    stackId, stackVersion, lastModified = _get_stack_version(
+        stack, host, port, owner, project, session)
+    store = TileSpecStore(path)
+    if not store.matches(stackId, stackVersion, lastModified):
+        store.close()
+        raise StaleDataError(
+            'store {} does not hold version {} (modified {}) of stack '
+            '{}'.format(path, stackVersion.get('createTimestamp'),
+                        lastModified, stack))
+    return store
@@ -1,18 +1,21 @@
 #!/usr/bin/env python
 from .render import format_preamble, renderaccess
-from .utils import NullHandler
+from .utils import NullHandler, SlotsPickleMixin, imap_bounded
 from .stack import get_z_values_for_stack
-from .transform import TransformList
+from .transform import TransformList, TransformLibrary, ReferenceTransform
 from .errors import RenderError
 from collections import OrderedDict
+import copy
+import hashlib
+import json
 import logging
-import requests
+import numpy as np
 
 logger = logging.getLogger(__name__)
 logger.addHandler(NullHandler())
 
 
-class Layout:
+class Layout(SlotsPickleMixin):
     '''Layout class to describe acquisition settings
     inputs:
     keyword arguments
@@ -29,6 +32,9 @@ class Layout:
         at the magnification it was taken
     --force_pixelsize: whether to default pixelsize to 0.1 (default True)
     '''
+    __slots__ = ('sectionId', 'scopeId', 'cameraId', 'imageRow', 'imageCol',
+                 'stageX', 'stageY', 'rotation', 'pixelsize')
+
     def __init__(self, sectionId=None, scopeId=None, cameraId=None,
                  imageRow=None, imageCol=None, stageX=None, stageY=None,
                  rotation=None, pixelsize=None,
@@ -81,7 +87,55 @@ class Layout:
             self.pixelsize = d.get('pixelsize')
 
 
-class TileSpec:
+def _load_layout(d):
+    layout = Layout()
+    layout.from_dict(d.get('layout', None))
+    return layout
+
+
+def _load_image_pyramid(d):
+    return ImagePyramid(mipMapLevels=[
+         MipMapLevel(
+             int(l), imageUrl=v.get('imageUrl'), maskUrl=v.get('maskUrl'))
+         for l, v in d['mipmapLevels'].items()])
+
+
+def _load_tforms(d):
+    return TransformList(json=d['transforms']).tforms
+
+
+def _copy_json(d):
+    '''copy of a json compatible structure of dicts, lists and scalars'''
+    if isinstance(d, dict):
+        return {k: _copy_json(v) for k, v in d.items()}
+    elif isinstance(d, list):
+        return [_copy_json(v) for v in d]
+    return d
+
+
+def _lazy_field(name, load):
+    '''
+    property for a TileSpec field which, for lazily loaded tilespecs,
+        is parsed from the retained json dictionary on first access
+    '''
+    private = '_' + name
+
+    def fget(self):
+        # the value may be modified in place once handed out
+        self._unchanged = False
+        try:
+            return getattr(self, private)
+        except AttributeError:
+            value = load(self._json)
+            setattr(self, private, value)
+            return value
+
+    def fset(self, value):
+        setattr(self, private, value)
+    return property(fget, fset)
+
+
+class TileSpec(SlotsPickleMixin):
     '''Fundamental class of render that store image tiles and their transformations
     init:
     Keyword arguments:
@@ -114,14 +168,31 @@ class TileSpec:
     --mipMapLevels: a list of MipMapLevel objects for this tile
     --json: a json dictionary to initialize this object with
         (if not None overrides and ignores all keyword arguments)
+    --lazy: when initializing from json, keep the dictionary and parse
+        layout, ip (mipmapLevels) and tforms only when first accessed
+        (default False).  The dictionary is copied, so that changing it
+        does not change the tile.  to_dict then returns a copy of the
+        original dictionary as long as no attribute has been set and
+        none of those fields have been accessed.
     '''
+    __slots__ = ('tileId', 'z', 'width', 'height', 'minint', 'maxint',
+                 'frameId', '_layout', '_tforms', 'inputfilters', '_ip',
+                 'imageUrl', 'maskUrl', 'scale1Url', 'scale2Url', 'scale3Url',
+                 'minX', 'maxX', 'minY', 'maxY', '_json', '_unchanged',
+                 '_tformlist')
+
+    layout = _lazy_field('layout', _load_layout)
+    ip = _lazy_field('ip', _load_image_pyramid)
+    tforms = _lazy_field('tforms', _load_tforms)
+
     def __init__(self, tileId=None, z=None, width=None, height=None,
                  imageUrl=None, maskUrl=None,
                  minint=0, maxint=65535, layout=None, tforms=[],
                  inputfilters=[], scale3Url=None, scale2Url=None,
-                 scale1Url=None, json=None, mipMapLevels=[], **kwargs):
+                 scale1Url=None, json=None, mipMapLevels=[], lazy=False,
+                 **kwargs):
         if json is not None:
-            self.from_dict(json)
+            self.from_dict(json, lazy=lazy)
         else:
             self.tileId = tileId
             self.z = z
@@ -161,10 +232,35 @@ class TileSpec:
                 'undefined bounding box for tile {}'.format(self.tileId))
         return box
 
+    def approximate_tforms(self, shape=(32, 32), method='piecewise_affine'):
+        '''
+        mesh approximating the transforms of this tile over its width x
+            height, cached with the tile until its transforms change
+            (see TransformList.approximate and transform.TransformMesh)
+        keyword arguments:
+            shape -- (rows, columns) of mesh cells (default (32, 32))
+            method -- 'piecewise_affine' (default) or 'bilinear'
+        returns:
+            TransformMesh with tform method and max_error attribute
+        '''
+        tformlist = getattr(self, '_tformlist', None)
+        if tformlist is None or tformlist.tforms is not self.tforms:
+            tformlist = TransformList(tforms=self.tforms)
+            self._tformlist = tformlist
+        return tformlist.approximate(
+            self.width, self.height, shape=shape, method=method)
+
+    def __setattr__(self, name, value):
+        if not name.startswith('_'):
+            object.__setattr__(self, '_unchanged', False)
+        object.__setattr__(self, name, value)
+
     def to_dict(self):
         '''method to produce a json tilespec for this tile
         returns a json compatible dictionary
         '''
+        if getattr(self, '_unchanged', False):
+            return _copy_json(self._json)
         thedict = {}
         thedict['tileId'] = self.tileId
         thedict['z'] = self.z
@@ -202,8 +298,12 @@ class TileSpec:
         thedict = {k: v for k, v in thedict.items() if v is not None}
         return thedict
 
-    def from_dict(self, d):
-        '''Method to load tilespec from json dictionary'''
+    def from_dict(self, d, lazy=False):
+        '''Method to load tilespec from json dictionary
+        keyword arguments:
+        --lazy: keep a copy of d and parse layout, mipmapLevels and
+            transforms on first access (default False)
+        '''
         self.tileId = d['tileId']
         self.z = d['z']
         self.width = d['width']
@@ -211,19 +311,20 @@ class TileSpec:
         self.minint = d.get('minIntensity')
         self.maxint = d.get('maxIntensity')
         self.frameId = d.get('frameId')
-        self.layout = Layout()
-        self.layout.from_dict(d.get('layout', None))
         self.minX = d.get('minX', None)
         self.maxX = d.get('maxX', None)
         self.maxY = d.get('maxY', None)
         self.minY = d.get('minY', None)
-        self.ip = ImagePyramid(mipMapLevels=[
-             MipMapLevel(
-                 int(l), imageUrl=v.get('imageUrl'), maskUrl=v.get('maskUrl'))
-             for l, v in d['mipmapLevels'].items()])
-
-        tfl = TransformList(json=d['transforms'])
-        self.tforms = tfl.tforms
+        for private in ['_layout', '_ip', '_tforms', '_json', '_tformlist']:
+            if hasattr(self, private):
+                delattr(self, private)
+        if lazy:
+            self._json = _copy_json(d)
+            self._unchanged = True
+        else:
+            self.layout = _load_layout(d)
+            self.ip = _load_image_pyramid(d)
+            self.tforms = _load_tforms(d)
 
         # TODO filters not implemented -- should skip
         '''
@@ -236,7 +337,7 @@ class TileSpec:
         '''
 
 
-class MipMapLevel:
+class MipMapLevel(SlotsPickleMixin):
     '''
     MipMapLevel class to represent a level of an image pyramid.
     Can be put in dictionary formatting using dict(mML)
@@ -246,6 +347,8 @@ class MipMapLevel:
         imageUrl (optional) -- url corresponding to image
         maskUrl (optional) -- url corresponding to mask
     '''
+    __slots__ = ('level', 'imageUrl', 'maskUrl')
+
     def __init__(self, level, imageUrl=None, maskUrl=None):
         self.level = level
         self.imageUrl = imageUrl
@@ -266,7 +369,7 @@ class MipMapLevel:
         return iter([(self.level, self._formatUrls())])
 
 
-class ImagePyramid:
+class ImagePyramid(SlotsPickleMixin):
     '''
     Image Pyramid class representing a set of MipMapLevels which correspond
         to mipmapped (continuously downsmapled by 2x) representations
@@ -285,6 +388,8 @@ class ImagePyramid:
         input: key(optional) -- key to sort ordered dictionary
             default sort by level via lambda x: x[0]
     '''
+    __slots__ = ('mipMapLevels', )
+
     def __init__(self, mipMapLevels=[]):
         self.mipMapLevels = mipMapLevels
 
@@ -317,9 +422,229 @@ class ImagePyramid:
             l for sl in [list(mmL) for mmL in self.mipMapLevels] for l in sl])
 
 
+def _affine_parameters(tforms):
+    '''
+    parameters (M00, M01, M10, M11, B0, B1) of the composition of a list
+        of transforms, or NaNs if any transform in it is not affine
+    '''
+    M = np.identity(3)
+    for tform in tforms:
+        if isinstance(tform, list) or hasattr(tform, 'tforms'):
+            sub = _affine_parameters(getattr(tform, 'tforms', tform))
+            tM = np.array([[sub[0], sub[1], sub[4]],
+                           [sub[2], sub[3], sub[5]],
+                           [0., 0., 1.]])
+        elif hasattr(tform, 'M'):
+            tM = tform.M
+        else:
+            return np.full(6, np.nan)
+        M = tM.dot(M)
+    return np.array([M[0, 0], M[0, 1], M[1, 0], M[1, 1], M[0, 2], M[1, 2]])
+
+
+class TileSpecCollection(object):
+    '''
+    columnar collection of tilespecs, holding the commonly queried fields
+        of many tiles as numpy arrays so they can be filtered and compared
+        without looping over TileSpec objects.  TileSpec objects are only
+        created when an element is indexed or the collection is iterated.
+
+    columns (numpy arrays, with NaN or None for missing values):
+        tileId, sectionId -- object arrays of strings
+        z, width, height, minint, maxint, minX, minY, maxX, maxY --
+            float64 arrays
+        M00, M01, M10, M11, B0, B1 -- float64 arrays of the parameters of
+            the composition of each tile's transforms if they are all
+            affine, NaN otherwise
+
+    indexing:
+        collection[i] -- TileSpec for tile i
+        collection[slice], collection[boolean mask], collection[indices]
+            -- TileSpecCollection of the selected tiles
+
+    init:
+        specs -- list of tilespec dictionaries or TileSpec objects, as
+            returned by get_tile_specs_from_z (see from_json,
+            from_tilespecs)
+    '''
+    float_columns = ['z', 'width', 'height', 'minint', 'maxint',
+                     'minX', 'minY', 'maxX', 'maxY']
+    affine_columns = ['M00', 'M01', 'M10', 'M11', 'B0', 'B1']
+    object_columns = ['tileId', 'sectionId']
+    columns = object_columns + float_columns + affine_columns
+
+    def __init__(self, specs=[]):
+        self._specs = np.empty(len(specs), dtype=object)
+        self._specs[:] = specs
+        rows = [self._row(s) for s in specs]
+        self._columns = {}
+        for i, c in enumerate(self.object_columns):
+            self._columns[c] = np.empty(len(rows), dtype=object)
+            self._columns[c][:] = [r[i] for r in rows]
+        floats = np.array(
+            [r[len(self.object_columns):-1] for r in rows],
+            dtype=np.float64).reshape(len(rows), len(self.float_columns))
+        affines = np.array(
+            [r[-1] for r in rows], dtype=np.float64).reshape(
+                len(rows), len(self.affine_columns))
+        for i, c in enumerate(self.float_columns):
+            self._columns[c] = floats[:, i]
+        for i, c in enumerate(self.affine_columns):
+            self._columns[c] = affines[:, i]
+
+    @classmethod
+    def from_json(cls, tilespec_jsons):
+        '''
+        input:
+            tilespec_jsons -- list of tilespec dictionaries
+        returns:
+            TileSpecCollection
+        '''
+        return cls(list(tilespec_jsons))
+
+    @classmethod
+    def from_tilespecs(cls, tilespecs):
+        '''
+        input:
+            tilespecs -- list of TileSpec objects
+        returns:
+            TileSpecCollection
+        '''
+        return cls(list(tilespecs))
+
+    @staticmethod
+    def _row(spec):
+        def value(v):
+            return np.nan if v is None else v
+
+        spec = (spec._json if getattr(spec, '_unchanged', False)
+                else spec)
+        if isinstance(spec, dict):
+            tforms = TransformList(json=spec['transforms']).tforms
+            floats = [spec.get(k) for k in ['z', 'width', 'height',
+                                            'minIntensity', 'maxIntensity',
+                                            'minX', 'minY', 'maxX', 'maxY']]
+            tileId = spec['tileId']
+            sectionId = (spec.get('layout') or {}).get('sectionId')
+        else:
+            tforms = spec.tforms
+            floats = [getattr(spec, k, None) for k in
+                      TileSpecCollection.float_columns]
+            tileId = spec.tileId
+            sectionId = getattr(spec.layout, 'sectionId', None)
+        return ([tileId, sectionId] + [value(v) for v in floats] +
+                [_affine_parameters(tforms)])
+
+    @classmethod
+    def _from_columns(cls, specs, columns):
+        collection = cls.__new__(cls)
+        collection._specs = specs
+        collection._columns = columns
+        return collection
+
+    def __getattr__(self, name):
+        if name in TileSpecCollection.columns and '_columns' in vars(self):
+            return self._columns[name]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return len(self._specs)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            spec = self._specs[index]
+            return TileSpec(json=spec) if isinstance(spec, dict) else spec
+        return self._from_columns(
+            self._specs[index],
+            {c: v[index] for c, v in self._columns.items()})
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def bbox(self):
+        '''N x 4 array of minX, minY, maxX, maxY'''
+        return np.column_stack([self.minX, self.minY, self.maxX, self.maxY])
+
+    @property
+    def affine(self):
+        '''N x 3 x 3 array of homogeneous affine matrices'''
+        M = np.zeros((len(self), 3, 3))
+        M[:, 0, 0], M[:, 0, 1], M[:, 0, 2] = self.M00, self.M01, self.B0
+        M[:, 1, 0], M[:, 1, 1], M[:, 1, 2] = self.M10, self.M11, self.B1
+        M[:, 2, 2] = 1.
+        return M
+
+    def filter_z(self, zmin, zmax=None):
+        '''
+        input:
+            zmin -- minimum z value (or only z value if zmax is None)
+        keyword arguments:
+            zmax -- maximum z value, inclusive
+        returns:
+            TileSpecCollection of tiles in the z range
+        '''
+        if zmax is None:
+            return self[self.z == zmin]
+        return self[(self.z >= zmin) & (self.z <= zmax)]
+
+    def filter_bbox(self, minX, minY, maxX, maxY):
+        '''
+        input:
+            minX, minY, maxX, maxY -- world coordinates of a box
+        returns:
+            TileSpecCollection of tiles whose bounding box intersects
+                the box (tiles without bounds are excluded)
+        '''
+        return self[(self.minX <= maxX) & (self.maxX >= minX) &
+                    (self.minY <= maxY) & (self.maxY >= minY)]
+
+    def filter_sectionId(self, sectionIds):
+        '''
+        input:
+            sectionIds -- sectionId string or list of sectionIds
+        returns:
+            TileSpecCollection of tiles in those sections
+        '''
+        if isinstance(sectionIds, basestring):
+            sectionIds = [sectionIds]
+        return self[np.in1d(self.sectionId, list(sectionIds))]
+
+    def argsort(self, by='tileId'):
+        '''
+        input:
+            by -- column name or list of column names, the first being
+                the primary sort key (default 'tileId')
+        returns:
+            array of indices sorting the collection
+        '''
+        keys = [by] if isinstance(by, basestring) else list(by)
+        return np.lexsort([self._columns[k] for k in reversed(keys)])
+
+    def sort(self, by='tileId'):
+        '''
+        input:
+            by -- column name or list of column names, the first being
+                the primary sort key (default 'tileId')
+        returns:
+            sorted TileSpecCollection
+        '''
+        return self[self.argsort(by)]
+
+    def to_tilespecs(self):
+        '''returns list of TileSpec objects'''
+        return list(self)
+
+    def to_json(self):
+        '''returns list of tilespec dictionaries'''
+        return [s if isinstance(s, dict) else s.to_dict()
+                for s in self._specs]
+
+
 @renderaccess
 def get_tile_spec(stack, tile, host=None, port=None, owner=None,
-                  project=None, session=requests.session(),
+                  project=None, session=None,
                   render=None, **kwargs):
     '''renderapi call to get a specific tilespec by tileId
     note that this will return a tilespec with resolved transform references
@@ -331,7 +656,7 @@ def get_tile_spec(stack, tile, host=None, port=None, owner=None,
     keyword args:
     --render: render connect object
     (or host, port, owner, project)
-    --session: sessions object to connect with (default make a new one)
+    --session: sessions object to connect with (default pooled session)
     outputs:
     A TileSpec object with dereferenced transforms
     '''
@@ -351,7 +676,7 @@ def get_tile_spec(stack, tile, host=None, port=None, owner=None,
 
 @renderaccess
 def get_tile_spec_raw(stack, tile, host=None, port=None, owner=None,
-                      project=None, session=requests.session(),
+                      project=None, session=None,
                       render=None, **kwargs):
     '''renderapi call to get a specific tilespec by tileId
     note that this will return a tilespec without resolved transform references
@@ -362,7 +687,7 @@ def get_tile_spec_raw(stack, tile, host=None, port=None, owner=None,
     keyword args:
     --render: render connect object
     (or host, port, owner, project)
-    --session: sessions object to connect with (default make a new one)
+    --session: sessions object to connect with (default pooled session)
     outputs:
     a TileSpec object with referenced transforms if present
     '''
@@ -384,7 +709,7 @@ def get_tile_spec_raw(stack, tile, host=None, port=None, owner=None,
 def get_tile_specs_from_minmax_box(stack, z, xmin, xmax, ymin, ymax,
                                    scale=1.0, host=None,
                                    port=None, owner=None, project=None,
-                                   session=requests.session(),
+                                   session=None,
                                    render=None, **kwargs):
     '''renderapi call to get all tilespec that exist within a 2d bounding box
     specified with min and max x,y values
@@ -401,7 +726,7 @@ def get_tile_specs_from_minmax_box(stack, z, xmin, xmax, ymin, ymax,
     --scale: scale to use when retrieving render parameters (not important)
     --render: render connect object
     (or host, port, owner, project)
-    --session: sessions object to connect with (default make a new one)
+    --session: sessions object to connect with (default pooled session)
     outputs:
     a list of TileSpec objects
     '''
@@ -418,7 +743,7 @@ def get_tile_specs_from_minmax_box(stack, z, xmin, xmax, ymin, ymax,
 @renderaccess
 def get_tile_specs_from_box(stack, z, x, y, width, height,
                             scale=1.0, host=None, port=None, owner=None,
-                            project=None, session=requests.session(),
+                            project=None, session=None,
                             render=None, **kwargs):
     '''renderapi call to get all tilespec that exist within a 2d bounding box
     specified with min  x,y values and width, height
@@ -435,7 +760,7 @@ def get_tile_specs_from_box(stack, z, x, y, width, height,
     --scale: scale to use when retrieving render parameters (not important)
     --render: render connect object
     (or host, port, owner, project)
-    --session: sessions object to connect with (default make a new one)
+    --session: sessions object to connect with (default pooled session)
     outputs:
     a list of TileSpec objects
     '''
@@ -455,110 +780,309 @@ def get_tile_specs_from_box(stack, z, x, y, width, height,
             for tilespec_json in tilespecs_json['tileSpecs']]
 
 
-@renderaccess
-def get_tile_specs_from_z(stack, z, host=None, port=None,
-                          owner=None, project=None, session=requests.session(),
-                          render=None, **kwargs):
-    '''
-    input:
-        stack -- string render stack
-        z -- render z
-    keyword arguments:
-        render -- render connect object (or host, port, owner, project)
-        session -- requests.session (default start a new one)
-    output: list of TileSpec objects from that stack at that z
-    '''
+def _get_tile_spec_jsons_from_z(stack, z, host, port, owner, project,
+                                session):
+    '''list of the tilespec dictionaries of a stack at z'''
     request_url = format_preamble(
         host, port, owner, project, stack) + '/z/%f/tile-specs' % (z)
     logger.debug(request_url)
     r = session.get(request_url)
     try:
-        tilespecs_json = r.json()
+        return r.json()
     except Exception as e:
         logger.error(e)
         logger.error(r.text)
         raise RenderError(r.text)
 
+
+@renderaccess
+def get_tile_specs_from_z(stack, z, host=None, port=None,
+                          owner=None, project=None, session=None,
+                          render=None, lazy=False, **kwargs):
+    '''
+    input:
+        stack -- string render stack
+        z -- render z
+    keyword arguments:
+        lazy -- parse layouts, mipmapLevels and transforms only when
+            accessed (default False, see TileSpec)
+        render -- render connect object (or host, port, owner, project)
+        session -- requests.session (default pooled session)
+    output: list of TileSpec objects from that stack at that z
+    '''
+    tilespecs_json = _get_tile_spec_jsons_from_z(
+        stack, z, host, port, owner, project, session)
     if len(tilespecs_json) == 0:
         return None
     else:
-        return [TileSpec(json=tilespec_json)
+        return [TileSpec(json=tilespec_json, lazy=lazy)
                 for tilespec_json in tilespecs_json]
 
 
 @renderaccess
 def get_tile_specs_from_stack(stack, host=None, port=None,
                               owner=None, project=None,
-                              session=requests.session(),
-                              render=None, **kwargs):
+                              session=None,
+                              render=None, lazy=False, **kwargs):
     '''get flat list of tilespecs for stack using i for sl in l for i in sl
+    (see iter_tile_specs_from_stack to stream layers concurrently)
     input:
     stack -- string render stack
     keyword arguments:
+    lazy -- parse layouts, mipmapLevels and transforms only when accessed
+        (default False, see TileSpec)
     render -- render connect object (or host, port, owner, project)
-    session -- requests.session (default start a new one)
+    session -- requests.session (default pooled session)
     output:
     List of TileSpec objects from the stack
     '''
     return [i for sl in [
-        get_tile_specs_from_z(stack, z, host=host, port=port,
+        get_tile_specs_from_z(stack, z, lazy=lazy, host=host, port=port,
                               owner=owner, project=project, session=session)
         for z in get_z_values_for_stack(stack, host=host, port=port,
                                         owner=owner, project=project,
                                         session=session)] for i in sl]
 
-# TODO: ADD FEATURES THAT REQUIRED THESE TO SUPPORT.. NOT YET FULLY IMPLEMENTED
-# class ResolvedTileSpecMap:
-#     def __init__(self, tilespecs=[], transforms=[]):
-#         self.tilespecs = tilespecs
-#         self.transforms = transforms
 
-#     def to_dict(self):
-#         d = {}
-#         d['tileIdToSpecMap'] = {}
-#         for ts in self.tilespecs:
-#             d['tileIdToSpecMap'][ts.tileId] = ts.to_dict()
-#         d['transformIdToSpecMap'] = {}
-#         for tf in self.transforms:
-#             d['transformIdToSpecMap'][tf.transformId] = tf.to_dict()
-#         return d
+@renderaccess
+def iter_tile_specs_from_stack(stack, zValues=None, poolsize=None,
+                               readahead=None, ordered=True, host=None,
+                               port=None, owner=None, project=None,
+                               session=None, render=None, lazy=False,
+                               **kwargs):
+    '''iterate over the z layers of a stack, fetching layers concurrently
+    input:
+    stack -- string render stack
+    keyword arguments:
+    zValues -- list of z values to fetch (default all z in the stack)
+    poolsize -- number of layers requested at once (default 10).
+        The session should keep at least this many connections
+        (see renderapi.connect(pool_maxsize=...))
+    readahead -- maximum number of layers fetched but not yet yielded
+        (default 2 * poolsize), bounding the number held in memory
+    ordered -- whether to yield layers in order of zValues (default True)
+        or as soon as they arrive
+    lazy -- parse layouts, mipmapLevels and transforms only when accessed
+        (default False, see TileSpec)
+    render -- render connect object (or host, port, owner, project)
+    session -- requests.session (default pooled session)
+    yields:
+    (z, list of TileSpec objects) for each z, with an empty list
+        for z values without tiles
+    '''
+    if zValues is None:
+        zValues = get_z_values_for_stack(stack, host=host, port=port,
+                                         owner=owner, project=project,
+                                         session=session)
 
-#     def from_dict(self, d):
-#         tsmap = d['tileIdToSpecMap']
-#         tfmap = d['transformIdToSpecMap']
-#         for tsd in tsmap.values():
-#             ts = TileSpec()
-#             ts.from_dict(tsd)
-#             self.tilespecs.append(ts)
-#         for tfd in tfmap.values():
-#             tf = load_transform_json(tfd)
-#             self.transforms.append(tf)
-
-
-# class ResolvedTileSpecCollection:
-#     def __init__(self, tilespecs=[], transforms=[]):
-#         self.tilespecs = tilespecs
-#         self.transforms = transforms
+    def get_layer(z):
+        return get_tile_specs_from_z(
+            stack, z, lazy=lazy, host=host, port=port, owner=owner,
+            project=project, session=session) or []
 
-#     def to_dict(self):
-#         d = {}
-#         d['tileCount'] = len(self.tilespecs)
-#         d['tileSpecs'] = [ts.to_dict() for ts in self.tilespecs]
-#         d['transformCount'] = len(self.transforms)
-#         d['transformSpecs'] = [tf.to_dict() for tf in self.transforms]
-#         return d
+    for z, tilespecs in imap_bounded(get_layer, zValues, poolsize=poolsize,
+                                     readahead=readahead, ordered=ordered):
+        yield z, tilespecs
 
-#     def from_dict(self, d):
-#         self.tilespecs = []
-#         self.transforms = []
-#         for i in range(d['tileCount']):
-#             ts = TileSpec()
-#             ts.from_dict(d['tileSpecs'][i])
-#             self.tilespecs.append(ts)
-#         for i in range(d['tranformCount']):
-#             tfd = d['transformSpecs'][i]
-#             tf = load_transform_json(tfd)
-#             self.transforms.append(tf)
+
+@renderaccess
+def get_transform_library(stack, z=None, host=None, port=None, owner=None,
+                          project=None, session=None, render=None, **kwargs):
+    '''
+    fetch the shared transforms of a stack (or of one of its layers) at
+        once from its resolvedTiles, to resolve transform references
+        locally (see TransformLibrary.resolve_tilespecs) instead of
+        requesting render-parameters for each tile
+    input:
+        stack -- string render stack
+    keyword arguments:
+        z -- z value of a single layer (default the whole stack)
+        render -- render connect object (or host, port, owner, project)
+        session -- requests.session (default pooled session)
+    returns:
+        TransformLibrary
+    raises:
+        RenderError
+    '''
+    request_url = format_preamble(
+        host, port, owner, project, stack) + (
+            '/resolvedTiles' if z is None else '/z/%f/resolvedTiles' % (z))
+    logger.debug(request_url)
+    r = session.get(request_url)
+    try:
+        resolved = r.json()
+    except Exception as e:
+        logger.error(e)
+        logger.error(r.text)
+        raise RenderError(r.text)
+    return TransformLibrary(resolved.get('transformIdToSpecMap', {}))
+
+
+class ResolvedTileSpecCollection(object):
+    '''
+    tilespecs together with the shared transforms they reference
+    init:
+        tilespecs -- list of TileSpec objects
+        transforms -- list of shared transform objects with transformIds
+        deduplicate -- whether to hoist transforms that several tiles
+            have in common into shared transforms referenced by the tiles
+            (default True, see deduplicate)
+        min_count -- minimum number of tiles sharing a transform for it to
+            be hoisted (default 2)
+        json -- json dictionary to initialize this object with (either
+            format, see to_dict and to_map_dict)
+    '''
+    def __init__(self, tilespecs=None, transforms=None, deduplicate=True,
+                 min_count=2, json=None):
+        if json is not None:
+            self.from_dict(json)
+        else:
+            self.tilespecs = [] if tilespecs is None else tilespecs
+            self.transforms = [] if transforms is None else transforms
+            self._refIds = {}
+            if deduplicate:
+                self.deduplicate(min_count=min_count)
+
+    @staticmethod
+    def _transform_key(tform):
+        if isinstance(tform, list):
+            tform = TransformList(tforms=tform)
+        return json.dumps(tform.to_dict(), sort_keys=True)
+
+    def deduplicate(self, min_count=2):
+        '''
+        find transforms that at least min_count tiles have in common (as
+            one of the elements of their tforms), add them to transforms
+            and have the serialized tilespecs reference them.  The tiles
+            themselves are not modified; references are found from their
+            tforms when serializing, so tiles and transforms changed or
+            added afterwards are written out as they are.  Shared
+            transforms keep their transformId, or are given an id derived
+            from their spec.
+        keyword arguments:
+            min_count -- minimum number of tiles sharing a transform for it
+                to be hoisted (default 2)
+        returns:
+            list of transforms added
+        '''
+        keys = [[None if isinstance(t, ReferenceTransform)
+                 else self._transform_key(t) for t in ts.tforms]
+                for ts in self.tilespecs]
+        counts = {}
+        for tilekeys in keys:
+            for k in set(tilekeys):
+                counts[k] = counts.get(k, 0) + 1
+
+        taken = {t.transformId for t in self.transforms}
+        refIds = dict(self._refIds)
+        added = []
+        for ts, tilekeys in zip(self.tilespecs, keys):
+            for tform, k in zip(ts.tforms, tilekeys):
+                if (k is None or k in refIds or
+                        counts[k] < max(min_count, 1)):
+                    continue
+                if isinstance(tform, list):
+                    tform = TransformList(tforms=tform)
+                refId = getattr(tform, 'transformId', None)
+                if refId is None or refId in taken:
+                    refId = 'transform_{}'.format(
+                        hashlib.sha1(k.encode('utf-8')).hexdigest()[:16])
+                tform = copy.copy(tform)
+                tform.transformId = refId
+                taken.add(refId)
+                refIds[k] = refId
+                added.append(tform)
+        self.transforms = self.transforms + added
+        self._refIds = refIds
+        logger.debug('hoisted {} shared transforms from {} tiles'.format(
+            len(added), len(self.tilespecs)))
+        return added
+
+    def _tilespec_dicts(self):
+        for ts in self.tilespecs:
+            d = ts.to_dict()
+            if self._refIds:
+                tforms = []
+                for t in ts.tforms:
+                    if not isinstance(t, ReferenceTransform):
+                        refId = self._refIds.get(self._transform_key(t))
+                        if refId is not None:
+                            t = ReferenceTransform(refId=refId)
+                    tforms.append(t)
+                d = dict(d)
+                d['transforms'] = TransformList(tforms=tforms).to_dict()
+            yield d
+
+    def _transform_dicts(self):
+        for tform in self.transforms:
+            d = tform.to_dict()
+            d.setdefault('id', tform.transformId)
+            yield d
+
+    def to_dict(self):
+        '''
+        returns:
+            dictionary with tileCount, tileSpecs, transformCount and
+                transformSpecs
+        '''
+        tileSpecs = list(self._tilespec_dicts())
+        transformSpecs = list(self._transform_dicts())
+        return {'tileCount': len(tileSpecs), 'tileSpecs': tileSpecs,
+                'transformCount': len(transformSpecs),
+                'transformSpecs': transformSpecs}
+
+    def to_map_dict(self):
+        '''
+        returns:
+            dictionary with tileIdToSpecMap and transformIdToSpecMap, as
+                accepted by render's resolvedTiles endpoints
+        '''
+        return {
+            'tileIdToSpecMap': {d['tileId']: d
+                                for d in self._tilespec_dicts()},
+            'transformIdToSpecMap': {t.transformId: d for t, d in zip(
+                self.transforms, self._transform_dicts())}}
+
+    def from_dict(self, d):
+        '''
+        load tilespecs and shared transforms from a dictionary in either
+            the format of to_dict or of to_map_dict
+        '''
+        if 'tileIdToSpecMap' in d:
+            tilespec_jsons = d['tileIdToSpecMap'].values()
+            transform_jsons = d.get('transformIdToSpecMap', {})
+        else:
+            tilespec_jsons = d.get('tileSpecs', [])
+            transform_jsons = d.get('transformSpecs', [])
+        self.tilespecs = [TileSpec(json=tsd) for tsd in tilespec_jsons]
+        self.transforms = []
+        library = TransformLibrary(transform_jsons)
+        for refId in sorted(library.transforms):
+            tform = library[refId]
+            tform.transformId = refId
+            self.transforms.append(tform)
+        self._refIds = {}
+
+    def resolve(self):
+        '''
+        returns:
+            list of the tilespecs with their transform references replaced
+                by copies of the shared transforms (see TransformLibrary)
+        '''
+        library = TransformLibrary()
+        for tform in self.transforms:
+            library.add(tform)
+        tilespecs = [TileSpec(json=d) for d in self._tilespec_dicts()]
+        return library.resolve_tilespecs(tilespecs)
+
+
+class ResolvedTileSpecMap(ResolvedTileSpecCollection):
+    '''
+    ResolvedTileSpecCollection serialized by to_dict as tileIdToSpecMap
+        and transformIdToSpecMap, the format of render's resolvedTiles
+    '''
+    def to_dict(self):
+        return self.to_map_dict()
 
 
 # class Filter:
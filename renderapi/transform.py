@@ -5,12 +5,15 @@ handling mpicbg transforms in python
 Currently only implemented to facilitate Affine, Polynomial2D,
     and LensCorrection used in Khaled Khairy's EM aligner workflow
 '''
+import copy
 import json
 import logging
-from collections import Iterable
+import threading
+from collections import Iterable, OrderedDict
+from math import factorial
 import numpy as np
 from .errors import ConversionError, EstimationError, RenderError
-from .utils import NullHandler
+from .utils import NullHandler, SlotsPickleMixin
 
 logger = logging.getLogger(__name__)
 logger.addHandler(NullHandler())
@@ -25,7 +28,79 @@ except ImportError as e:
     from numpy.linalg.linalg import LinAlgError
 
 
-class TransformList:
+def _finite_difference_jacobian(forward, points, delta=1e-2):
+    '''
+    Nx2x2 central difference jacobians of forward at points,
+        evaluating forward once on all perturbed points
+    '''
+    N = points.shape[0]
+    offsets = np.array([[delta, 0.], [-delta, 0.], [0., delta], [0., -delta]])
+    perturbed = (points[np.newaxis] + offsets[:, np.newaxis]).reshape(-1, 2)
+    values = forward(perturbed).reshape(4, N, 2)
+    J = np.empty((N, 2, 2))
+    J[:, :, 0] = (values[0] - values[1]) / (2. * delta)
+    J[:, :, 1] = (values[2] - values[3]) / (2. * delta)
+    return J
+
+
+def _newton_inverse(forward, points, initial, jacobian=None, tol=1e-6,
+                    max_iterations=20):
+    '''
+    solve forward(x) = points for x by batched Newton iterations,
+        iterating only on points which have not yet converged
+    input:
+        forward -- function mapping Nx2 numpy arrays to Nx2 numpy arrays
+        points -- Nx2 numpy array of points to invert
+        initial -- Nx2 numpy array of initial estimates
+    keyword arguments:
+        jacobian -- function giving Nx2x2 jacobians of forward at Nx2
+            points (default central finite differences)
+        tol -- distance from points at which an estimate has converged
+        max_iterations -- maximum number of Newton steps
+    returns:
+        tuple of (Nx2 numpy array of estimates, boolean numpy array
+                  marking points which converged)
+    '''
+    if jacobian is None:
+        def jacobian(x):
+            return _finite_difference_jacobian(forward, x)
+    points = np.asarray(points, dtype=np.float64)
+    x = np.array(initial, dtype=np.float64)
+    converged = np.zeros(points.shape[0], dtype=bool)
+    active = np.arange(points.shape[0])
+    for iteration in range(max_iterations + 1):
+        if not active.size:
+            break
+        xa = x[active]
+        r = forward(xa) - points[active]
+        with np.errstate(invalid='ignore'):
+            done = np.hypot(r[:, 0], r[:, 1]) < tol
+        converged[active[done]] = True
+        keep = ~done & np.isfinite(r).all(axis=1)
+        if iteration == max_iterations or not keep.any():
+            break
+        active, xa, r = active[keep], xa[keep], r[keep]
+        J = jacobian(xa)
+        # closed form solution of the 2x2 systems J * step = r
+        with np.errstate(divide='ignore', invalid='ignore'):
+            det = J[:, 0, 0] * J[:, 1, 1] - J[:, 0, 1] * J[:, 1, 0]
+            x[active, 0] = xa[:, 0] - (
+                J[:, 1, 1] * r[:, 0] - J[:, 0, 1] * r[:, 1]) / det
+            x[active, 1] = xa[:, 1] - (
+                J[:, 0, 0] * r[:, 1] - J[:, 1, 0] * r[:, 0]) / det
+    return x, converged
+
+
+class TransformList(SlotsPickleMixin):
+    '''
+    list of transforms applied in order
+    init:
+        tforms -- list of transform objects (or nested lists of them)
+        transformId -- optional id of this list
+        json -- json dictionary to initialize this object with
+    '''
+    __slots__ = ('tforms', 'transformId', '_plan', '_fingerprint', '_mesh')
+
     def __init__(self, tforms=None, transformId=None, json=None):
         if json is not None:
             self.from_dict(json)
@@ -51,6 +126,11 @@ class TransformList:
     def to_json(self):
         return json.dumps(self.to_dict())
 
+    def __copy__(self):
+        # copy the members so that the copy's list can be modified
+        return TransformList(tforms=[copy.copy(t) for t in self.tforms],
+                             transformId=self.transformId)
+
     def from_dict(self, d):
         self.tforms = []
         if d is not None:
@@ -59,6 +139,243 @@ class TransformList:
                 self.tforms.append(load_transform_json(td))
         return self.tforms
 
+    @staticmethod
+    def _flatten(tforms):
+        for tform in tforms:
+            if isinstance(tform, (list, TransformList)):
+                for leaf in TransformList._flatten(
+                        getattr(tform, 'tforms', tform)):
+                    yield leaf
+            else:
+                yield tform
+
+    @staticmethod
+    def _leaf_fingerprint(tform):
+        # parameters of a leaf which its values depend on
+        if isinstance(tform, AffineModel):
+            return tform.M.tobytes()
+        elif isinstance(tform, Polynomial2DTransform):
+            return tform._params.tobytes()
+        elif isinstance(tform, NonLinearCoordinateTransform):
+            return tform._fingerprint()
+        return getattr(tform, 'dataString', None)
+
+    def compile(self):
+        '''
+        evaluation plan for this list: runs of consecutive affine-family
+            transforms are merged into a single AffineModel and other
+            transforms are kept as separate steps.  The plan is cached
+            until the transforms in the list or the parameters of one of
+            them change.
+        returns:
+            list of transform objects to apply in order
+        '''
+        leaves = list(self._flatten(self.tforms))
+        fingerprint = tuple((id(t), self._leaf_fingerprint(t))
+                            for t in leaves)
+        if getattr(self, '_fingerprint', None) != fingerprint:
+            plan = []
+            for tform in leaves:
+                if isinstance(tform, AffineModel):
+                    if plan and isinstance(plan[-1], AffineModel):
+                        plan[-1] = tform.concatenate(plan[-1])
+                    else:
+                        plan.append(tform)
+                else:
+                    plan.append(tform)
+            self._plan = plan
+            self._fingerprint = fingerprint
+        return self._plan
+
+    def tform(self, points):
+        '''
+        apply the transforms in the list to points
+        input:
+            points -- Nx2 numpy array of points
+        returns:
+            Nx2 numpy array of transformed points
+        raises:
+            ConversionError if the list holds a transform which cannot be
+                evaluated (e.g. an unresolved ReferenceTransform)
+        '''
+        for step in self.compile():
+            if not hasattr(step, 'tform'):
+                raise ConversionError(
+                    'cannot evaluate transform {}'.format(step))
+            points = step.tform(points)
+        return points
+
+    def inverse_tform(self, points, tol=1e-6, max_iterations=20,
+                      return_converged=False):
+        '''
+        apply the inverse of the transforms in the list to points.
+            Each step is inverted with its own inverse_tform if every step
+            has one; otherwise the whole chain is inverted by Newton
+            iterations started from the inverse of its affine steps.
+        input:
+            points -- Nx2 numpy array of points
+        keyword arguments:
+            tol -- distance in the output space within which a
+                numerically inverted point has converged (default 1e-6)
+            max_iterations -- maximum number of Newton iterations
+                (default 20)
+            return_converged -- boolean whether to also return a boolean
+                numpy array marking points which converged
+        returns:
+            Nx2 numpy array of points (and converged array if requested).
+                Points which did not converge are NaN.
+        raises:
+            ConversionError if the list holds a transform which can
+                neither be evaluated nor inverted
+        '''
+        plan = self.compile()
+        for step in plan:
+            if not (hasattr(step, 'tform') or
+                    hasattr(step, 'inverse_tform')):
+                raise ConversionError(
+                    'cannot invert transform {}'.format(step))
+        if all(hasattr(step, 'inverse_tform') for step in plan):
+            converged = np.ones(points.shape[0], dtype=bool)
+            for step in reversed(plan):
+                if isinstance(step, AffineModel):
+                    points = step.inverse_tform(points)
+                else:
+                    points, c = step.inverse_tform(
+                        points, tol=tol, max_iterations=max_iterations,
+                        return_converged=True)
+                    converged &= c
+        else:
+            for step in plan:
+                if not hasattr(step, 'tform'):
+                    raise ConversionError(
+                        'cannot invert transform {}'.format(step))
+            initial = points
+            for step in reversed(plan):
+                if isinstance(step, AffineModel):
+                    initial = step.inverse_tform(initial)
+            points, converged = _newton_inverse(
+                self.tform, points, initial, tol=tol,
+                max_iterations=max_iterations)
+            points[~converged] = np.nan
+        return (points, converged) if return_converged else points
+
+    def approximate(self, width, height, shape=(32, 32),
+                    method='piecewise_affine'):
+        '''
+        mesh approximating this list over a width x height tile (see
+            TransformMesh).  The mesh is cached until the arguments or the
+            evaluation plan (see compile) change.
+        input:
+            width, height -- size of the area of the source space covered
+        keyword arguments:
+            shape -- (rows, columns) of mesh cells (default (32, 32))
+            method -- 'piecewise_affine' (default) or 'bilinear'
+        returns:
+            TransformMesh
+        '''
+        self.compile()
+        key = (width, height, tuple(shape), method, self._fingerprint)
+        cached = getattr(self, '_mesh', None)
+        if cached is None or cached[0] != key:
+            cached = (key, TransformMesh(
+                self, width, height, shape=shape, method=method))
+            self._mesh = cached
+        return cached[1]
+
+
+class TransformMesh(object):
+    '''
+    approximation of a transform by its values at the vertices of a grid
+        over a width x height tile, as render warps images through a
+        mesh rather than transforming every pixel.  Points are mapped by
+        interpolating within their grid cell (and extrapolating from the
+        nearest cell outside the tile), which is much faster than exactly
+        evaluating polynomial or lens correction transforms.
+    init:
+        tform -- transform or TransformList with tform method
+        width, height -- size of the area of the source space covered
+    keyword arguments:
+        shape -- (rows, columns) of mesh cells (default (32, 32))
+        method -- 'piecewise_affine' (default) splits each cell into two
+            triangles as render does, 'bilinear' interpolates bilinearly
+    attributes:
+        max_error -- maximum distance between the mesh and the transform
+            at the cell centers and edge midpoints
+    '''
+    METHODS = ('piecewise_affine', 'bilinear')
+
+    def __init__(self, tform, width, height, shape=(32, 32),
+                 method='piecewise_affine'):
+        if method not in self.METHODS:
+            raise ConversionError(
+                'unknown mesh method {} -- expected one of {}'.format(
+                    method, self.METHODS))
+        self.width = float(width)
+        self.height = float(height)
+        self.shape = tuple(int(n) for n in shape)
+        self.method = method
+        rows, cols = self.shape
+        self.cellsize = np.array([self.width / cols, self.height / rows])
+
+        # sample on a grid of twice the resolution: even samples are the
+        #     vertices and the others measure the interpolation error
+        y, x = np.meshgrid(np.linspace(0., self.height, 2 * rows + 1),
+                           np.linspace(0., self.width, 2 * cols + 1),
+                           indexing='ij')
+        samples = np.stack([x.ravel(), y.ravel()], axis=1)
+        exact = tform.tform(samples).reshape(2 * rows + 1, 2 * cols + 1, 2)
+        self.vertices = np.ascontiguousarray(exact[::2, ::2])
+        self._coefficients = self._interpolation_coefficients()
+        tests = np.ones(exact.shape[:2], dtype=bool)
+        tests[::2, ::2] = False
+        self.max_error = float(np.max(np.hypot(
+            *(self.tform(samples[tests.ravel()]) - exact[tests]).T)))
+
+    def _interpolation_coefficients(self):
+        '''
+        table of the coefficients of the interpolant of each cell (or of
+            the two triangles of each cell) in the fractional position
+            fx, fy of a point within its cell, so that mapping a point
+            gathers a single row
+        '''
+        v = self.vertices
+        v00, v01 = v[:-1, :-1], v[:-1, 1:]
+        v10, v11 = v[1:, :-1], v[1:, 1:]
+        if self.method == 'bilinear':
+            # v00 + fx * c1 + fy * c2 + fx * fy * c3
+            terms = [v00, v01 - v00, v10 - v00, v11 - v10 - v01 + v00]
+            return np.concatenate(terms, axis=-1).reshape(-1, 8)
+        # triangles split along the diagonal from v01 to v10:
+        #     v00 + fx * (v01 - v00) + fy * (v10 - v00) if fx + fy <= 1,
+        #     else v11 + (1 - fx) * (v10 - v11) + (1 - fy) * (v01 - v11)
+        upper = np.concatenate([v00, v01 - v00, v10 - v00], axis=-1)
+        lower = np.concatenate([v10 + v01 - v11, v11 - v10, v11 - v01],
+                               axis=-1)
+        return np.stack([upper, lower], axis=2).reshape(-1, 6)
+
+    def tform(self, points):
+        '''
+        map points by interpolating the mesh
+        input:
+            points -- Nx2 numpy array of points
+        returns:
+            Nx2 numpy array of approximately transformed points
+        '''
+        rows, cols = self.shape
+        scaled = np.asarray(points, dtype=np.float64) / self.cellsize
+        cell = np.clip(np.floor(scaled), 0, [cols - 1, rows - 1])
+        scaled -= cell
+        fx, fy = scaled[:, 0:1], scaled[:, 1:2]
+        index = (cell[:, 1] * cols + cell[:, 0]).astype(np.intp)
+        if self.method == 'bilinear':
+            c = np.take(self._coefficients, index, axis=0)
+            return (c[:, 0:2] + fx * (c[:, 2:4] + fy * c[:, 6:8]) +
+                    fy * c[:, 4:6])
+        index *= 2
+        index += (fx + fy > 1)[:, 0]
+        c = np.take(self._coefficients, index, axis=0)
+        return c[:, 0:2] + fx * c[:, 2:4] + fy * c[:, 4:6]
+
 
 def load_transform_json(d, default_type='leaf'):
     handle_load_tform = {'leaf': load_leaf_json,
@@ -72,11 +389,72 @@ def load_transform_json(d, default_type='leaf'):
         raise RenderError('Unknown Transform Type {}'.format(e))
 
 
+class LeafCache(object):
+    '''
+    LRU cache interning leaf transforms by className and dataString, so
+        that a leaf shared by many tiles (e.g. a lens correction) is
+        parsed once.  Each lookup returns a shallow copy of the interned
+        transform: copies share their immutable parsed data and own
+        anything mutable in place (see the __copy__ methods of the
+        transform classes).  load_leaf_json reads through the module's
+        leaf_cache; set its maxsize to 0 to disable interning.
+    init:
+        maxsize -- int maximum number of transforms interned (default 1024)
+    '''
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, d, load):
+        '''
+        input:
+            d -- leaf transform dictionary
+            load -- function creating a transform from d
+        returns:
+            transform object for d with d's transformId
+        '''
+        if not self.maxsize:
+            return load(d)
+        key = (d['className'], d['dataString'])
+        with self._lock:
+            tform = self._entries.pop(key, None)
+            if tform is not None:
+                self._entries[key] = tform
+                self.hits += 1
+        if tform is None:
+            tform = load(d)
+            tform.transformId = None
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = tform
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        tform = copy.copy(tform)
+        tform.transformId = d.get('transformId', None)
+        return tform
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+leaf_cache = LeafCache()
+
+
 def load_leaf_json(d):
     handle_load_leaf = {
         AffineModel.className: lambda x: AffineModel(json=x),
         Polynomial2DTransform.className:
             lambda x: Polynomial2DTransform(json=x),
+        NonLinearCoordinateTransform.className:
+            lambda x: NonLinearCoordinateTransform(json=x),
         TranslationModel.className: lambda x: TranslationModel(json=x),
         RigidModel.className: lambda x: RigidModel(json=x),
         SimilarityModel.className: lambda x: SimilarityModel(json=x)}
@@ -87,11 +465,12 @@ def load_leaf_json(d):
             'Unexpected or unknown Transform Type {}'.format(tform_type))
     tform_class = d['className']
     try:
-        return handle_load_leaf[tform_class](d)
+        load = handle_load_leaf[tform_class]
     except KeyError as e:
         logger.info('Leaf transform class {} not defined in '
                     'transform module, using generic'.format(e))
-        return Transform(json=d)
+        load = (lambda x: Transform(json=x))
+    return leaf_cache.get(d, load)
 
 
 class InterpolatedTransform:
@@ -126,7 +505,9 @@ class InterpolatedTransform:
                      ('lambda', self.lambda_)])
 
 
-class ReferenceTransform:
+class ReferenceTransform(SlotsPickleMixin):
+    __slots__ = ('refId', )
+
     def __init__(self, refId=None, json=None):
         if json is not None:
             self.from_dict(json)
@@ -152,7 +533,171 @@ class ReferenceTransform:
         return iter([('type', 'ref'), ('refId', self.refId)])
 
 
-class Transform(object):
+class TransformLibrary(object):
+    '''
+    shared transforms by id, used to resolve ReferenceTransforms locally
+        rather than requesting render-parameters for every tile
+    init:
+        transforms -- dictionary of id: transform object or spec
+            dictionary (e.g. a transformIdToSpecMap), or list of transform
+            objects or spec dictionaries with ids
+    '''
+    def __init__(self, transforms=None):
+        self.transforms = {}
+        if transforms is not None:
+            self.update(transforms)
+
+    @staticmethod
+    def _spec_id(spec):
+        if isinstance(spec, dict):
+            return spec.get('id', spec.get('transformId'))
+        return getattr(spec, 'transformId', None)
+
+    def add(self, spec, transformId=None):
+        '''
+        add a shared transform
+        input:
+            spec -- transform object or spec dictionary
+        keyword arguments:
+            transformId -- id of the transform (default the id of spec)
+        raises:
+            RenderError if the transform has no id
+        '''
+        transformId = (self._spec_id(spec) if transformId is None
+                       else transformId)
+        if transformId is None:
+            raise RenderError('shared transform {} has no id'.format(spec))
+        self.transforms[transformId] = (load_transform_json(spec)
+                                        if isinstance(spec, dict) else spec)
+
+    def update(self, transforms):
+        '''
+        add shared transforms
+        input:
+            transforms -- dictionary of id: transform or spec dictionary,
+                or list of transforms or spec dictionaries with ids
+        '''
+        if isinstance(transforms, dict):
+            for transformId, spec in transforms.items():
+                self.add(spec, transformId)
+        else:
+            for spec in transforms:
+                self.add(spec)
+
+    @classmethod
+    def from_file(cls, path):
+        '''
+        load a library from a json file holding a list of transform specs,
+            a dictionary of id: spec, or a resolved tiles dictionary with
+            transformIdToSpecMap or transformSpecs
+        input:
+            path -- path of json file
+        returns:
+            TransformLibrary
+        '''
+        with open(path, 'r') as f:
+            d = json.load(f)
+        if isinstance(d, dict):
+            if 'transformIdToSpecMap' in d:
+                d = d['transformIdToSpecMap']
+            elif 'transformSpecs' in d:
+                d = d['transformSpecs']
+            elif 'type' in d or 'className' in d:
+                d = [d]
+        return cls(d)
+
+    def to_dict(self):
+        '''returns dictionary of id: transform spec dictionary'''
+        return {transformId: tform.to_dict()
+                for transformId, tform in self.transforms.items()}
+
+    def __getitem__(self, transformId):
+        return self.transforms[transformId]
+
+    def __contains__(self, transformId):
+        return transformId in self.transforms
+
+    def __len__(self):
+        return len(self.transforms)
+
+    def resolve(self, tform, _seen=()):
+        '''
+        replace the ReferenceTransforms in a transform by copies of the
+            transforms they refer to
+        input:
+            tform -- transform object, TransformList or list of transforms
+        returns:
+            transform (or list) without references.  Transforms without
+                references are returned as they are.
+        raises:
+            RenderError if a reference is not in the library or is circular
+        '''
+        if isinstance(tform, ReferenceTransform):
+            if tform.refId in _seen:
+                raise RenderError('circular transform reference {}'.format(
+                    tform.refId))
+            try:
+                shared = self.transforms[tform.refId]
+            except KeyError:
+                raise RenderError(
+                    'transform reference {} not in library'.format(
+                        tform.refId))
+            return copy.copy(self.resolve(shared, _seen + (tform.refId, )))
+        if isinstance(tform, (list, TransformList)):
+            tforms = getattr(tform, 'tforms', tform)
+            resolved = [self.resolve(t, _seen) for t in tforms]
+            if all(r is t for r, t in zip(resolved, tforms)):
+                return tform
+            if isinstance(tform, list):
+                return resolved
+            return TransformList(tforms=resolved,
+                                 transformId=tform.transformId)
+        if isinstance(tform, InterpolatedTransform):
+            a, b = self.resolve(tform.a, _seen), self.resolve(tform.b, _seen)
+            if a is tform.a and b is tform.b:
+                return tform
+            return InterpolatedTransform(a=a, b=b, lambda_=tform.lambda_)
+        return tform
+
+    def resolve_tilespecs(self, tilespecs):
+        '''
+        resolve the transform references of tilespecs in place
+        input:
+            tilespecs -- list of TileSpec objects
+        returns:
+            tilespecs
+        raises:
+            RenderError if a reference is not in the library
+        '''
+        for ts in tilespecs:
+            tforms = self.resolve(ts.tforms)
+            if tforms is not ts.tforms:
+                ts.tforms = tforms
+        return tilespecs
+
+
+class _ClassName(object):
+    '''
+    className descriptor for slotted transforms: accessed on a class it
+        gives the mpicbg class that class implements, accessed on an
+        instance it gives the className the instance was given
+    '''
+    def __init__(self, className=None):
+        self.className = className
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self.className
+        return getattr(obj, '_className', self.className)
+
+    def __set__(self, obj, value):
+        obj._className = value
+
+
+class Transform(SlotsPickleMixin):
+    __slots__ = ('_className', 'dataString', 'transformId')
+    className = _ClassName()
+
     def __init__(self, className=None, dataString=None,
                  transformId=None, json=None):
         if json is not None:
@@ -192,23 +737,68 @@ class Transform(object):
     def __hash__(self):
         return hash((self.__str__()))
 
+    def __copy__(self):
+        other = self.__class__.__new__(self.__class__)
+        other.__setstate__(self.__getstate__())
+        return other
+
+
+def _matrix_element(i, j):
+    '''property reading and writing element i, j of the matrix M'''
+    def fget(self):
+        return self.M[i, j]
+
+    def fset(self, value):
+        self.M[i, j] = value
+    return property(fget, fset, doc='element M[{}, {}]'.format(i, j))
+
+
+def _shared_array(name, dtype=np.float64):
+    '''
+    property of a transform array, which copies of the transform share
+        until one of them accesses its arrays and takes its own copies of
+        them (see the _own_arrays methods)
+    '''
+    attr = '_' + name
+
+    def fget(self):
+        if self._shared:
+            self._own_arrays()
+        return getattr(self, attr)
+
+    def fset(self, value):
+        if self._shared:
+            self._own_arrays()
+        if value is not None and dtype is not None:
+            value = np.asarray(value, dtype=dtype)
+        setattr(self, attr, value)
+    return property(fget, fset, doc='numpy array {}'.format(name))
+
 
 class AffineModel(Transform):
-    className = 'mpicbg.trakem2.transform.AffineModel2D'
+    '''
+    2D affine transformation stored as a 3x3 homogeneous matrix M.
+        The parameters M00, M01, M10, M11, B0 and B1 are views of
+        elements of M.
+    '''
+    __slots__ = ('M', )
+    className = _ClassName('mpicbg.trakem2.transform.AffineModel2D')
+
+    M00 = _matrix_element(0, 0)
+    M01 = _matrix_element(0, 1)
+    M10 = _matrix_element(1, 0)
+    M11 = _matrix_element(1, 1)
+    B0 = _matrix_element(0, 2)
+    B1 = _matrix_element(1, 2)
 
     def __init__(self, M00=1.0, M01=0.0, M10=0.0, M11=1.0, B0=0.0, B1=0.0,
                  transformId=None, json=None):
+        self.M = np.identity(3, np.double)
         if json is not None:
             self.from_dict(json)
         else:
-            self.M00 = M00
-            self.M01 = M01
-            self.M10 = M10
-            self.M11 = M11
-            self.B0 = B0
-            self.B1 = B1
+            self.M[:2] = [[M00, M01, B0], [M10, M11, B1]]
             self.className = 'mpicbg.trakem2.transform.AffineModel2D'
-            self.load_M()
             self.transformId = transformId
 
     @property
@@ -228,36 +818,118 @@ class AffineModel(Transform):
         self.M11 = float(dsList[3])
         self.B0 = float(dsList[4])
         self.B1 = float(dsList[5])
-        self.load_M()
+
+    def __copy__(self):
+        other = super(AffineModel, self).__copy__()
+        other.M = self.M.copy()
+        return other
 
     def load_M(self):
-        self.M = np.identity(3, np.double)
-        self.M[0, 0] = self.M00
-        self.M[0, 1] = self.M01
-        self.M[1, 0] = self.M10
-        self.M[1, 1] = self.M11
-        self.M[0, 2] = self.B0
-        self.M[1, 2] = self.B1
+        '''
+        retained for compatibility -- the parameters are stored in M,
+            so it is always up to date
+        '''
+        pass
 
     @staticmethod
     def fit(A, B):
+        '''
+        least squares fit of an affine transformation mapping A to B
+        input:
+            A -- Nx2 numpy array of source points
+            B -- Nx2 numpy array of destination points
+        returns:
+            6x1 numpy array of parameters M00, M01, M10, M11, B0, B1
+        '''
         if not all([A.shape[0] == B.shape[0], A.shape[1] == B.shape[1] == 2]):
             raise EstimationError(
                 'shape mismatch! A shape: {}, B shape {}'.format(
                     A.shape, B.shape))
 
-        N = A.shape[0]  # total points
+        # x and y of B are independent 3 parameter fits in A
+        design = np.column_stack([A, np.ones(A.shape[0])])
+        (X, residuals, rank, s) = np.linalg.lstsq(design, B, rcond=-1)
+        return np.array([X[0, 0], X[1, 0], X[0, 1], X[1, 1],
+                         X[2, 0], X[2, 1]]).reshape(6, 1)
 
-        M = np.zeros((2 * N, 6))
-        Y = np.zeros((2 * N, 1))
-        for i in range(N):
-            M[2 * i, :] = [A[i, 0], A[i, 1], 0, 0, 1, 0]
-            M[2 * i + 1, :] = [0, 0, A[i, 0], A[i, 1], 0, 1]
-            Y[2 * i] = B[i, 0]
-            Y[2 * i + 1] = B[i, 1]
+    @staticmethod
+    def fit_batch(A, B, offsets=None):
+        '''
+        least squares fit of many affine transformations in one call,
+            using closed form normal equations on centered points
+        input:
+            A -- KxNx2 numpy array of K sets of source points, or
+                (total points)x2 array of concatenated sets split by offsets
+            B -- destination points matching A
+        keyword arguments:
+            offsets -- array of K+1 indices into A, B such that set k is
+                A[offsets[k]:offsets[k + 1]] (default None, A is KxNx2)
+        returns:
+            Kx3x3 numpy array of homogeneous affine matrices
+        raises:
+            EstimationError if inputs do not match or a set is empty
+        '''
+        A = np.asarray(A, dtype=np.float64)
+        B = np.asarray(B, dtype=np.float64)
+        if A.shape != B.shape or A.shape[-1] != 2:
+            raise EstimationError(
+                'shape mismatch! A shape: {}, B shape {}'.format(
+                    A.shape, B.shape))
+        if offsets is None:
+            if A.ndim != 3:
+                raise EstimationError(
+                    'expected KxNx2 points without offsets, got {}'.format(
+                        A.shape))
+            K, N = A.shape[:2]
+            offsets = np.arange(K + 1) * N
+            A = A.reshape(-1, 2)
+            B = B.reshape(-1, 2)
+        offsets = np.asarray(offsets)
+        counts = np.diff(offsets)
+        if (A.ndim != 2 or offsets[0] != 0 or offsets[-1] != A.shape[0] or
+                np.any(counts <= 0)):
+            raise EstimationError(
+                'offsets must increase from 0 to {}'.format(A.shape[0]))
+
+        K = counts.shape[0]
+        group = np.repeat(np.arange(K), counts)
+
+        def group_sum(values):
+            return np.column_stack([
+                np.bincount(group, weights=v, minlength=K) for v in values.T])
+
+        meanA = group_sum(A) / counts[:, np.newaxis]
+        meanB = group_sum(B) / counts[:, np.newaxis]
+        a = A - meanA[group]
+        b = B - meanB[group]
+        sums = group_sum(np.column_stack([
+            a[:, 0] * a[:, 0], a[:, 0] * a[:, 1], a[:, 1] * a[:, 1],
+            a[:, 0] * b[:, 0], a[:, 0] * b[:, 1],
+            a[:, 1] * b[:, 0], a[:, 1] * b[:, 1]]))
+        Saa = sums[:, [0, 1, 1, 2]].reshape(K, 2, 2)
+        Sab = sums[:, 3:].reshape(K, 2, 2)
+
+        # centered b = a L, so the linear part of the affine is L.T
+        L = np.matmul(np.linalg.pinv(Saa), Sab)
+        T = np.zeros((K, 3, 3))
+        T[:, :2, :2] = L.transpose(0, 2, 1)
+        T[:, :2, 2] = meanB - np.einsum('kij,kj->ki', T[:, :2, :2], meanA)
+        T[:, 2, 2] = 1.
+        return T
 
-        (Tvec, residuals, rank, s) = np.linalg.lstsq(M, Y)
-        return Tvec
+    @staticmethod
+    def estimate_batch(A, B, offsets=None):
+        '''
+        estimate many affine models in one call (see fit_batch)
+        returns:
+            list of AffineModel objects
+        '''
+        models = []
+        for M in AffineModel.fit_batch(A, B, offsets=offsets):
+            model = AffineModel()
+            model.M = M
+            models.append(model)
+        return models
 
     def estimate(self, A, B, return_params=True, **kwargs):
         Tvec = self.fit(A, B, **kwargs)
@@ -267,7 +939,6 @@ class AffineModel(Transform):
         self.M11 = Tvec[3, 0]
         self.B0 = Tvec[4, 0]
         self.B1 = Tvec[5, 0]
-        self.load_M()
         if return_params:
             return self.M
 
@@ -356,7 +1027,8 @@ class AffineModel(Transform):
 
 
 class TranslationModel(AffineModel):
-    className = 'mpicbg.trakem2.transform.TranslationModel2D'
+    __slots__ = ()
+    className = _ClassName('mpicbg.trakem2.transform.TranslationModel2D')
 
     def __init__(self, *args, **kwargs):
         super(TranslationModel, self).__init__(*args, **kwargs)
@@ -368,7 +1040,6 @@ class TranslationModel(AffineModel):
         tx, ty = map(float(dataString.split(' ')))
         self.B0 = tx
         self.B1 = ty
-        self.load_M()
 
     @staticmethod
     def fit(src, dst):
@@ -384,7 +1055,8 @@ class TranslationModel(AffineModel):
 
 
 class RigidModel(AffineModel):
-    className = 'mpicbg.trakem2.transform.RigidModel2D'
+    __slots__ = ()
+    className = _ClassName('mpicbg.trakem2.transform.RigidModel2D')
 
     def __init__(self, *args, **kwargs):
         super(RigidModel, self).__init__(*args, **kwargs)
@@ -400,7 +1072,6 @@ class RigidModel(AffineModel):
         self.M11 = np.sin(theta)
         self.B0 = tx
         self.B1 = ty
-        self.load_M()
 
     @staticmethod
     def fit(src, dst, rigid=True, **kwargs):
@@ -450,7 +1121,8 @@ class RigidModel(AffineModel):
 
 
 class SimilarityModel(RigidModel):
-    className = 'mpicbg.trakem2.transform.SimilarityModel2D'
+    __slots__ = ()
+    className = _ClassName('mpicbg.trakem2.transform.SimilarityModel2D')
 
     def __init__(self, *args, **kwargs):
         super(SimilarityModel, self).__init__(*args, **kwargs)
@@ -466,7 +1138,6 @@ class SimilarityModel(RigidModel):
         self.M11 = s * np.sin(theta)
         self.B0 = tx
         self.B1 = ty
-        self.load_M()
 
     @staticmethod
     def fit(src, dst, rigid=False, **kwargs):
@@ -504,14 +1175,22 @@ class Polynomial2DTransform(Transform):
     order = integer degree of polynomial to fit when using src,dst
 
 
+    Copies of the transform (as returned for every tile by
+        load_leaf_json, see LeafCache) share params until a copy accesses
+        them, when it takes its own copy.
+
     TODO:
         fall back to Affine Model in special cases
     '''
-    className = 'mpicbg.trakem2.transform.PolynomialTransform2D'
+    __slots__ = ('_params', '_shared')
+    className = _ClassName('mpicbg.trakem2.transform.PolynomialTransform2D')
+    # maximum number of points evaluated at once by tform
+    DEFAULT_CHUNKSIZE = 2 ** 20
 
     def __init__(self, dataString=None, src=None, dst=None, order=2,
                  force_polynomial=True, params=None, identity=False,
                  json=None, **kwargs):
+        self._shared = False
         if json is not None:
             self.from_dict(json)
         else:
@@ -530,6 +1209,20 @@ class Polynomial2DTransform(Transform):
                                           'not supported {}')
             self.transformId = None
 
+    # parameters are read internally through _params, so that copies
+    #     evaluating the transform keep sharing them
+    params = _shared_array('params', dtype=None)
+
+    def _own_arrays(self):
+        if getattr(self, '_params', None) is not None:
+            self._params = self._params.copy()
+        self._shared = False
+
+    def __copy__(self):
+        other = super(Polynomial2DTransform, self).__copy__()
+        self._shared = other._shared = True
+        return other
+
     @property
     def is_affine(self):
         '''TODO allow default to Affine'''
@@ -538,20 +1231,60 @@ class Polynomial2DTransform(Transform):
 
     @property
     def order(self):
-        no_coeffs = len(self.params.ravel())
+        no_coeffs = len(self._params.ravel())
         return int((abs(np.sqrt(4 * no_coeffs + 1)) - 3) / 2)
 
     @property
     def dataString(self):
-        return Polynomial2DTransform._dataStringfromParams(self.params)
+        return Polynomial2DTransform._dataStringfromParams(self._params)
 
     @staticmethod
-    def fit(src, dst, order=2):
-        xs = src[:, 0]
-        ys = src[:, 1]
-        xd = dst[:, 0]
-        yd = dst[:, 1]
-        rows = src.shape[0]
+    def _denormalization(order, offset, scale):
+        '''
+        matrix D such that params fit to coordinates (x - offset) / scale
+            are params.dot(D) in the original coordinates, from the
+            binomial expansion of each normalized monomial
+        '''
+        def index(p, q):
+            # index of monomial x ** p * y ** q
+            return (p + q) * (p + q + 1) // 2 + q
+
+        def binomial_terms(n, shift):
+            # coefficients of t ** a in (t - shift) ** n for a in 0..n
+            return [factorial(n) // (factorial(a) * factorial(n - a)) *
+                    (-shift) ** (n - a) for a in range(n + 1)]
+
+        nterms = (order + 1) * (order + 2) // 2
+        D = np.zeros((nterms, nterms))
+        for j in range(order + 1):
+            for q in range(j + 1):
+                p = j - q
+                xterms = binomial_terms(p, offset[0])
+                yterms = binomial_terms(q, offset[1])
+                for a in range(p + 1):
+                    for b in range(q + 1):
+                        D[index(p, q), index(a, b)] += (
+                            xterms[a] * yterms[b] / scale ** j)
+        return D
+
+    @staticmethod
+    def fit(src, dst, order=2, return_residual=False):
+        '''
+        least squares fit of polynomial coefficients mapping src to dst,
+            solving both axes against a shared monomial design matrix.
+            Coordinates are normalized before fitting at order 3 and above.
+        input:
+            src -- Nx2 numpy array of source points
+            dst -- Nx2 numpy array of destination points
+        keyword arguments:
+            order -- integer order of polynomial (default 2)
+            return_residual -- boolean whether to also return the root
+                mean square distance between transformed src and dst
+        returns:
+            2xK numpy array of coefficients (and residual if requested)
+        raises:
+            EstimationError if the points cannot be fit
+        '''
         no_coeff = (order + 1) * (order + 2)
 
         if len(src) != len(dst):
@@ -563,25 +1296,50 @@ class Polynomial2DTransform(Transform):
                 'order {} is too large to fit {} points!'.format(
                     order, len(src)))
 
-        A = np.zeros([rows * 2, no_coeff + 1])
-        pidx = 0
-        for j in range(order + 1):
-            for i in range(j + 1):
-                A[:rows, pidx] = xs ** (j - i) * ys ** i
-                A[rows:, pidx + no_coeff // 2] = xs ** (j - i) * ys ** i
-                pidx += 1
-
-        A[:rows, -1] = xd
-        A[rows:, -1] = yd
-
-        # right singular vector corresponding to smallest singular value
-        _, s, V = svd(A)
-        Vsm = V[np.argmin(s), :]  # never trust computers
-        return (-Vsm[:-1] / Vsm[-1]).reshape((2, no_coeff // 2))
+        src = np.asarray(src, dtype=np.float64)
+        dst = np.asarray(dst, dtype=np.float64)
+        normalize = order >= 3
+        if normalize:
+            offset = src.mean(axis=0)
+            scale = np.abs(src - offset).max() or 1.
+            design_pts = (src - offset) / scale
+        else:
+            design_pts = src
+        design = Polynomial2DTransform._monomial_basis(
+            design_pts[:, 0], design_pts[:, 1], order)
+        try:
+            X = np.linalg.lstsq(design, dst, rcond=-1)[0]
+        except (LinAlgError, ValueError) as e:
+            raise EstimationError('Could not fit Polynomial: {}'.format(e))
+        params = X.T
+        if normalize:
+            params = params.dot(Polynomial2DTransform._denormalization(
+                order, offset, scale))
+        if not return_residual:
+            return params
+        residual = np.sqrt(np.mean(np.sum(
+            (Polynomial2DTransform(params=params).tform(src) - dst) ** 2,
+            axis=1)))
+        return params, residual
 
     def estimate(self, src, dst, order=2,
                  test_coords=True, max_tries=100, return_params=True,
                  **kwargs):
+        '''
+        estimate coefficients mapping src to dst (see fit)
+        input:
+            src -- Nx2 numpy array of source points
+            dst -- Nx2 numpy array of destination points
+        keyword arguments:
+            order -- integer order of polynomial (default 2)
+            test_coords -- boolean whether to require the fit to reproduce
+                dst within atol, rtol (default 1e-3, 0) given as kwargs
+            max_tries -- ignored, retained for compatibility -- the fit is
+                deterministic so it is solved once
+            return_params -- boolean whether to return the coefficients
+        raises:
+            EstimationError if the fit fails or does not reproduce dst
+        '''
         def fitgood(src, dst, params, atol=1e-3, rtol=0, **kwargs):
             result = Polynomial2DTransform(params=params).tform(src)
             t = np.allclose(
@@ -589,22 +1347,13 @@ class Polynomial2DTransform(Transform):
                 atol=atol, rtol=rtol)
             return t
 
-        estimated = False
-        tries = 0
-        while (tries < max_tries and not estimated):
-            tries += 1
-            try:
-                params = Polynomial2DTransform.fit(src, dst, order=order)
-            except (LinAlgError, ValueError) as e:
-                logger.debug('Encountered error {}'.format(e))
-                continue
-            estimated = (fitgood(src, dst, params, **kwargs) if
-                         test_coords else True)
-
-        if tries == max_tries and not estimated:
-            raise EstimationError('Could not fit Polynomial '
-                                  'in {} attempts!'.format(tries))
-        logger.debug('fit parameters in {} attempts'.format(tries))
+        params, residual = Polynomial2DTransform.fit(
+            src, dst, order=order, return_residual=True)
+        logger.debug('fit parameters with rms residual {}'.format(residual))
+        if test_coords and not fitgood(src, dst, params, **kwargs):
+            raise EstimationError(
+                'Polynomial fit does not reproduce destination points '
+                '(rms residual {})'.format(residual))
         self.params = params
         if return_params:
             return self.params
@@ -627,19 +1376,127 @@ class Polynomial2DTransform(Transform):
             [[float(d) for d in raveled_params[:len(raveled_params)/2]],
              [float(d) for d in raveled_params[len(raveled_params)/2:]]])
 
-    def tform(self, points):
-        dst = np.zeros(points.shape)
-        x = points[:, 0]
-        y = points[:, 1]
-
-        o = int((-3 + np.sqrt(9 - 4 * (2 - len(self.params.ravel())))) / 2)
-        pidx = 0
-        for j in range(o + 1):
-            for i in range(j + 1):
-                dst[:, 0] += self.params[0, pidx] * x ** (j - i) * y ** i
-                dst[:, 1] += self.params[1, pidx] * x ** (j - i) * y ** i
-                pidx += 1
-        return dst
+    @staticmethod
+    def _monomial_basis(x, y, order, out=None):
+        '''
+        design matrix of the monomials x ** (j - i) * y ** i for
+            j in 0..order, i in 0..j, in the order of the parameters
+        input:
+            x, y -- length N numpy arrays of coordinates
+            order -- integer order of polynomial
+        keyword arguments:
+            out -- Nx(number of terms) numpy array to fill
+        returns:
+            Nx(number of terms) numpy array
+        '''
+        nterms = (order + 1) * (order + 2) // 2
+        basis = (np.empty((x.shape[0], nterms), dtype=x.dtype)
+                 if out is None else out)
+        basis[:, 0] = 1
+        start = 0
+        # terms of degree j are those of degree j - 1 times x,
+        #     and the last of them times y
+        for j in range(1, order + 1):
+            prev = basis[:, start:start + j]
+            start += j
+            np.multiply(prev, x[:, np.newaxis], out=basis[:, start:start + j])
+            np.multiply(prev[:, -1], y, out=basis[:, start + j])
+        return basis
+
+    def tform(self, points, dtype=np.float64, chunksize=None, out=None):
+        '''
+        apply the transform to points
+        input:
+            points -- Nx2 numpy array of points
+        keyword arguments:
+            dtype -- numpy float type to compute with (default float64)
+            chunksize -- maximum number of points evaluated at once,
+                bounding memory used for the monomial basis
+                (default DEFAULT_CHUNKSIZE)
+            out -- Nx2 numpy array to write transformed points into
+        returns:
+            Nx2 numpy array of transformed points
+        '''
+        npoints = points.shape[0]
+        if out is None:
+            out = np.empty((npoints, 2), dtype=dtype)
+        elif out.shape != (npoints, 2):
+            raise ConversionError(
+                'out must be of shape {} -- got {}'.format(
+                    (npoints, 2), out.shape))
+        chunksize = max(1, min(npoints,
+                               chunksize or self.DEFAULT_CHUNKSIZE))
+
+        nterms = self._params.shape[1]
+        order = int((np.sqrt(8 * nterms + 1) - 3) / 2)
+        params = self._params.astype(dtype).T
+        basis = np.empty((chunksize, nterms), dtype=dtype)
+        for start in range(0, npoints, chunksize):
+            chunk = points[start:start + chunksize]
+            b = self._monomial_basis(
+                chunk[:, 0].astype(dtype), chunk[:, 1].astype(dtype),
+                order, out=basis[:chunk.shape[0]])
+            out[start:start + chunk.shape[0]] = np.dot(b, params)
+        return out
+
+    def jacobian(self, points):
+        '''
+        partial derivatives of the transform at points
+        input:
+            points -- Nx2 numpy array of points
+        returns:
+            Nx2x2 numpy array of [[dx'/dx, dx'/dy], [dy'/dx, dy'/dy]]
+        '''
+        nterms = self._params.shape[1]
+        order = int((np.sqrt(8 * nterms + 1) - 3) / 2)
+        # derivative of x ** p * y ** q is p * x ** (p - 1) * y ** q
+        #     and q * x ** p * y ** (q - 1), terms of one order lower
+        dx = np.zeros((2, max(1, order * (order + 1) // 2)))
+        dy = np.zeros_like(dx)
+        for j in range(1, order + 1):
+            for q in range(j + 1):
+                p = j - q
+                c = self._params[:, j * (j + 1) // 2 + q]
+                if p:
+                    dx[:, (j - 1) * j // 2 + q] += p * c
+                if q:
+                    dy[:, (j - 1) * j // 2 + q - 1] += q * c
+        basis = self._monomial_basis(
+            points[:, 0].astype(np.float64), points[:, 1].astype(np.float64),
+            max(0, order - 1))
+        return np.stack([basis.dot(dx.T), basis.dot(dy.T)], axis=-1)
+
+    def inverse_tform(self, points, tol=1e-6, max_iterations=20,
+                      return_converged=False):
+        '''
+        invert the transform at points by batched Newton iterations
+            starting from the inverse of its linear terms
+        input:
+            points -- Nx2 numpy array of points
+        keyword arguments:
+            tol -- distance from points within which an inverted point
+                has converged (default 1e-6)
+            max_iterations -- maximum number of Newton iterations
+                (default 20)
+            return_converged -- boolean whether to also return a boolean
+                numpy array marking points which converged
+        returns:
+            Nx2 numpy array of points (and converged array if requested).
+                Points which did not converge are NaN.
+        '''
+        points = np.asarray(points, dtype=np.float64)
+        linear = np.zeros((2, 3))
+        linear[:, :min(3, self._params.shape[1])] = self._params[:, :3]
+        try:
+            initial = np.linalg.solve(
+                linear[:, 1:], (points - linear[:, 0]).T).T
+        except LinAlgError:
+            initial = points.copy()
+        result, converged = _newton_inverse(
+            self.tform, points, initial, jacobian=self.jacobian, tol=tol,
+            max_iterations=max_iterations)
+        result[~converged] = np.nan
+        return (result, converged) if return_converged else result
 
     def coefficients(self, order=None):
         '''
@@ -663,7 +1520,8 @@ class Polynomial2DTransform(Transform):
                 'order {} not supported'.format(
                     self.dataString, self.order, order))
         new_params = np.zeros([2, self.coefficients(order) // 2])
-        new_params[:self.params.shape[0], :self.params.shape[1]] = self.params
+        new_params[:self._params.shape[0], :self._params.shape[1]] = (
+            self._params)
         return Polynomial2DTransform(params=new_params)
 
     @staticmethod
@@ -679,21 +1537,187 @@ class Polynomial2DTransform(Transform):
             [aff.M[1, 2], aff.M[1, 0], aff.M[1, 1]]]))
 
 
+class NonLinearCoordinateTransform(Transform):
+    '''
+    mpicbg NonLinearCoordinateTransform, the lens correction model of
+        TrakEM2: a polynomial of the given dimension whose monomials
+        (excluding the constant) are normalized by normMean and normVar
+        before being weighted by beta.  The normalization is folded into
+        an equivalent Polynomial2DTransform which evaluates and inverts
+        point arrays.
+    NonLinearCoordinateTransform(dataString=None, dimension=None,
+                                 beta=None, normMean=None, normVar=None,
+                                 width=None, height=None, json=None)
+    init:
+        json -- json dictionary representation of the transform
+        dataString -- dataString representation of the transform from
+            mpicbg, kept verbatim for to_dict until a parameter changes
+        dimension -- integer order of the polynomial
+        beta -- (length)x2 numpy array of coefficients, where length is
+            (dimension + 1) * (dimension + 2) / 2
+        normMean, normVar -- length numpy arrays of monomial normalization
+        width, height -- integer size of the images corrected
+
+    Copies of the transform (as returned for every tile by
+        load_leaf_json, see LeafCache) share beta, normMean and normVar
+        until a copy accesses them, when it takes its own copies.
+    '''
+    __slots__ = ('dimension', '_beta', '_normMean', '_normVar', 'width',
+                 'height', '_shared', '_source', '_polynomial')
+    className = _ClassName(
+        'mpicbg.trakem2.transform.NonLinearCoordinateTransform')
+
+    def __init__(self, dataString=None, dimension=None, beta=None,
+                 normMean=None, normVar=None, width=None, height=None,
+                 json=None):
+        self._shared = False
+        if json is not None:
+            self.from_dict(json)
+        else:
+            self.className = self.__class__.className
+            if dataString is not None:
+                self._process_dataString(dataString)
+            else:
+                self.dimension = dimension
+                self.beta = beta
+                self.normMean = normMean
+                self.normVar = normVar
+                self.width = width
+                self.height = height
+            self.transformId = None
+
+    beta = _shared_array('beta')
+    normMean = _shared_array('normMean')
+    normVar = _shared_array('normVar')
+
+    def _own_arrays(self):
+        for attr in ('_beta', '_normMean', '_normVar'):
+            values = getattr(self, attr)
+            if values is not None:
+                setattr(self, attr, values.copy())
+        self._shared = False
+
+    def __copy__(self):
+        other = super(NonLinearCoordinateTransform, self).__copy__()
+        self._shared = other._shared = True
+        return other
+
+    @property
+    def length(self):
+        '''number of terms of the polynomial'''
+        return self._beta.shape[0]
+
+    def _fingerprint(self):
+        return (self.dimension, self.width, self.height,
+                self._beta.tobytes(), self._normMean.tobytes(),
+                self._normVar.tobytes())
+
+    def _process_dataString(self, datastring):
+        fields = datastring.split()
+        dimension, length = int(fields[0]), int(fields[1])
+        if len(fields) != 4 + 4 * length:
+            raise ConversionError(
+                'NonLinearCoordinateTransform dataString has {} fields '
+                '-- expected {} for length {}'.format(
+                    len(fields), 4 + 4 * length, length))
+        values = np.array(fields[2:2 + 4 * length], dtype=np.float64)
+        self.dimension = dimension
+        self._shared = False
+        self._beta = values[:2 * length].reshape(length, 2)
+        self._normMean = values[2 * length:3 * length]
+        self._normVar = values[3 * length:]
+        self.width = int(fields[-2])
+        self.height = int(fields[-1])
+        self._source = (datastring, self._fingerprint())
+        if length == (dimension + 1) * (dimension + 2) // 2:
+            # build the polynomial now so that copies share it
+            self._get_polynomial()
+
+    @property
+    def dataString(self):
+        source = getattr(self, '_source', None)
+        if source is not None and source[1] == self._fingerprint():
+            return source[0]
+
+        def fmt(values):
+            return ''.join('{} '.format(repr(float(v)).replace('e', 'E'))
+                           for v in values)
+        return '{} {} {}{}{}{} {} '.format(
+            self.dimension, self.length, fmt(self._beta.ravel()),
+            fmt(self._normMean), fmt(self._normVar), self.width,
+            self.height)
+
+    @dataString.setter
+    def dataString(self, datastring):
+        self._process_dataString(datastring)
+
+    def as_polynomial(self):
+        '''
+        returns:
+            Polynomial2DTransform evaluating identically to this transform
+        raises:
+            ConversionError if the number of terms does not match dimension
+        '''
+        return copy.copy(self._get_polynomial())
+
+    def _get_polynomial(self):
+        # the polynomial is cached for the current parameters and shared
+        #     by copies, so it is not handed out to be modified
+        cached = getattr(self, '_polynomial', None)
+        fingerprint = self._fingerprint()
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        nterms = (self.dimension + 1) * (self.dimension + 2) // 2
+        if self.length != nterms:
+            raise ConversionError(
+                'NonLinearCoordinateTransform of dimension {} has {} terms '
+                '-- expected {}'.format(self.dimension, self.length, nterms))
+        # the monomials x ** (i - q) * y ** q of degree i = 1..dimension
+        #     are ordered as in Polynomial2DTransform and normalized by
+        #     (m - normMean) / normVar, while the last term is constant 100
+        scaled = self._beta[:-1] / self._normVar[:-1, np.newaxis]
+        params = np.empty((2, nterms))
+        params[:, 0] = (100. * self._beta[-1] -
+                        self._normMean[:-1].dot(scaled))
+        params[:, 1:] = scaled.T
+        polynomial = Polynomial2DTransform(params=params)
+        self._polynomial = (fingerprint, polynomial)
+        return polynomial
+
+    def tform(self, points, **kwargs):
+        '''
+        apply the transform to points
+        input:
+            points -- Nx2 numpy array of points
+        keyword arguments:
+            see Polynomial2DTransform.tform
+        returns:
+            Nx2 numpy array of transformed points
+        '''
+        return self._get_polynomial().tform(points, **kwargs)
+
+    def jacobian(self, points):
+        '''see Polynomial2DTransform.jacobian'''
+        return self._get_polynomial().jacobian(points)
+
+    def inverse_tform(self, points, **kwargs):
+        '''see Polynomial2DTransform.inverse_tform'''
+        return self._get_polynomial().inverse_tform(points, **kwargs)
+
+
 def estimate_dstpts(transformlist, src=None):
     '''
     estimate destination points for list of transforms
     input:
-        transformlist -- list of transform classes with tform method
+        transformlist -- TransformList or (nested) list of transform
+            classes with tform method.  A TransformList caches its
+            compiled evaluation plan (see TransformList.compile)
         src -- Nx2 numpy array of source points
     output: Nx2 numpt array of destination points
     '''
-    dstpts = src
-    for tform in transformlist:
-        if isinstance(tform, list):
-            dstpts = estimate_dstpts(tform, dstpts)
-        else:
-            dstpts = tform.tform(dstpts)
-    return dstpts
+    if not isinstance(transformlist, TransformList):
+        transformlist = TransformList(tforms=list(transformlist))
+    return transformlist.tform(src)
 
 
 def estimate_transformsum(transformlist, src=None, order=2):
@@ -7,6 +7,12 @@ import logging
 import inspect
 import copy
 import json
+from collections import deque
+from multiprocessing.pool import ThreadPool
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 from .errors import RenderError
 
 
@@ -133,10 +139,52 @@ def defaultifNone(val, default=None):
     return val if val is not None else default
 
 
+class SlotsPickleMixin(object):
+    '''
+    base for classes defining __slots__ to keep instances picklable
+        with every pickle protocol (python 2 refuses protocols 0 and 1
+        for slotted objects without __getstate__).  Subclasses must
+        define __slots__ themselves to avoid gaining a __dict__.
+    '''
+    __slots__ = ()
+
+    @staticmethod
+    def _slot_descriptors(obj):
+        # use the slot descriptors themselves, since subclasses may
+        #     shadow a slot with a property
+        for cls in type(obj).__mro__:
+            for k in getattr(cls, '__slots__', ()):
+                yield k, cls.__dict__[k]
+
+    def __getstate__(self):
+        state = {}
+        for k, slot in self._slot_descriptors(self):
+            try:
+                state[k] = slot.__get__(self)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        for k, slot in self._slot_descriptors(self):
+            if k in state:
+                slot.__set__(self, state[k])
+
+
+def unwrap(f):
+    '''
+    get the function underneath decorators which set __wrapped__
+        (as functools.wraps does in python 3)
+    '''
+    while hasattr(f, '__wrapped__'):
+        f = f.__wrapped__
+    return f
+
+
 def fitargspec(f, oldargs, oldkwargs):
     ''' fit function argspec given input args tuple and kwargs dict'''
     try:
-        args, varargs, keywords, defaults = inspect.getargspec(f)
+        args, varargs, keywords, defaults = inspect.getargspec(unwrap(f))
         num_expected_args = len(args) - len(defaults)
         new_args = tuple(oldargs[:num_expected_args])
         new_kwargs = copy.copy(oldkwargs)
@@ -147,3 +195,58 @@ def fitargspec(f, oldargs, oldkwargs):
         logger.error('Cannot fit argspec for {}'.format(f))
         logger.error(e)
         return oldargs, oldkwargs
+
+
+def imap_bounded(f, iterable, poolsize=None, readahead=None, ordered=True):
+    '''
+    lazily map a function over an iterable on a pool of threads
+    input:
+        f -- function of a single item
+        iterable -- items to map, consumed only as results are yielded
+    keyword arguments:
+        poolsize -- int number of threads (default 10)
+        readahead -- int maximum number of items submitted but not yet
+            yielded (default 2 * poolsize).  Bounds the number of results
+            held in memory at once.
+        ordered -- boolean whether to yield results in the order of
+            iterable (default True) or as soon as they complete
+    yields:
+        (item, f(item)) tuples
+    raises:
+        any exception raised by f, when its result would have been yielded
+    '''
+    poolsize = defaultifNone(poolsize, 10)
+    readahead = max(defaultifNone(readahead, 2 * poolsize), 1)
+    completed = Queue()
+
+    def run(item):
+        try:
+            return item, True, f(item)
+        except Exception as e:
+            return item, False, e
+
+    items = iter(iterable)
+    pending = deque()
+    pool = ThreadPool(poolsize)
+    try:
+        while True:
+            while len(pending) < readahead:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                pending.append(pool.apply_async(
+                    run, (item,),
+                    callback=(None if ordered else completed.put)))
+            if not pending:
+                break
+            if ordered:
+                item, success, result = pending.popleft().get()
+            else:
+                pending.pop()
+                item, success, result = completed.get()
+            if not success:
+                raise result
+            yield item, result
+    finally:
+        pool.terminate()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+'''
+export rendered z sections of a stack into an array on disk
+'''
+import json
+import logging
+import math
+import os
+import numpy as np
+from .image import get_bb_image
+from .render import renderaccess
+from .stack import get_stack_bounds, get_z_values_for_stack
+from .errors import RenderError
+from .utils import NullHandler, imap_bounded
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+VOLUME_LAYOUTS = ['memmap', 'chunks']
+PROGRESS_FILE = 'progress.json'
+VOLUME_FILE = 'volume.npy'
+
+
+def _chunk_file(i):
+    return 'z_{:06d}.npy'.format(i)
+
+
+def _read_progress(path):
+    try:
+        with open(os.path.join(path, PROGRESS_FILE), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_progress(path, progress):
+    # replace the file in one step so an interruption never corrupts it
+    tmp = os.path.join(path, '.' + PROGRESS_FILE)
+    with open(tmp, 'w') as f:
+        json.dump(progress, f)
+    os.rename(tmp, os.path.join(path, PROGRESS_FILE))
+
+
+def load_volume(path, mode='r'):
+    '''
+    open an exported volume
+    input:
+        path -- directory of the export (see export_volume)
+    keyword arguments:
+        mode -- np.memmap mode to open the data with (default 'r')
+    returns:
+        tuple of (progress dictionary with the parameters of the export
+                  and the list of z values done,
+                  np.memmap of shape (number of z, rows, columns[, bands])
+                  for the memmap layout, or list of np.memmaps of the
+                  sections done for the chunks layout)
+    raises:
+        RenderError if path does not hold an export
+    '''
+    progress = _read_progress(path)
+    if progress is None:
+        raise RenderError('no exported volume in {}'.format(path))
+    if progress['layout'] == 'memmap':
+        return progress, np.load(os.path.join(path, VOLUME_FILE),
+                                 mmap_mode=mode)
+    return progress, [
+        np.load(os.path.join(path, _chunk_file(progress['zValues'].index(z))),
+                mmap_mode=mode)
+        for z in progress['zValues'] if z in set(progress['done'])]
+
+
+@renderaccess
+def export_volume(stack, path, zValues=None, bounds=None, scale=1.0,
+                  layout='memmap', poolsize=None, readahead=None,
+                  tilesize=None, img_format=None, minIntensity=None,
+                  maxIntensity=None, filter=None, host=None, port=None,
+                  owner=None, project=None, session=None, render=None,
+                  **kwargs):
+    '''
+    render the same box of a range of z sections and write each as it
+        arrives into a preallocated array on disk, fetching sections
+        concurrently.  Progress is recorded after every section, so an
+        interrupted export is resumed by calling export_volume again with
+        the same arguments; an export with other arguments is started over.
+    input:
+        stack -- string render stack
+        path -- directory to write to (created if missing)
+    keyword arguments:
+        zValues -- list of z values to export (default all in stack)
+        bounds -- (x, y, width, height) of the box to render, rounded
+            out to whole pixels (default the bounds of the stack)
+        scale -- float scale at which to render (default 1.0)
+        layout -- 'memmap' (default) for a single volume.npy holding a
+            (number of z, rows, columns[, bands]) array, or 'chunks' for
+            one .npy file per section
+        poolsize -- number of sections fetched at once (default 10)
+        readahead -- maximum number of sections requested but not yet
+            written (default 2 * poolsize)
+        tilesize -- render each section in tiles of this size
+            (see image.get_bb_image)
+        img_format -- image format requested from render (default png)
+        minIntensity, maxIntensity, filter -- see image.get_bb_image
+        render -- render connect object (or host, port, owner, project)
+        session -- requests.session (default pooled session)
+    returns:
+        tuple of (progress dictionary, volume) as returned by load_volume
+    raises:
+        RenderError if a section cannot be rendered
+    '''
+    if layout not in VOLUME_LAYOUTS:
+        raise RenderError('unknown volume layout {} -- expected one of '
+                          '{}'.format(layout, VOLUME_LAYOUTS))
+    if zValues is None:
+        zValues = get_z_values_for_stack(stack, host=host, port=port,
+                                         owner=owner, project=project,
+                                         session=session)
+    if bounds is None:
+        b = get_stack_bounds(stack, host=host, port=port, owner=owner,
+                             project=project, session=session)
+        bounds = (b['minX'], b['minY'], b['maxX'] - b['minX'],
+                  b['maxY'] - b['minY'])
+    # round the box out to whole pixels so that it covers its edges
+    x, y, width, height = bounds
+    minX, minY = int(math.floor(x)), int(math.floor(y))
+    bounds = [minX, minY, int(math.ceil(x + width)) - minX,
+              int(math.ceil(y + height)) - minY]
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    parameters = {'stack': stack, 'zValues': list(zValues),
+                  'bounds': bounds, 'scale': scale, 'layout': layout,
+                  'img_format': img_format, 'minIntensity': minIntensity,
+                  'maxIntensity': maxIntensity, 'filter': filter}
+    progress = _read_progress(path)
+    if progress is None or any(progress.get(k) != v
+                               for k, v in parameters.items()):
+        if progress is not None:
+            logger.warning('restarting export in {} with new '
+                           'parameters'.format(path))
+        progress = dict(parameters, done=[], dtype=None, shape=None)
+        _write_progress(path, progress)
+    done = set(progress['done'])
+    missing = [(i, z) for i, z in enumerate(zValues) if z not in done]
+    logger.debug('exporting {} of {} sections of {}'.format(
+        len(missing), len(zValues), stack))
+
+    def get_section(z, out=None):
+        image = get_bb_image(
+            stack, z, *bounds, scale=scale, tilesize=tilesize,
+            img_format=img_format, minIntensity=minIntensity,
+            maxIntensity=maxIntensity, filter=filter, out=out,
+            host=host, port=port, owner=owner, project=project,
+            session=session, render=render)
+        if isinstance(image, RenderError):
+            raise image
+        return image
+
+    def save(i, image):
+        if layout == 'memmap':
+            volume[i] = image
+        else:
+            np.save(os.path.join(path, _chunk_file(i)), image)
+
+    volume = None
+    if missing and progress['dtype'] is None:
+        # the first section gives the type and shape of the volume
+        i, z = missing.pop(0)
+        image = get_section(z)
+        progress['dtype'] = image.dtype.str
+        progress['shape'] = list(image.shape)
+        if layout == 'memmap':
+            volume = np.lib.format.open_memmap(
+                os.path.join(path, VOLUME_FILE), mode='w+',
+                dtype=image.dtype, shape=(len(zValues), ) + image.shape)
+        save(i, image)
+        progress['done'].append(z)
+        _write_progress(path, progress)
+    if layout == 'memmap' and volume is None and missing:
+        volume = np.load(os.path.join(path, VOLUME_FILE), mmap_mode='r+')
+
+    def export_section(item):
+        # sections are written by the worker threads, each to its own slice
+        i, z = item
+        if layout == 'memmap' and tilesize is not None:
+            get_section(z, out=volume[i])
+        else:
+            save(i, get_section(z))
+
+    for (i, z), result in imap_bounded(export_section, missing,
+                                       poolsize=poolsize,
+                                       readahead=readahead, ordered=False):
+        if volume is not None:
+            volume.flush()
+        progress['done'].append(z)
+        _write_progress(path, progress)
+    if volume is not None:
+        volume.flush()
+    return load_volume(path)
@@ -0,0 +1,144 @@
+'''
+minimal in-process stand-in for render-ws used to exercise web api calls
+'''
+import json
+import threading
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+import renderapi
+import rendersettings
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeRenderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        path = self.path.split('?')[0]
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else None
+        self.server.fake.requests.append((self.command, self.path, body))
+        try:
+            content, content_type = self.server.fake.route(
+                self.command, path)
+        except KeyError:
+            content, content_type = b'not found: ' + path.encode(), None
+            status = 404
+        else:
+            status = 201 if self.command == 'PUT' else 200
+            if callable(content):
+                content = content(self.path, body)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type or 'text/plain')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeRenderServer(object):
+    '''
+    serves registered responses to render api requests on localhost
+    usage:
+        with FakeRenderServer() as server:
+            server.add_json('/zValues/', [0, 1], stack='mystack')
+            renderapi.stack.get_z_values_for_stack(
+                'mystack', render=server.render)
+    '''
+    owner = rendersettings.DEFAULT_RENDER['owner']
+    project = rendersettings.DEFAULT_RENDER['project']
+
+    def __init__(self):
+        self.routes = {}
+        self.prefixes = []
+        self.requests = []
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), FakeRenderHandler)
+        self.httpd.fake = self
+        self.port = self.httpd.server_address[1]
+        self.render = renderapi.render.Render(
+            host='http://127.0.0.1', port=self.port,
+            owner=self.owner, project=self.project, pool_maxsize=32)
+
+    def url_path(self, endpoint, stack=None):
+        if stack is None:
+            return '/render-ws/v1' + endpoint
+        return '/render-ws/v1/owner/{}/project/{}/stack/{}{}'.format(
+            self.owner, self.project, stack, endpoint)
+
+    def add(self, endpoint, content, content_type=None, stack=None,
+            method='GET'):
+        '''register content (bytes or callable(path, body) returning
+        bytes) for a request'''
+        self.routes[(method, self.url_path(endpoint, stack))] = (
+            content, content_type)
+
+    def add_prefix(self, endpoint, content, content_type=None, stack=None,
+                   method='GET'):
+        '''register content for every request whose path starts with
+        endpoint, when no exact route matches'''
+        self.prefixes.append(
+            (method, self.url_path(endpoint, stack), content, content_type))
+
+    def route(self, method, path):
+        try:
+            return self.routes[(method, path)]
+        except KeyError:
+            for m, prefix, content, content_type in self.prefixes:
+                if m == method and path.startswith(prefix):
+                    return content, content_type
+            raise
+
+    def add_json(self, endpoint, obj, **kwargs):
+        self.add(endpoint, json.dumps(obj).encode(),
+                 content_type='application/json', **kwargs)
+
+    def requested(self, endpoint, stack=None, method='GET'):
+        '''number of requests made to an endpoint'''
+        path = self.url_path(endpoint, stack)
+        return len([r for r in self.requests
+                    if r[0] == method and r[1].split('?')[0] == path])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def load_test_tilespecs():
+    with open(rendersettings.TEST_TILESPECS_FILE, 'r') as f:
+        return json.load(f)
+
+
+def serve_stack(server, stack, tilespec_jsons, state='COMPLETE'):
+    '''register the stack-level endpoints for a list of tilespec dicts'''
+    zvalues = sorted(set(ts['z'] for ts in tilespec_jsons))
+    server.add_json('/zValues/', zvalues, stack=stack)
+    server.add_json('', {'state': state, 'currentVersion': {
+        'createTimestamp': '2017-06-29T00:00:00.000Z'}}, stack=stack)
+    for z in zvalues:
+        server.add_json('/z/%f/tile-specs' % z,
+                        [ts for ts in tilespec_jsons if ts['z'] == z],
+                        stack=stack)
+    return zvalues
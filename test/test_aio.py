@@ -0,0 +1,54 @@
+import copy
+import pytest
+import renderapi
+from fakeserver import FakeRenderServer, load_test_tilespecs, serve_stack
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeRenderServer() as server:
+        yield server
+
+
+def make_layers(n):
+    ts_json = load_test_tilespecs()
+    layers = []
+    for z in range(n):
+        for ts in ts_json:
+            d = copy.deepcopy(ts)
+            d['z'] = z
+            d['tileId'] = '{}.{}'.format(ts['tileId'], z)
+            layers.append(d)
+    return layers
+
+
+def test_aio_tile_specs(server):
+    layers = make_layers(20)
+    serve_stack(server, 'aio_stack', layers)
+
+    zvalues = renderapi.aio.get_z_values_for_stack(
+        'aio_stack', render=server.render).get()
+    assert zvalues == list(range(20))
+
+    results = [renderapi.aio.get_tile_specs_from_z(
+        'aio_stack', z, render=server.render) for z in zvalues]
+    tilespecs = renderapi.aio.gather(results, timeout=10)
+    assert ([ts.tileId for tss in tilespecs for ts in tss] ==
+            [d['tileId'] for d in layers])
+    assert server.requested('/z/%f/tile-specs' % 3, stack='aio_stack') == 1
+
+
+def test_aio_raises(server):
+    result = renderapi.aio.get_stack_bounds(
+        'no_such_stack', render=server.render)
+    with pytest.raises(renderapi.errors.RenderError):
+        result.get(10)
+
+
+def test_aio_poolsize(server):
+    serve_stack(server, 'aio_stack_small', make_layers(2))
+    renderapi.aio.set_poolsize(2)
+    assert renderapi.aio.get_pool()._processes == 2
+    assert renderapi.aio.get_z_values_for_stack(
+        'aio_stack_small', render=server.render).get(10) == [0, 1]
+    renderapi.aio.set_poolsize(renderapi.aio.DEFAULT_POOLSIZE)
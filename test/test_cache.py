@@ -0,0 +1,185 @@
+import os
+import pickle
+import pytest
+import renderapi
+from fakeserver import FakeRenderServer, load_test_tilespecs, serve_stack
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeRenderServer() as server:
+        serve_stack(server, 'complete_stack', load_test_tilespecs())
+        server.add('/state/COMPLETE', b'', stack='complete_stack',
+                   method='PUT')
+        serve_stack(server, 'loading_stack', load_test_tilespecs(),
+                    state='LOADING')
+        yield server
+
+
+def cached_render(server, **kwargs):
+    return renderapi.render.Render(
+        cache=renderapi.cache.ResponseCache(**kwargs),
+        **server.render.make_kwargs())
+
+
+def test_response_cache_lru():
+    cache = renderapi.cache.ResponseCache(maxsize=2)
+    cache.set(('h', 1, 'o', 'p', 's'), ('a', ), 1, immutable=True)
+    cache.set(('h', 1, 'o', 'p', 's'), ('b', ), 2, immutable=True)
+    assert cache.get(('h', 1, 'o', 'p', 's'), ('a', )) == (True, 1)
+    cache.set(('h', 1, 'o', 'p', 's'), ('c', ), 3, immutable=True)
+    assert cache.get(('h', 1, 'o', 'p', 's'), ('b', )) == (False, None)
+    assert len(cache) == 2
+
+    cache.set(('h', 1, 'o', 'p', 't'), ('d', ), 4, immutable=True)
+    cache.invalidate(('h', 1, 'o', 'p', 's'))
+    assert len(cache) == 1
+    assert pickle.loads(pickle.dumps(cache)).maxsize == 2
+
+
+def test_cache_immutable_stack(server):
+    render = cached_render(server)
+    for i in range(3):
+        zvalues = renderapi.stack.get_z_values_for_stack(
+            'complete_stack', render=render)
+        zvalues.append('modifying a result does not change the cache')
+    assert server.requested('/zValues/', stack='complete_stack') == 1
+
+    renderapi.stack.set_stack_state(
+        'complete_stack', 'COMPLETE', render=render)
+    zvalues = renderapi.stack.get_z_values_for_stack(
+        'complete_stack', render=render)
+    assert server.requested('/zValues/', stack='complete_stack') == 2
+    assert zvalues == [2266]
+
+
+def test_cache_mutable_stack(server):
+    render = cached_render(server, ttl=0.)
+    for i in range(2):
+        renderapi.stack.get_z_values_for_stack(
+            'loading_stack', render=render)
+    assert server.requested('/zValues/', stack='loading_stack') == 2
+
+
+def test_cache_disk_store(server, tmpdir):
+    path = os.path.join(str(tmpdir), 'responses')
+    render = cached_render(server, path=path)
+    before = server.requested('/zValues/', stack='complete_stack')
+    renderapi.stack.get_z_values_for_stack('complete_stack', render=render)
+    render.cache.close()
+
+    render = cached_render(server, path=path)
+    assert renderapi.stack.get_z_values_for_stack(
+        'complete_stack', render=render) == [2266]
+    assert server.requested(
+        '/zValues/', stack='complete_stack') == before + 1
+
+
+def test_response_cache_disk_entries(tmpdir):
+    path = os.path.join(str(tmpdir), 'responses')
+    cache = renderapi.cache.ResponseCache(maxsize=1, path=path)
+    stackkey = ('h', 1, 'o', 'p', 's')
+    for z in range(100):
+        cache.set(stackkey, ('bounds', z), z, immutable=True,
+                  version=['2017', None])
+    cache.set(('h', 1, 'o', 'p', 't'), ('bounds', 0), -1, immutable=True)
+    # each response is stored on its own next to the version of its stack
+    assert len(cache._shelf) == 100 + 1 + 2
+    assert cache.get(stackkey, ('bounds', 3),
+                     version=['2017', None]) == (True, 3)
+
+    # responses of other versions are dropped, leaving other stacks alone
+    assert cache.get(stackkey, ('bounds', 4),
+                     version=['2017', '2018']) == (False, None)
+    assert len(cache._shelf) == 2
+    cache.set(stackkey, ('bounds', 4), 4, immutable=True,
+              version=['2017', '2018'])
+    cache.invalidate(('h', 1, 'o', 'p', 't'))
+    assert len(cache._shelf) == 2
+    cache.close()
+
+
+def test_cache_disk_store_rebuilt_stack(tmpdir):
+    path = os.path.join(str(tmpdir), 'responses')
+    with FakeRenderServer() as server:
+        serve_stack(server, 'rebuilt_stack', load_test_tilespecs())
+        render = cached_render(server, path=path)
+        assert renderapi.stack.get_z_values_for_stack(
+            'rebuilt_stack', render=render) == [2266]
+        render.cache.close()
+
+        # another process deletes the stack and loads it again
+        server.add_json('/zValues/', [1, 2], stack='rebuilt_stack')
+        server.add_json('', {'state': 'COMPLETE', 'currentVersion': {
+            'createTimestamp': '2018-01-01T00:00:00.000Z'}},
+            stack='rebuilt_stack')
+        render = cached_render(server, path=path)
+        assert renderapi.stack.get_z_values_for_stack(
+            'rebuilt_stack', render=render) == [1, 2]
+        assert server.requested('/zValues/', stack='rebuilt_stack') == 2
+        render.cache.close()
+
+        render = cached_render(server, path=path)
+        assert renderapi.stack.get_z_values_for_stack(
+            'rebuilt_stack', render=render) == [1, 2]
+        assert server.requested('/zValues/', stack='rebuilt_stack') == 2
+
+
+def test_image_cache_lru(tmpdir):
+    path = str(tmpdir.join('images'))
+    cache = renderapi.cache.ImageCache(path, maxbytes=25)
+    stackkey = ('h', 1, 'o', 'p', 's')
+    cache.set(stackkey, ('a', ), b'0' * 10)
+    cache.set(stackkey, ('b', ), b'1' * 10)
+    assert cache.get(stackkey, ('a', )) == b'0' * 10
+    cache.set(stackkey, ('c', ), b'2' * 10)
+    assert cache.get(stackkey, ('b', )) is None
+    assert (len(cache), cache.nbytes) == (2, 20)
+    cache.set(stackkey, ('d', ), b'3' * 100)
+    assert cache.get(stackkey, ('d', )) is None
+
+    # images persist across instances and processes
+    reopened = pickle.loads(pickle.dumps(cache))
+    assert reopened.get(stackkey, ('c', )) == b'2' * 10
+    assert len(reopened) == 2
+    reopened.invalidate(stackkey)
+    assert cache.get(stackkey, ('a', )) is None
+    assert len(reopened) == 0
+
+
+def test_image_cache_version(tmpdir):
+    path = str(tmpdir.join('images'))
+    cache = renderapi.cache.ImageCache(path)
+    stackkey = ('h', 1, 'o', 'p', 's')
+    cache.set(stackkey, ('a', ), b'old', version=['2017', None])
+    assert cache.get(stackkey, ('a', ), version=['2017', None]) == b'old'
+
+    # a stack rebuilt under the same name misses, including across runs
+    reopened = renderapi.cache.ImageCache(path)
+    assert reopened.get(stackkey, ('a', ), version=['2018', None]) is None
+    reopened.set(stackkey, ('a', ), b'new', version=['2018', None])
+    assert len(reopened) == 1
+    assert reopened.get(stackkey, ('a', ), version=['2018', None]) == b'new'
+    assert cache.get(stackkey, ('a', ), version=['2017', None]) is None
+
+
+def test_image_cache_concurrent_set(tmpdir, monkeypatch):
+    from multiprocessing.pool import ThreadPool
+    cache = renderapi.cache.ImageCache(str(tmpdir.join('images')))
+    stackkey = ('h', 1, 'o', 'p', 's')
+    pool = ThreadPool(16)
+    for trial in range(20):
+        version = [str(trial), None]
+        pool.map(lambda i: cache.set(stackkey, (i, ), b'0' * 10,
+                                     version=version), range(16))
+        assert all(cache.get(stackkey, (i, ), version=version) == b'0' * 10
+                   for i in range(16))
+        assert len(cache) == 16
+    pool.close()
+
+    # failing to write an image is a miss rather than an error
+    def mkstemp(*args, **kwargs):
+        raise OSError(2, 'No such file or directory')
+    monkeypatch.setattr(renderapi.cache.tempfile, 'mkstemp', mkstemp)
+    cache.set(stackkey, ('a', ), b'0', version=['20', None])
+    assert cache.get(stackkey, ('a', ), version=['20', None]) is None
@@ -1,4 +1,5 @@
 import os
+import pickle
 import renderapi
 import rendersettings
 
@@ -51,3 +52,35 @@ def test_environment_variables_client():
         rkwargs=rendersettings.DEFAULT_RENDER_CLIENT,
         renvkwargs=rendersettings.DEFAULT_RENDER_CLIENT_ENVIRONMENT_VARIABLES,
         validate_client=False)
+
+
+def test_render_pooled_session():
+    r = renderapi.render.Render(pool_maxsize=64, timeout=30.,
+                                **rendersettings.DEFAULT_RENDER)
+    session = r.session
+    assert session is r.session
+    assert session.timeout == 30.
+    assert session.get_adapter(
+        rendersettings.DEFAULT_RENDER['host'])._pool_maxsize == 64
+
+    # a render object unpickled in a worker builds its own session
+    r_copy = pickle.loads(pickle.dumps(r))
+    assert r_copy.session is not session
+
+    # as does a forked process
+    r._session_pid = -1
+    assert r.session is not session
+
+
+def test_renderaccess_session_injection():
+    @renderapi.render.renderaccess
+    def get_session(host=None, port=None, owner=None, project=None,
+                    session=None, render=None, **kwargs):
+        return session
+
+    r = renderapi.render.Render(**rendersettings.DEFAULT_RENDER)
+    assert get_session(render=r) is r.session
+    assert (get_session() is
+            renderapi.render.get_default_session())
+    explicit_session = renderapi.render.make_session()
+    assert get_session(render=r, session=explicit_session) is explicit_session
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import renderapi
+from fakeserver import FakeRenderServer, serve_stack
+
+
+def make_tilespecs(rows=3, cols=4, size=1000., overlap=100.):
+    tilespecs = []
+    for r in range(rows):
+        for c in range(cols):
+            theta = 0.01 * (r - c)
+            tforms = [
+                renderapi.transform.AffineModel(
+                    M00=np.cos(theta), M01=-np.sin(theta),
+                    M10=np.sin(theta), M11=np.cos(theta)),
+                renderapi.transform.AffineModel(
+                    B0=c * (size - overlap), B1=r * (size - overlap))]
+            tilespecs.append(renderapi.tilespec.TileSpec(
+                tileId='{}_{}'.format(r, c), z=1., width=size, height=size,
+                tforms=tforms))
+    return tilespecs
+
+
+def test_coordinate_mapper():
+    tilespecs = make_tilespecs()
+    mapper = renderapi.coordinate.CoordinateMapper(tilespecs)
+    local = np.random.rand(500, 2) * 1000.
+
+    for ts in tilespecs[:3]:
+        world = mapper.local_to_world_array(local, ts.tileId)
+        assert np.allclose(world, renderapi.transform.estimate_dstpts(
+            ts.tforms, local))
+        assert np.allclose(mapper.world_to_local_array(world, ts.tileId),
+                           local)
+
+    ts = tilespecs[5]
+    world = mapper.local_to_world_array(local, ts.tileId)
+    results = mapper.world_to_local(world)
+    assert len(results) == len(local)
+    for xy, result in zip(local, results):
+        match = [r for r in result if r['tileId'] == ts.tileId]
+        assert len(match) == 1
+        assert np.allclose(match[0]['local'], xy)
+        for r in result:
+            assert 0 <= r['local'][0] <= 1000. and 0 <= r['local'][1] <= 1000.
+    assert mapper.world_to_local(np.array([[-1e6, -1e6]])) == [[]]
+
+    d = [{'tileId': ts.tileId, 'local': list(xy)} for xy in local[:5]]
+    assert np.allclose(
+        renderapi.coordinate.unpackage_local_to_world_point_match_from_json(
+            mapper.local_to_world_batch(d)), world[:5])
+
+
+def test_coordinate_execute_local():
+    tilespecs = make_tilespecs(rows=2, cols=2)
+    local = np.random.rand(20, 2) * 1000.
+    with FakeRenderServer() as server:
+        serve_stack(server, 'coordinate_stack',
+                    [ts.to_dict() for ts in tilespecs])
+        world = renderapi.coordinate.local_to_world_coordinates_array(
+            'coordinate_stack', local, tilespecs[3].tileId, 1.,
+            execute_local=True, render=server.render)
+        assert np.allclose(world, renderapi.transform.estimate_dstpts(
+            tilespecs[3].tforms, local))
+        assert np.allclose(
+            renderapi.coordinate.world_to_local_coordinates_array(
+                'coordinate_stack', world, tilespecs[3].tileId, 1.,
+                execute_local=True, render=server.render), local)
+
+        # connection arguments keep their positions before execute_local
+        r = server.render
+        args = (r.DEFAULT_HOST, r.DEFAULT_PORT, r.DEFAULT_OWNER,
+                r.DEFAULT_PROJECT, r.session)
+        d = renderapi.coordinate.package_point_match_data_into_json(
+            local, tilespecs[3].tileId, 'local')
+        mapped = renderapi.coordinate.local_to_world_coordinates_batch(
+            'coordinate_stack', d, 1., *args, execute_local=True)
+        unpackage = (renderapi.coordinate.
+                     unpackage_local_to_world_point_match_from_json)
+        assert np.allclose(unpackage(mapped), world)
+
+
+def test_coordinate_mapper_unsupported():
+    ts = make_tilespecs(1, 1)[0]
+    ts.tforms = ts.tforms + [renderapi.transform.Transform(
+        className='mpicbg.trakem2.transform.NotATransform',
+        dataString='1 2 3')]
+    mapper = renderapi.coordinate.CoordinateMapper(
+        [renderapi.tilespec.TileSpec(json=dict(
+            ts.to_dict(), minX=0, minY=0, maxX=1000, maxY=1000))])
+    with pytest.raises(renderapi.errors.ConversionError):
+        mapper.world_to_local_array(np.zeros((1, 2)), ts.tileId)
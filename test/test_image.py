@@ -0,0 +1,281 @@
+import io
+import struct
+import numpy as np
+from PIL import Image
+import pytest
+import renderapi
+from fakeserver import FakeRenderServer, serve_stack
+
+
+def render_box(path, body):
+    # pixels hold their column and row in the scaled world, modulo 251
+    box, image_ext = path.split('?')[0].split('/box/')[1].split('/')
+    x, y, width, height, scale = [float(v) for v in box.split(',')]
+    rows, cols = renderapi.image._bb_image_shape(width, height, scale)
+    r0, c0 = int(round(y * scale)), int(round(x * scale))
+    image = ((np.arange(c0, c0 + cols)[np.newaxis, :] +
+              np.arange(r0, r0 + rows)[:, np.newaxis] * 7) % 251)
+    f = io.BytesIO()
+    Image.fromarray(image.astype(np.uint8)).save(
+        f, format=image_ext.split('-')[0])
+    return f.getvalue()
+
+
+def raw_tiff(image, byteorder='>', rowsperstrip=None):
+    '''uncompressed tiff of an array, in strips of rowsperstrip rows'''
+    rows, cols = image.shape[:2]
+    samples = 1 if image.ndim == 2 else image.shape[2]
+    rowsperstrip = rows if rowsperstrip is None else rowsperstrip
+    pixels = image.astype(image.dtype.newbyteorder(byteorder)).tobytes()
+    stripbytes = rowsperstrip * cols * samples * image.dtype.itemsize
+    nstrips = (rows + rowsperstrip - 1) // rowsperstrip
+    sampleformat = {'u': 1, 'i': 2, 'f': 3}[image.dtype.kind]
+    entries = [(256, 4, [cols]), (257, 4, [rows]),
+               (258, 3, [image.dtype.itemsize * 8] * samples),
+               (259, 3, [1]), (262, 3, [1 if samples == 1 else 2]),
+               (273, 4, None), (277, 3, [samples]),
+               (278, 4, [rowsperstrip]),
+               (279, 4, [min(stripbytes, len(pixels) - i * stripbytes)
+                         for i in range(nstrips)]),
+               (339, 3, [sampleformat])]
+    ifdsize = 2 + 12 * len(entries) + 4
+    extra = b''
+    pixeloffset = 8 + ifdsize + 4 * (2 * nstrips + samples)
+    ifd = struct.pack(byteorder + 'H', len(entries))
+    for tag, fieldtype, values in entries:
+        if values is None:
+            values = [pixeloffset + i * stripbytes for i in range(nstrips)]
+        fmt = '{}{}{}'.format(byteorder, len(values), 'HI'[fieldtype - 3])
+        packed = struct.pack(fmt, *values)
+        if len(packed) <= 4:
+            value = packed.ljust(4, b'\0')
+        else:
+            value = struct.pack(byteorder + 'I', 8 + ifdsize + len(extra))
+            extra += packed
+        ifd += struct.pack(byteorder + 'HHI', tag, fieldtype,
+                           len(values)) + value
+    ifd += struct.pack(byteorder + 'I', 0)
+    extra = extra.ljust(pixeloffset - 8 - ifdsize, b'\0')
+    header = (b'MM' if byteorder == '>' else b'II') + struct.pack(
+        byteorder + 'HI', 42, 8)
+    return header + ifd + extra + pixels
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeRenderServer() as server:
+        for stack, state in [('image_stack', 'COMPLETE'),
+                             ('loading_stack', 'LOADING')]:
+            serve_stack(server, stack, [], state=state)
+            server.add_prefix('/z/1/box/', render_box, stack=stack)
+        server.add('/state/LOADING', b'', stack='image_stack', method='PUT')
+        yield server
+
+
+@pytest.mark.parametrize('scale', [1.0, 0.5, 0.3])
+def test_get_bb_image_tiled(server, scale):
+    args = ('image_stack', 1, 1000, 2000, 3000, 1700)
+    whole = renderapi.image.get_bb_image(
+        *args, scale=scale, render=server.render)
+    before = len(server.requests)
+    tiled = renderapi.image.get_bb_image(
+        *args, scale=scale, tilesize=256, poolsize=4, render=server.render)
+    assert tiled.shape == whole.shape
+    assert tiled.dtype == whole.dtype
+    assert np.array_equal(tiled, whole)
+    assert len(server.requests) - before > 1
+
+
+def test_get_bb_image_tiled_out(server, tmpdir):
+    path = str(tmpdir.join('image.dat'))
+    image = renderapi.image.get_bb_image(
+        'image_stack', 1, 0, 0, 1000, 500, scale=0.5, tilesize=128,
+        memmap=path, render=server.render)
+    assert isinstance(image, np.memmap)
+    image.flush()
+    reread = np.memmap(path, dtype=np.uint8, mode='r', shape=(250, 500))
+    assert np.array_equal(reread, renderapi.image.get_bb_image(
+        'image_stack', 1, 0, 0, 1000, 500, scale=0.5, render=server.render))
+
+    out = np.zeros((250, 500), dtype=np.uint8)
+    assert renderapi.image.get_bb_image(
+        'image_stack', 1, 0, 0, 1000, 500, scale=0.5, tilesize=128,
+        out=out, render=server.render) is out
+    assert np.array_equal(out, reread)
+
+    # out must match the rendered image, checked before fetching for shape
+    before = box_requests(server, 'image_stack')
+    for wrong in [np.zeros((250, 499), dtype=np.uint8),
+                  np.zeros((500, 1000), dtype=np.uint8)]:
+        with pytest.raises(ValueError):
+            renderapi.image.get_bb_image(
+                'image_stack', 1, 0, 0, 1000, 500, scale=0.5, tilesize=128,
+                out=wrong, render=server.render)
+    assert box_requests(server, 'image_stack') == before
+    for wrong in [np.zeros((250, 500), dtype=np.float32),
+                  np.zeros((250, 500, 3), dtype=np.uint8)]:
+        with pytest.raises(ValueError):
+            renderapi.image.get_bb_image(
+                'image_stack', 1, 0, 0, 1000, 500, scale=0.5, tilesize=128,
+                out=wrong, render=server.render)
+
+    with pytest.raises(renderapi.errors.RenderError):
+        renderapi.image.get_bb_image(
+            'image_stack', 2, 0, 0, 1000, 500, tilesize=128,
+            render=server.render)
+
+
+def box_requests(server, stack):
+    return len([r for r in server.requests if '/stack/{}/z/1/box/'.format(
+        stack) in r[1]])
+
+
+def test_image_cache(server, tmpdir):
+    render = renderapi.render.Render(
+        image_cache=renderapi.cache.ImageCache(str(tmpdir.join('images'))),
+        **server.render.make_kwargs())
+    before = box_requests(server, 'image_stack')
+    images = [renderapi.image.get_bb_image(
+        'image_stack', 1, 0, 0, 1000, 500, scale=scale, render=render)
+        for scale in [0.5, 0.5, 0.25, 0.5]]
+    assert box_requests(server, 'image_stack') == before + 2
+    assert np.array_equal(images[0], images[1])
+    assert images[2].shape == (125, 250)
+
+    renderapi.image.get_bb_image(
+        'image_stack', 1, 0, 0, 1000, 500, scale=0.5, minIntensity=10,
+        render=render)
+    assert box_requests(server, 'image_stack') == before + 3
+
+    # stacks which may change are not cached
+    for i in range(2):
+        renderapi.image.get_bb_image(
+            'loading_stack', 1, 0, 0, 1000, 500, render=render)
+    assert box_requests(server, 'loading_stack') == 2
+
+    # changing a stack drops its images
+    renderapi.stack.set_stack_state('image_stack', 'LOADING', render=render)
+    assert len(render.image_cache) == 0
+
+
+@pytest.mark.parametrize('mode,dtype', [
+    ('L', np.uint8), ('I;16', np.uint16), ('F', np.float32),
+    ('RGB', np.uint8), ('RGBA', np.uint8)])
+def test_parse_tiff_pil(mode, dtype):
+    random = np.random.RandomState(0)
+    bands = len(mode) if mode in ('RGB', 'RGBA') else 1
+    shape = (37, 53) if bands == 1 else (37, 53, bands)
+    image = (random.rand(*shape) * 200).astype(dtype)
+    f = io.BytesIO()
+    (Image.fromarray(image, mode=mode) if mode != 'RGBA' else
+     Image.fromarray(image)).save(f, format='tiff')
+    content = f.getvalue()
+    parsed = renderapi.image._parse_tiff(content)
+    assert parsed is not None
+    assert np.array_equal(parsed, image)
+    assert np.array_equal(
+        parsed, np.asarray(Image.open(io.BytesIO(content))))
+
+
+@pytest.mark.parametrize('byteorder', ['<', '>'])
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.int32,
+                                   np.float64])
+def test_parse_tiff_strips(byteorder, dtype):
+    image = (np.arange(7 * 11 * 3).reshape(7, 11, 3) - 20).astype(dtype)
+    if image.dtype.kind == 'u':
+        image = image + 20
+    for rowsperstrip in [None, 1, 3]:
+        parsed = renderapi.image._parse_tiff(raw_tiff(
+            image, byteorder, rowsperstrip))
+        assert parsed.dtype == image.dtype.newbyteorder(byteorder)
+        assert np.array_equal(parsed, image)
+        assert np.array_equal(parsed[..., 0], renderapi.image._parse_tiff(
+            raw_tiff(image[..., 0], byteorder, rowsperstrip)))
+
+
+def test_parse_tiff_fallback():
+    image = (np.arange(64 * 64) % 7).reshape(64, 64).astype(np.uint8)
+    for fmt, kwargs in [('png', {}), ('tiff', {'compression': 'packbits'}),
+                        ('tiff', {'compression': 'tiff_deflate'})]:
+        f = io.BytesIO()
+        try:
+            Image.fromarray(image).save(f, format=fmt, **kwargs)
+        except (IOError, OSError, KeyError):  # pragma: no cover
+            continue  # PIL built without libtiff
+        assert renderapi.image._parse_tiff(f.getvalue()) is None
+        assert np.array_equal(
+            renderapi.image._decode_image(f.getvalue()), image)
+    assert renderapi.image._parse_tiff(b'') is None
+    assert renderapi.image._parse_tiff(raw_tiff(image)[:100]) is None
+
+
+def test_get_bb_image_buffer(server):
+    args = ('image_stack', 1, 0, 0, 300, 200)
+    png = renderapi.image.get_bb_image(*args, render=server.render)
+    buffer = bytearray(2 ** 20)
+    image = renderapi.image.get_bb_image(
+        *args, img_format='tiff', buffer=buffer, render=server.render)
+    assert np.array_equal(image, png)
+    assert np.may_share_memory(image, np.frombuffer(buffer, np.uint8))
+
+    # other formats are read into the buffer and decoded by PIL
+    assert np.array_equal(renderapi.image.get_bb_image(
+        *args, buffer=buffer, render=server.render), png)
+
+    with pytest.raises(renderapi.errors.RenderError):
+        renderapi.image.get_bb_image(
+            *args, img_format='tiff', buffer=bytearray(1000),
+            render=server.render)
+    with pytest.raises(ValueError):
+        renderapi.image.get_bb_image(
+            *args, tilesize=100, buffer=buffer, render=server.render)
+
+
+def test_get_bb_image_positional(server):
+    # new keyword arguments follow the existing positional ones
+    r = server.render
+    image = renderapi.image.get_bb_image(
+        'image_stack', 1, 0, 0, 300, 200, 0.5, None, None, None, None, None,
+        r.DEFAULT_HOST, r.DEFAULT_PORT, r.DEFAULT_OWNER, r.DEFAULT_PROJECT,
+        'tiff', r.session)
+    assert np.array_equal(image, renderapi.image.get_bb_image(
+        'image_stack', 1, 0, 0, 300, 200, scale=0.5, render=r))
+
+
+def render_tile(path, body):
+    tileId = path.split('?')[0].split('/tile/')[1].split('/')[0]
+    if tileId.startswith('bad'):
+        return b'tile not found'
+    f = io.BytesIO()
+    Image.fromarray(np.full((8, 8), int(tileId), dtype=np.uint8)).save(
+        f, format='png')
+    return f.getvalue()
+
+
+def test_get_tile_images(server):
+    server.add_prefix('/tile/', render_tile, stack='image_stack')
+    tileIds = [str(i) for i in range(40)]
+    images = dict(renderapi.image.get_tile_images(
+        'image_stack', tileIds, poolsize=4, readahead=4,
+        render=server.render))
+    assert sorted(images) == sorted(tileIds)
+    for tileId, image in images.items():
+        assert image.shape == (8, 8)
+        assert (image == int(tileId)).all()
+
+    ordered = [tileId for tileId, image in renderapi.image.get_tile_images(
+        'image_stack', tileIds, ordered=True, render=server.render)]
+    assert ordered == tileIds
+
+    errors = {}
+    images = dict(renderapi.image.get_tile_images(
+        'image_stack', ['1', 'bad1', '2', 'bad2'], errors=errors,
+        render=server.render))
+    assert sorted(images) == ['1', '2']
+    assert sorted(errors) == ['bad1', 'bad2']
+    assert all(isinstance(e, renderapi.errors.RenderError)
+               for e in errors.values())
+
+    with pytest.raises(renderapi.errors.RenderError):
+        list(renderapi.image.get_tile_images(
+            'image_stack', ['1', 'bad1'], render=server.render))
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+import renderapi
+
+
+def make_correspondences(tform, N=200, outliers=0.3, seed=0):
+    random = np.random.RandomState(seed)
+    src = random.rand(N, 2) * 2000.
+    dst = tform.tform(src) + random.randn(N, 2) * 0.5
+    bad = random.rand(N) < outliers
+    dst[bad] += random.rand(bad.sum(), 2) * 500. + 100.
+    return src, dst, ~bad
+
+
+@pytest.mark.parametrize('model,target', [
+    (renderapi.transform.AffineModel, renderapi.transform.AffineModel(
+        M00=1.02, M01=0.05, M10=-0.03, M11=0.98, B0=120., B1=-45.)),
+    (renderapi.transform.TranslationModel, renderapi.transform.AffineModel(
+        B0=120., B1=-45.)),
+    (renderapi.transform.RigidModel, renderapi.transform.AffineModel(
+        M00=np.cos(0.1), M01=-np.sin(0.1), M10=np.sin(0.1),
+        M11=np.cos(0.1), B0=120., B1=-45.)),
+    (renderapi.transform.SimilarityModel, renderapi.transform.AffineModel(
+        M00=1.1 * np.cos(0.1), M01=-1.1 * np.sin(0.1),
+        M10=1.1 * np.sin(0.1), M11=1.1 * np.cos(0.1), B0=120., B1=-45.))])
+def test_ransac_models(model, target):
+    src, dst, good = make_correspondences(target)
+    tform, inliers = renderapi.ransac.ransac(
+        src, dst, model=model, max_error=5., seed=1)
+    assert isinstance(tform, model)
+    assert np.array_equal(inliers, good)
+    assert np.allclose(tform.M, target.M, atol=0.5, rtol=1e-3)
+
+
+def test_ransac_polynomial():
+    target = renderapi.transform.Polynomial2DTransform(params=np.array([
+        [10., 1.01, 0.02, 1e-6, -2e-6, 3e-6],
+        [-5., -0.01, 0.98, 2e-6, 1e-6, -1e-6]]))
+    src, dst, good = make_correspondences(target, outliers=0.2)
+    tform, inliers = renderapi.ransac.ransac(
+        src, dst, model=renderapi.transform.Polynomial2DTransform,
+        max_error=5., order=2, seed=1)
+    assert np.array_equal(inliers, good)
+    assert np.abs(tform.tform(src[good]) - dst[good]).max() < 5.
+
+
+def test_ransac_polynomial_order3():
+    target = renderapi.transform.Polynomial2DTransform(params=np.array([
+        [10., 1.01, 0.02, 1e-6, -2e-6, 3e-6, 1e-9, -2e-9, 1e-9, 2e-9],
+        [-5., -0.01, 0.98, 2e-6, 1e-6, -1e-6, -1e-9, 1e-9, 2e-9, -1e-9]]))
+    random = np.random.RandomState(0)
+    # far from the origin cubic monomials of raw coordinates are ~1e18
+    src = random.rand(200, 2) * 4000. + 1e6
+    dst = target.tform(src)
+    good = random.rand(200) > 0.2
+    dst[~good] += 100.
+    tform, inliers = renderapi.ransac.ransac(
+        src, dst, model=renderapi.transform.Polynomial2DTransform,
+        max_error=0.01, order=3, seed=1)
+    assert np.array_equal(inliers, good)
+
+
+def test_ransac_refit_min_inliers():
+    # the hypothesis through the middle point covers every point, but the
+    # translation refit to them is pulled away from the far points
+    src = np.zeros((13, 2))
+    dst = np.zeros((13, 2))
+    dst[10, 0] = 0.95
+    dst[11:, 0] = 1.9
+    with pytest.raises(renderapi.errors.EstimationError):
+        renderapi.ransac.ransac(
+            src, dst, model=renderapi.transform.TranslationModel,
+            max_error=1., min_inliers=12, seed=0)
+
+
+def test_ransac_failure():
+    src = np.random.rand(20, 2)
+    with pytest.raises(renderapi.errors.EstimationError):
+        renderapi.ransac.ransac(src, src, min_inliers=30)
+    with pytest.raises(renderapi.errors.EstimationError):
+        renderapi.ransac.ransac(src, src[:10])
+
+
+def test_filter_matches():
+    target = renderapi.transform.AffineModel(B0=50., B1=20.)
+    src, dst, good = make_correspondences(target)
+    matches = [{'pGroupId': '1.0', 'pId': 'a', 'qGroupId': '1.0',
+                'qId': 'b', 'matches': {
+                    'p': src.T.tolist(), 'q': dst.T.tolist(),
+                    'w': [1.] * len(src)}},
+               {'pGroupId': '1.0', 'pId': 'a', 'qGroupId': '1.0',
+                'qId': 'c', 'matches': {
+                    'p': src[:2].T.tolist(), 'q': dst[:2].T.tolist(),
+                    'w': [1., 1.]}}]
+    filtered = renderapi.ransac.filter_matches(matches, max_error=5.,
+                                               min_inliers=10, seed=0)
+    assert len(filtered) == 1
+    assert filtered[0]['qId'] == 'b'
+    assert np.allclose(filtered[0]['matches']['p'], src[good].T)
+    assert len(filtered[0]['matches']['w']) == good.sum()
+
+    kept = renderapi.ransac.filter_matches(
+        matches, max_error=5., min_inliers=10, drop_empty=False, seed=0)
+    assert len(kept) == 2
+    assert kept[1]['matches']['w'] == []
+
+
+@pytest.mark.parametrize('order', [2, 3])
+def test_ransac_polynomial_low_inlier_ratio(order):
+    random = np.random.RandomState(0)
+    # only the points of a hypothesis fit it, so the inlier ratio
+    # raised to the sample size vanishes
+    src = random.rand(500, 2) * 2000.
+    dst = random.rand(500, 2) * 2000.
+    with pytest.raises(renderapi.errors.EstimationError):
+        renderapi.ransac.ransac(
+            src, dst, model=renderapi.transform.Polynomial2DTransform,
+            max_error=20., min_inliers=250, order=order, seed=0)
+    matches = [{'pId': 'a', 'qId': 'b', 'matches': {
+        'p': src.T.tolist(), 'q': dst.T.tolist(), 'w': [1.] * len(src)}}]
+    assert renderapi.ransac.filter_matches(
+        matches, model=renderapi.transform.Polynomial2DTransform,
+        max_error=20., min_inliers=250, order=order, seed=0) == []
@@ -0,0 +1,92 @@
+import os
+import pytest
+import renderapi
+from fakeserver import FakeRenderServer, load_test_tilespecs, serve_stack
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeRenderServer() as server:
+        serve_stack(server, 'store_stack', load_test_tilespecs())
+        serve_stack(server, 'loading_store_stack', load_test_tilespecs(),
+                    state='LOADING')
+        yield server
+
+
+def test_mirror_stack(server, tmpdir):
+    path = os.path.join(str(tmpdir), 'store.sqlite')
+    store = renderapi.store.mirror_stack(
+        'store_stack', path, render=server.render)
+    ts_json = load_test_tilespecs()
+    assert len(store) == len(ts_json)
+    assert store.get_z_values() == [2266]
+    assert ([ts.tileId for ts in store.get_tile_specs_from_z(2266)] ==
+            sorted(d['tileId'] for d in ts_json))
+    assert (store.get_tile_spec(ts_json[0]['tileId']).to_dict() ==
+            renderapi.tilespec.TileSpec(json=ts_json[0]).to_dict())
+    with pytest.raises(renderapi.errors.RenderError):
+        store.get_tile_spec('no_such_tile')
+    store.close()
+
+    # resuming a complete mirror does not refetch layers
+    before = server.requested('/z/%f/tile-specs' % 2266, stack='store_stack')
+    renderapi.store.mirror_stack(
+        'store_stack', path, render=server.render).close()
+    assert server.requested(
+        '/z/%f/tile-specs' % 2266, stack='store_stack') == before
+
+    store = renderapi.store.open_store(
+        'store_stack', path, render=server.render)
+    assert len(store) == len(ts_json)
+    store.close()
+
+
+def test_store_stale(server, tmpdir):
+    path = os.path.join(str(tmpdir), 'store.sqlite')
+    with pytest.raises(renderapi.errors.StaleDataError):
+        renderapi.store.mirror_stack(
+            'loading_store_stack', path, render=server.render)
+
+    renderapi.store.mirror_stack(
+        'store_stack', path, render=server.render).close()
+    server.add_json('', {'state': 'COMPLETE', 'currentVersion': {
+        'createTimestamp': '2017-07-01T00:00:00.000Z'}}, stack='store_stack')
+    try:
+        with pytest.raises(renderapi.errors.StaleDataError):
+            renderapi.store.open_store(
+                'store_stack', path, render=server.render)
+        store = renderapi.store.mirror_stack(
+            'store_stack', path, render=server.render)
+        assert store.stackVersion['createTimestamp'] == (
+            '2017-07-01T00:00:00.000Z')
+        store.close()
+    finally:
+        serve_stack(server, 'store_stack', load_test_tilespecs())
+
+
+def test_store_modified(server, tmpdir):
+    path = os.path.join(str(tmpdir), 'store.sqlite')
+    renderapi.store.mirror_stack(
+        'store_stack', path, render=server.render).close()
+    # the stack is set to LOADING, changed and set COMPLETE again
+    server.add_json('', {
+        'state': 'COMPLETE',
+        'lastModifiedTimestamp': '2017-07-01T00:00:00.000Z',
+        'currentVersion': {'createTimestamp': '2017-06-29T00:00:00.000Z'}},
+        stack='store_stack')
+    try:
+        with pytest.raises(renderapi.errors.StaleDataError):
+            renderapi.store.open_store(
+                'store_stack', path, render=server.render)
+        before = server.requested(
+            '/z/%f/tile-specs' % 2266, stack='store_stack')
+        store = renderapi.store.mirror_stack(
+            'store_stack', path, render=server.render)
+        assert server.requested(
+            '/z/%f/tile-specs' % 2266, stack='store_stack') == before + 1
+        assert store.lastModifiedTimestamp == '2017-07-01T00:00:00.000Z'
+        store.close()
+        renderapi.store.open_store(
+            'store_stack', path, render=server.render).close()
+    finally:
+        serve_stack(server, 'store_stack', load_test_tilespecs())
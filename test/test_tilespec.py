@@ -1,7 +1,10 @@
 import json
+import pickle
+import numpy as np
 from operator import eq
 import renderapi
 import rendersettings
+from fakeserver import FakeRenderServer, load_test_tilespecs, serve_stack
 
 
 def test_load_tilespecs_json():
@@ -54,3 +57,235 @@ def test_bbox_shape():
         tilespecs = [renderapi.tilespec.TileSpec(json=d) for d in json.load(f)]
 
     assert(all([len(ts.bbox) == 4 for ts in tilespecs]))
+
+
+def test_tilespec_slots_pickle():
+    tilespecs = [renderapi.tilespec.TileSpec(json=d)
+                 for d in load_test_tilespecs()]
+    ts = tilespecs[0]
+    assert not hasattr(ts, '__dict__')
+    assert not hasattr(ts.layout, '__dict__')
+    assert not hasattr(ts.tforms[0], '__dict__')
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        unpickled = pickle.loads(pickle.dumps(tilespecs, protocol))
+        assert ([t.to_dict() for t in unpickled] ==
+                [t.to_dict() for t in tilespecs])
+
+
+def test_lazy_tilespec():
+    ts_json = load_test_tilespecs()
+    lazy = [renderapi.tilespec.TileSpec(json=d, lazy=True) for d in ts_json]
+    eager = [renderapi.tilespec.TileSpec(json=d) for d in ts_json]
+    assert [ts.to_dict() for ts in lazy] == ts_json
+    assert lazy[0].bbox == eager[0].bbox
+    assert not hasattr(lazy[0], '_tforms')
+    unpickled = pickle.loads(pickle.dumps(lazy[0]))
+    assert unpickled.to_dict() == ts_json[0]
+
+    assert lazy[0].tforms == eager[0].tforms
+    assert lazy[0].to_dict() == eager[0].to_dict()
+    lazy[1].z = 1.
+    assert lazy[1].to_dict()['z'] == 1.
+    assert lazy[1].layout.to_dict() == eager[1].layout.to_dict()
+    assert (lazy[2].ip.to_ordered_dict() ==
+            eager[2].ip.to_ordered_dict())
+
+
+def test_lazy_tilespec_copies_json():
+    ts_json = load_test_tilespecs()
+    d = ts_json[0]
+    ts = renderapi.tilespec.TileSpec(json=d, lazy=True)
+    expected = load_test_tilespecs()[0]
+
+    # changing the returned dictionary does not change the tile
+    out = ts.to_dict()
+    out['z'] = 999.
+    out['transforms']['specList'] = []
+    assert ts.to_dict() == expected
+
+    # nor does changing the dictionary it was loaded from
+    d['z'] = 999.
+    d['transforms']['specList'].pop()
+    assert ts.z == expected['z']
+    assert ts.to_dict() == expected
+    assert len(ts.tforms) == len(expected['transforms']['specList'])
+
+
+def test_tilespec_collection():
+    ts_json = load_test_tilespecs()
+    collection = renderapi.tilespec.TileSpecCollection.from_json(ts_json)
+    assert len(collection) == len(ts_json)
+    assert list(collection.tileId) == [d['tileId'] for d in ts_json]
+    assert np.array_equal(collection.maxX, [d['maxX'] for d in ts_json])
+    assert collection[1].to_dict() == renderapi.tilespec.TileSpec(
+        json=ts_json[1]).to_dict()
+    assert collection.to_json() == ts_json
+
+    assert len(collection.filter_z(2266)) == len(ts_json)
+    assert len(collection.filter_z(0, 1)) == 0
+    assert len(collection.filter_sectionId(['2266.0'])) == len(ts_json)
+    d = ts_json[0]
+    inbox = collection.filter_bbox(d['minX'], d['minY'],
+                                   d['minX'] + 1, d['minY'] + 1)
+    assert d['tileId'] in inbox.tileId
+    assert len(collection.filter_bbox(1e9, 1e9, 2e9, 2e9)) == 0
+
+    reverse = collection.sort(['z', 'maxX'])[::-1]
+    assert list(reverse.maxX) == sorted(collection.maxX, reverse=True)
+    assert ([ts.tileId for ts in reverse] == list(reverse.tileId))
+
+
+def test_tilespec_collection_affine():
+    tforms = [renderapi.transform.AffineModel(M00=2., M11=2.),
+              renderapi.transform.AffineModel(B0=5., B1=-3.)]
+    tilespecs = [renderapi.tilespec.TileSpec(
+        tileId=str(i), z=i, width=10, height=10, tforms=tforms,
+        sectionId=str(i)) for i in range(4)]
+    tilespecs.append(renderapi.tilespec.TileSpec(
+        tileId='poly', z=4, tforms=[
+            renderapi.transform.Polynomial2DTransform(identity=True)]))
+    collection = renderapi.tilespec.TileSpecCollection.from_tilespecs(
+        tilespecs)
+    assert np.allclose(collection.affine[:4], [[2., 0., 5.], [0., 2., -3.],
+                                               [0., 0., 1.]])
+    assert np.isnan(collection.M00[4])
+    assert list(collection.filter_sectionId('2').tileId) == ['2']
+    assert collection.filter_z(1, 2).to_tilespecs() == tilespecs[1:3]
+
+
+def test_iter_tile_specs_from_stack():
+    ts_json = load_test_tilespecs()
+    layers = []
+    for z in range(10):
+        for d in ts_json:
+            layers.append(dict(d, z=z, tileId='{}.{}'.format(d['tileId'], z)))
+
+    with FakeRenderServer() as server:
+        serve_stack(server, 'iter_stack', layers)
+        layer_iter = renderapi.tilespec.iter_tile_specs_from_stack(
+            'iter_stack', poolsize=2, readahead=2, render=server.render)
+        z, tilespecs = next(layer_iter)
+        assert z == 0
+        # zValues request plus at most readahead layers
+        assert len(server.requests) <= 3
+        ordered = [(z, tilespecs)] + list(layer_iter)
+        assert [z for z, tss in ordered] == list(range(10))
+        assert ([ts.tileId for z, tss in ordered for ts in tss] ==
+                [d['tileId'] for d in layers])
+
+        unordered = list(renderapi.tilespec.iter_tile_specs_from_stack(
+            'iter_stack', zValues=[1, 2, 3], ordered=False,
+            render=server.render))
+        assert sorted(z for z, tss in unordered) == [1, 2, 3]
+        assert all(len(tss) == len(ts_json) for z, tss in unordered)
+
+        # connection arguments keep their positions before lazy
+        r = server.render
+        args = (r.DEFAULT_HOST, r.DEFAULT_PORT, r.DEFAULT_OWNER,
+                r.DEFAULT_PROJECT, r.session)
+        tilespecs = renderapi.tilespec.get_tile_specs_from_z(
+            'iter_stack', 1, *args)
+        assert len(tilespecs) == len(ts_json)
+        assert len(renderapi.tilespec.get_tile_specs_from_stack(
+            'iter_stack', *args, lazy=True)) == len(layers)
+
+
+def test_get_transform_library():
+    ts_json = load_test_tilespecs()
+    lens = ts_json[0]['transforms']['specList'][0]
+    with FakeRenderServer() as server:
+        server.add_json('/resolvedTiles', {
+            'transformIdToSpecMap': {'lens': lens},
+            'tileIdToSpecMap': {}}, stack='lens_stack')
+        library = renderapi.tilespec.get_transform_library(
+            'lens_stack', render=server.render)
+    assert library.to_dict() == {'lens': lens}
+    ts = renderapi.tilespec.TileSpec(json=dict(ts_json[0], transforms={
+        'type': 'list', 'specList': [{'type': 'ref', 'refId': 'lens'}]}))
+    library.resolve_tilespecs([ts])
+    assert ts.to_dict()['transforms']['specList'] == [lens]
+
+
+def test_resolved_tilespec_collection():
+    ts_json = load_test_tilespecs()
+    tilespecs = [renderapi.tilespec.TileSpec(json=d) for d in ts_json]
+    # the last transform of the first tile is its own
+    tilespecs[0].tforms[-1] = renderapi.transform.AffineModel(B0=1.)
+    resolved = renderapi.tilespec.ResolvedTileSpecCollection(
+        tilespecs=tilespecs)
+    assert len(resolved.transforms) == 3
+    d = resolved.to_dict()
+    assert (d['tileCount'], d['transformCount']) == (3, 3)
+    specLists = [t['transforms']['specList'] for t in d['tileSpecs']]
+    # tiles share the lens correction, and some pairs of tiles an affine
+    assert [[s['type'] for s in specList] for specList in specLists] == [
+        ['ref', 'ref', 'leaf'], ['ref', 'ref', 'ref'], ['ref', 'leaf', 'ref']]
+    # the tiles themselves are unchanged
+    assert tilespecs[1].to_dict()['transforms'] == ts_json[1]['transforms']
+
+    np.random.seed(10)
+    for cls in (renderapi.tilespec.ResolvedTileSpecCollection,
+                renderapi.tilespec.ResolvedTileSpecMap):
+        reloaded = cls(json=cls(tilespecs=tilespecs).to_dict())
+        assert len(reloaded.tilespecs) == 3
+        points = np.random.rand(10, 2) * 3840.
+        for ts in reloaded.resolve():
+            expected = tilespecs[[t.tileId for t in tilespecs].index(
+                ts.tileId)]
+            assert np.allclose(
+                renderapi.transform.estimate_dstpts(ts.tforms, points),
+                renderapi.transform.estimate_dstpts(expected.tforms, points))
+
+    unshared = renderapi.tilespec.ResolvedTileSpecCollection(
+        tilespecs=tilespecs, min_count=4)
+    assert unshared.transforms == []
+
+    # in a larger layer the shared lens correction dominates the payload
+    layer = [dict(ts_json[i % 3], tileId='tile.{}'.format(i))
+             for i in range(30)]
+    resolved = renderapi.tilespec.ResolvedTileSpecCollection(
+        tilespecs=[renderapi.tilespec.TileSpec(json=d) for d in layer])
+    assert len(json.dumps(resolved.to_dict())) < len(json.dumps(layer)) / 3
+
+
+def test_resolved_tilespec_collection_modified():
+    ts_json = load_test_tilespecs()
+    tilespecs = [renderapi.tilespec.TileSpec(json=d) for d in ts_json]
+    resolved = renderapi.tilespec.ResolvedTileSpecCollection(
+        tilespecs=tilespecs)
+
+    # transforms and tiles added after deduplicating are written out
+    tilespecs[0].tforms.append(renderapi.transform.AffineModel(B0=2.))
+    added = renderapi.tilespec.TileSpec(json=dict(ts_json[1], tileId='new'))
+    resolved.tilespecs.append(added)
+    d = resolved.to_dict()
+    assert d['tileCount'] == 4
+    specLists = [t['transforms']['specList'] for t in d['tileSpecs']]
+    assert len(specLists[0]) == len(tilespecs[0].tforms) == 4
+    assert specLists[0][-1] == tilespecs[0].tforms[-1].to_dict()
+    # and reference the shared transforms they have in common
+    assert specLists[3] == specLists[1]
+
+    # a shared transform changed in one tile is no longer referenced
+    tilespecs[2].tforms[0] = renderapi.transform.AffineModel(B0=3.)
+    specList = resolved.to_dict()['tileSpecs'][2]['transforms']['specList']
+    assert specList[0] == tilespecs[2].tforms[0].to_dict()
+
+
+def test_put_resolved_tilespecs():
+    ts_json = load_test_tilespecs()
+    resolved = renderapi.tilespec.ResolvedTileSpecCollection(
+        tilespecs=[renderapi.tilespec.TileSpec(json=d) for d in ts_json])
+    received = []
+
+    def put(path, body):
+        received.append(json.loads(body))
+        return b''
+    with FakeRenderServer() as server:
+        server.add('/resolvedTiles', put, stack='loading_stack',
+                   method='PUT')
+        renderapi.stack.put_resolved_tilespecs(
+            'loading_stack', resolved, render=server.render)
+    assert received == [json.loads(json.dumps(resolved.to_map_dict()))]
+    assert sorted(received[0]['tileIdToSpecMap']) == sorted(
+        d['tileId'] for d in ts_json)
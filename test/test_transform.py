@@ -1,8 +1,10 @@
 import json
+import pytest
 import renderapi
 import numpy as np
 import scipy.linalg
 import rendersettings
+from fakeserver import load_test_tilespecs
 
 
 def test_affine_rot_90():
@@ -55,6 +57,19 @@ def test_affine_random():
         assert(np.sum(np.abs(am.M.ravel()-am_fit.M.ravel())) < (.001*6))
 
 
+def test_affine_parameters_view_M():
+    am = renderapi.transform.AffineModel(M00=2., M01=0.5, B1=3.)
+    assert np.allclose(am.M, [[2., 0.5, 0.], [0., 1., 3.], [0., 0., 1.]])
+    am.M10 = -1.
+    assert am.M[1, 0] == -1.
+    am.M = np.identity(3)
+    assert am.M00 == 1. and am.B1 == 0.
+    assert am.className == renderapi.transform.AffineModel.className
+    assert (renderapi.transform.RigidModel().className ==
+            renderapi.transform.AffineModel.className)
+    assert not hasattr(am, '__dict__')
+
+
 def test_invert_Affine():
     am = renderapi.transform.AffineModel(M00=.9,
                                          M10=-0.2,
@@ -354,3 +369,388 @@ def test_estimate_translation_transform():
     estimate_homography_transform(
         do_scale=False, do_rotate=False,
         transformclass=renderapi.transform.TranslationModel)
+
+
+def test_affine_fit_batch():
+    np.random.seed(0)
+    K = 20
+    counts = np.random.randint(3, 50, K)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    src = np.random.rand(offsets[-1], 2) * 4000. + 1e5
+    targets = np.random.rand(K, 3, 3)
+    targets[:, 2] = [0., 0., 1.]
+    group = np.repeat(np.arange(K), counts)
+    dst = (np.einsum('kij,kj->ki', targets[group][:, :2, :2], src) +
+           targets[group][:, :2, 2] + np.random.randn(len(src), 2) * 0.1)
+
+    batch = renderapi.transform.AffineModel.fit_batch(src, dst, offsets)
+    assert batch.shape == (K, 3, 3)
+    for k in range(K):
+        am = renderapi.transform.AffineModel()
+        am.estimate(src[offsets[k]:offsets[k + 1]],
+                    dst[offsets[k]:offsets[k + 1]], return_params=False)
+        assert np.allclose(batch[k], am.M, rtol=1e-6, atol=1e-4)
+
+    regular = renderapi.transform.AffineModel.estimate_batch(
+        src[:60].reshape(3, 20, 2), dst[:60].reshape(3, 20, 2))
+    assert len(regular) == 3
+    assert np.allclose(regular[0].M, renderapi.transform.AffineModel.fit_batch(
+        src[:20], dst[:20], [0, 20])[0])
+
+    with pytest.raises(renderapi.errors.EstimationError):
+        renderapi.transform.AffineModel.fit_batch(src, dst, [0, 5, 5])
+
+
+def test_polynomial_tform_basis():
+    np.random.seed(1)
+    order = 3
+    params = np.random.randn(2, 10)
+    tform = renderapi.transform.Polynomial2DTransform(params=params)
+    points = np.random.rand(1000, 2) * 100.
+
+    expected = np.zeros(points.shape)
+    pidx = 0
+    for j in range(order + 1):
+        for i in range(j + 1):
+            term = points[:, 0] ** (j - i) * points[:, 1] ** i
+            expected += params[:, pidx] * term[:, np.newaxis]
+            pidx += 1
+
+    assert np.allclose(tform.tform(points), expected)
+    out = np.empty_like(points)
+    result = tform.tform(points, chunksize=7, out=out)
+    assert result is out
+    assert np.allclose(out, expected)
+    assert tform.tform(points, dtype=np.float32).dtype == np.float32
+    assert np.allclose(tform.tform(points, dtype=np.float32), expected,
+                       rtol=1e-3)
+    assert tform.tform(np.empty((0, 2))).shape == (0, 2)
+
+
+def test_polynomial_fit_normalized():
+    np.random.seed(2)
+    srcpts = np.random.rand(200, 2) * 3840.
+    target = renderapi.transform.Polynomial2DTransform(params=np.array([
+        [12., 1.01, 0.02, 1e-6, -2e-6, 3e-6, 1e-10, -2e-10, 3e-11, 1e-10],
+        [-5., -0.01, 0.98, 2e-6, 1e-6, -1e-6, -1e-10, 1e-10, 2e-11, 3e-10]]))
+    dstpts = target.tform(srcpts)
+    params, residual = renderapi.transform.Polynomial2DTransform.fit(
+        srcpts, dstpts, order=3, return_residual=True)
+    assert residual < 1e-6
+    assert np.allclose(params, target.params, rtol=1e-4, atol=1e-12)
+
+    noisy = dstpts + np.random.randn(*dstpts.shape)
+    fit = renderapi.transform.Polynomial2DTransform()
+    with pytest.raises(renderapi.errors.EstimationError):
+        fit.estimate(srcpts, noisy, order=3)
+    fit.estimate(srcpts, noisy, order=3, test_coords=False)
+    assert np.abs(fit.tform(srcpts) - dstpts).max() < 5.
+
+    with pytest.raises(renderapi.errors.EstimationError):
+        renderapi.transform.Polynomial2DTransform.fit(
+            srcpts[:10], dstpts[:10], order=3)
+
+
+def test_transformlist_compile():
+    np.random.seed(3)
+    affines = [renderapi.transform.AffineModel(
+        *(np.random.rand(6) + [1, 0, 0, 1, 0, 0])) for i in range(5)]
+    poly = renderapi.transform.Polynomial2DTransform(params=np.array([
+        [1., 1., 0., 1e-4, 0., 0.], [2., 0., 1., 0., 1e-4, 0.]]))
+    tforms = affines[:2] + [[affines[2], affines[3]]] + [poly, affines[4]]
+    tformlist = renderapi.transform.TransformList(tforms=tforms)
+    points = np.random.rand(50, 2) * 100.
+
+    expected = points
+    for tform in affines[:4] + [poly, affines[4]]:
+        expected = tform.tform(expected)
+
+    plan = tformlist.compile()
+    assert len(plan) == 3
+    assert plan[1] is poly
+    assert tformlist.compile() is plan
+    assert np.allclose(tformlist.tform(points), expected)
+    assert np.allclose(
+        renderapi.transform.estimate_dstpts(tforms, points), expected)
+
+    # modifying a transform or the list invalidates the plan
+    affines[0].B0 += 10.
+    assert tformlist.compile() is not plan
+    expected = points
+    for tform in affines[:4] + [poly, affines[4]]:
+        expected = tform.tform(expected)
+    assert np.allclose(tformlist.tform(points), expected)
+    tformlist.tforms.append(renderapi.transform.AffineModel(B0=1.))
+    assert len(tformlist.compile()) == 3
+    assert np.allclose(tformlist.tform(points), expected + [1., 0.])
+
+    tformlist.tforms.append(renderapi.transform.ReferenceTransform('ref'))
+    with pytest.raises(renderapi.errors.ConversionError):
+        tformlist.tform(points)
+
+
+def lens_polynomial(size=3840.):
+    # radial distortion of a few pixels at the corners of a tile
+    c = size / 2.
+    k = 4. / c ** 2
+    src = np.random.rand(500, 2) * size
+    r2 = ((src - c) ** 2).sum(axis=1)[:, np.newaxis]
+    dst = c + (src - c) * (1 + k * r2 / c)
+    return renderapi.transform.Polynomial2DTransform(
+        src=src, dst=dst, order=3)
+
+
+def test_polynomial_inverse_tform():
+    np.random.seed(5)
+    poly = lens_polynomial()
+    points = np.random.rand(100000, 2) * 3840.
+
+    J = poly.jacobian(points[:10])
+    d = 1e-3
+    for i, offset in enumerate([[d, 0], [0, d]]):
+        fd = (poly.tform(points[:10] + offset) -
+              poly.tform(points[:10] - offset)) / (2 * d)
+        assert np.allclose(J[:, :, i], fd, atol=1e-6)
+
+    dst = poly.tform(points)
+    inverted, converged = poly.inverse_tform(dst, return_converged=True)
+    assert converged.all()
+    assert np.abs(inverted - points).max() < 1e-5
+
+    # points which cannot be inverted are marked and NaN
+    dst[0] = np.nan
+    inverted, converged = poly.inverse_tform(
+        dst[:5], max_iterations=0, return_converged=True)
+    assert not converged.any()
+    assert np.isnan(inverted).all()
+
+
+def test_transformlist_inverse_tform():
+    np.random.seed(6)
+    poly = lens_polynomial()
+    affine = renderapi.transform.AffineModel(
+        0.99, 0.05, -0.05, 1.01, 100., -200.)
+    tformlist = renderapi.transform.TransformList(
+        tforms=[poly, affine, renderapi.transform.AffineModel(B0=5.)])
+    points = np.random.rand(10000, 2) * 3840.
+    dst = tformlist.tform(points)
+    inverted, converged = tformlist.inverse_tform(
+        dst, return_converged=True)
+    assert converged.all()
+    assert np.allclose(inverted, points, atol=1e-5)
+
+    # transforms with only a forward mapping are inverted as a chain
+    class ForwardOnly(object):
+        def tform(self, points):
+            return poly.tform(points)
+
+    tformlist = renderapi.transform.TransformList(
+        tforms=[ForwardOnly(), affine])
+    assert np.allclose(tformlist.inverse_tform(dst - [5., 0.]),
+                       points, atol=1e-5)
+
+    tformlist = renderapi.transform.TransformList(
+        tforms=[renderapi.transform.ReferenceTransform(refId='lens')])
+    with pytest.raises(renderapi.errors.ConversionError):
+        tformlist.inverse_tform(dst)
+
+
+def nonlinear_reference(dataString, point):
+    # direct port of mpicbg NonLinearCoordinateTransform.applyInPlace
+    fields = dataString.split()
+    dimension, length = int(fields[0]), int(fields[1])
+    values = [float(f) for f in fields[2:2 + 4 * length]]
+    beta = [values[2 * i:2 * i + 2] for i in range(length)]
+    normMean = values[2 * length:3 * length]
+    normVar = values[3 * length:]
+    expanded = []
+    for i in range(1, dimension + 1):
+        for j in range(i, -1, -1):
+            expanded.append(point[0] ** j * point[1] ** (i - j))
+    for i in range(length - 1):
+        expanded[i] = (expanded[i] - normMean[i]) / normVar[i]
+    expanded.append(100.)
+    return [sum(e * b[k] for e, b in zip(expanded, beta)) for k in range(2)]
+
+
+def test_nonlinear_coordinate_transform():
+    d = load_test_tilespecs()[0]['transforms']['specList'][0]
+    lc = renderapi.transform.load_transform_json(d)
+    assert isinstance(lc, renderapi.transform.NonLinearCoordinateTransform)
+    assert lc.to_dict() == d
+    assert (lc.dimension, lc.length, lc.width, lc.height) == (
+        5, 21, 3840, 3840)
+
+    np.random.seed(7)
+    points = np.random.rand(1000, 2) * 3840.
+    expected = np.array([nonlinear_reference(d['dataString'], p)
+                         for p in points[:50]])
+    result = lc.tform(points)
+    assert np.allclose(result[:50], expected, atol=1e-6)
+
+    inverted, converged = lc.inverse_tform(result, return_converged=True)
+    assert converged.all()
+    assert np.allclose(inverted, points, atol=1e-5)
+
+    # parameters round trip through a regenerated dataString
+    copied = renderapi.transform.NonLinearCoordinateTransform(
+        dimension=lc.dimension, beta=lc.beta, normMean=lc.normMean,
+        normVar=lc.normVar, width=lc.width, height=lc.height)
+    reloaded = renderapi.transform.NonLinearCoordinateTransform(
+        dataString=copied.dataString)
+    assert np.array_equal(reloaded.beta, lc.beta)
+    assert np.array_equal(reloaded.tform(points), result)
+
+    lc.beta[0, 0] += 1.
+    assert lc.dataString != d['dataString']
+    assert not np.allclose(lc.tform(points), result)
+
+    with pytest.raises(renderapi.errors.ConversionError):
+        renderapi.transform.NonLinearCoordinateTransform(dataString='1 3 0 0')
+
+
+def test_transform_mesh():
+    ts = renderapi.tilespec.TileSpec(json=load_test_tilespecs()[0])
+    tformlist = renderapi.transform.TransformList(tforms=ts.tforms)
+    np.random.seed(8)
+    points = np.random.rand(20000, 2) * [ts.width, ts.height]
+    exact = tformlist.tform(points)
+
+    for method in renderapi.transform.TransformMesh.METHODS:
+        mesh = tformlist.approximate(ts.width, ts.height, method=method)
+        assert mesh.max_error < 0.5
+        error = np.hypot(*(mesh.tform(points) - exact).T)
+        assert error.max() < 2 * mesh.max_error
+    assert tformlist.approximate(
+        ts.width, ts.height, method='bilinear') is mesh
+
+    # the mesh reproduces the transform at its vertices, and finer meshes
+    #     approximate it better
+    coarse = tformlist.approximate(ts.width, ts.height, shape=(4, 4))
+    corners = np.array([[0., 0.], [ts.width, ts.height]])
+    assert np.allclose(coarse.tform(corners), tformlist.tform(corners))
+    assert coarse.max_error > mesh.max_error
+
+    mesh = ts.approximate_tforms(shape=(8, 8))
+    assert ts.approximate_tforms(shape=(8, 8)) is mesh
+    ts.tforms = ts.tforms[:1]
+    assert ts.approximate_tforms(shape=(8, 8)) is not mesh
+
+    with pytest.raises(renderapi.errors.ConversionError):
+        tformlist.approximate(ts.width, ts.height, method='spline')
+
+
+def test_transform_mesh_modified():
+    poly = renderapi.transform.Polynomial2DTransform(identity=True)
+    tformlist = renderapi.transform.TransformList(tforms=[poly])
+    point = np.array([[50., 50.]])
+    mesh = tformlist.approximate(100, 100, shape=(4, 4))
+    assert np.allclose(mesh.tform(point), point)
+
+    # changing a non-affine transform in place invalidates the mesh
+    poly.params[0, 0] = 10.
+    mesh = tformlist.approximate(100, 100, shape=(4, 4))
+    assert np.allclose(mesh.tform(point), [[60., 50.]])
+    assert np.allclose(tformlist.tform(point), [[60., 50.]])
+
+
+def test_leaf_cache():
+    tilespecs = [renderapi.tilespec.TileSpec(json=d)
+                 for d in load_test_tilespecs()]
+    lcs = [ts.tforms[0] for ts in tilespecs]
+    assert len(set(map(id, lcs))) == len(lcs)
+    assert all(lc._beta is lcs[0]._beta for lc in lcs)
+    assert lcs[0]._get_polynomial() is lcs[1]._get_polynomial()
+
+    # copies own whatever can be modified in place
+    affines = [ts.tforms[1] for ts in tilespecs]
+    affines[0].B0 += 10.
+    assert affines[1].B0 == affines[0].B0 - 10.
+    result = lcs[1].tform(np.zeros((1, 2)))
+    lcs[0].beta *= 2.
+    assert lcs[0].beta is not lcs[1]._beta
+    assert not np.allclose(lcs[0].tform(np.zeros((1, 2))), result)
+    assert np.array_equal(lcs[1].tform(np.zeros((1, 2))), result)
+    lcs[1].as_polynomial().params[:] = 0.
+    assert np.array_equal(lcs[1].tform(np.zeros((1, 2))), result)
+
+    # without interning, parsed arrays are writable
+    renderapi.transform.leaf_cache.maxsize = 0
+    try:
+        lc = renderapi.tilespec.TileSpec(json=tilespecs[0].to_dict()).tforms[0]
+        assert lc.beta.flags.writeable
+        assert lc.as_polynomial().params.flags.writeable
+    finally:
+        renderapi.transform.leaf_cache.maxsize = 1024
+
+    d = {'type': 'leaf',
+         'className': renderapi.transform.Polynomial2DTransform.className,
+         'dataString': '0.0 1.0 0.0 0.0 0.0 1.0', 'transformId': 'a'}
+    cache = renderapi.transform.LeafCache(maxsize=1)
+
+    def load(x):
+        return renderapi.transform.Polynomial2DTransform(json=x)
+
+    a = cache.get(d, load)
+    b = cache.get(dict(d, transformId='b'), load)
+    assert (a.transformId, b.transformId) == ('a', 'b')
+    # interned polynomials share their parameters until one is modified
+    assert a._params is b._params
+    assert np.allclose(a.tform(np.ones((1, 2))), b.tform(np.ones((1, 2))))
+    assert a._params is b._params
+    a.params[0, 0] = 5.
+    assert a._params is not b._params
+    assert b.params[0, 0] == 0.
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.get(dict(d, dataString='0 1 0 0 0 1'), load)
+    assert len(cache) == 1
+
+
+def test_transform_library(tmpdir):
+    tilespec_jsons = load_test_tilespecs()
+    lens = dict(tilespec_jsons[0]['transforms']['specList'][0])
+    shared = {'lens': lens,
+              'montage': {'type': 'list', 'specList': [
+                  {'type': 'ref', 'refId': 'lens'},
+                  renderapi.transform.AffineModel(B0=10.).to_dict()]}}
+    path = str(tmpdir.join('transforms.json'))
+    with open(path, 'w') as f:
+        json.dump({'transformIdToSpecMap': shared}, f)
+    library = renderapi.transform.TransformLibrary.from_file(path)
+    assert len(library) == 2 and 'montage' in library
+
+    tilespecs = []
+    for d in tilespec_jsons:
+        d = dict(d, transforms={'type': 'list', 'specList': [
+            {'type': 'ref', 'refId': 'montage'}] +
+            d['transforms']['specList'][1:]})
+        tilespecs.append(renderapi.tilespec.TileSpec(json=d))
+    unresolved = tilespecs[0].tforms
+    library.resolve_tilespecs(tilespecs)
+    expected = renderapi.tilespec.TileSpec(json=tilespec_jsons[0])
+    np.random.seed(9)
+    points = np.random.rand(100, 2) * 3840.
+    for ts in tilespecs:
+        assert not any(isinstance(t, renderapi.transform.ReferenceTransform)
+                       for t in renderapi.transform.TransformList._flatten(
+                           ts.tforms))
+        assert np.allclose(
+            renderapi.transform.estimate_dstpts(ts.tforms, points),
+            renderapi.transform.estimate_dstpts(
+                expected.tforms[:1] + [renderapi.transform.AffineModel(
+                    B0=10.)] + expected.tforms[1:], points))
+    assert tilespecs[0].tforms[0] is not tilespecs[1].tforms[0]
+    tilespecs[0].tforms[0].tforms.append(renderapi.transform.AffineModel())
+    assert len(tilespecs[1].tforms[0].tforms) == 2
+
+    # resolved tilespecs serialize their shared transforms inline
+    assert tilespecs[1].to_dict()['transforms']['specList'][0][
+        'specList'][0] == lens
+    assert library.resolve(tilespecs[1].tforms) is tilespecs[1].tforms
+
+    with pytest.raises(renderapi.errors.RenderError):
+        library.resolve(unresolved + [
+            renderapi.transform.ReferenceTransform(refId='missing')])
+    library.add({'type': 'ref', 'refId': 'loop'}, 'loop')
+    with pytest.raises(renderapi.errors.RenderError):
+        library.resolve(renderapi.transform.ReferenceTransform(refId='loop'))
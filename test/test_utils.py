@@ -1,3 +1,4 @@
+import pytest
 import renderapi
 
 
@@ -6,3 +7,17 @@ def test_jbool():
     assert(renderapi.utils.jbool(False) == 'false')
     assert(renderapi.utils.jbool(0) == 'false')
     assert(renderapi.utils.jbool(1) == 'true')
+
+
+def test_imap_bounded():
+    def square(x):
+        if x < 0:
+            raise ValueError(x)
+        return x ** 2
+    assert (list(renderapi.utils.imap_bounded(square, range(20), poolsize=3)) ==
+            [(i, i ** 2) for i in range(20)])
+    assert (sorted(renderapi.utils.imap_bounded(
+        square, range(20), ordered=False, readahead=1)) ==
+            [(i, i ** 2) for i in range(20)])
+    with pytest.raises(ValueError):
+        list(renderapi.utils.imap_bounded(square, [1, 2, -1, 3]))
@@ -0,0 +1,138 @@
+import io
+import json
+import os
+import numpy as np
+from PIL import Image
+import pytest
+import renderapi
+from fakeserver import FakeRenderServer
+
+ZVALUES = [0, 1, 2, 3, 4]
+
+
+def render_section(path, body):
+    # pixels hold their scaled world column and row and z, modulo 251
+    z, box = path.split('?')[0].split('/z/')[1].split('/box/')
+    box = box.split('/')[0]
+    x, y, width, height, scale = [float(v) for v in box.split(',')]
+    rows, cols = renderapi.image._bb_image_shape(width, height, scale)
+    r0, c0 = int(round(y * scale)), int(round(x * scale))
+    image = ((np.arange(c0, c0 + cols)[np.newaxis, :] +
+              np.arange(r0, r0 + rows)[:, np.newaxis] * 7 +
+              int(z) * 31) % 251)
+    f = io.BytesIO()
+    Image.fromarray(image.astype(np.uint8)).save(f, format='png')
+    return f.getvalue()
+
+
+def expected_section(z, x, y, width, height, scale):
+    return renderapi.image._decode_image(render_section(
+        '/z/%d/box/%d,%d,%d,%d,%f/png-image' % (
+            z, x, y, width, height, scale), None))
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeRenderServer() as server:
+        server.add_json('/zValues/', ZVALUES, stack='volume_stack')
+        server.add_json('/bounds', {
+            'minX': 100., 'minY': 50., 'maxX': 900., 'maxY': 650.,
+            'minZ': 0., 'maxZ': 4.}, stack='volume_stack')
+        server.add_prefix('/z/', render_section, stack='volume_stack')
+        yield server
+
+
+def section_requests(server):
+    return len([r for r in server.requests
+                if '/stack/volume_stack/z/' in r[1]])
+
+
+def test_export_volume_memmap(server, tmpdir):
+    path = str(tmpdir.join('volume'))
+    progress, volume = renderapi.volume.export_volume(
+        'volume_stack', path, scale=0.5, poolsize=3, readahead=2,
+        render=server.render)
+    assert volume.shape == (len(ZVALUES), 300, 400)
+    assert volume.dtype == np.uint8
+    assert sorted(progress['done']) == ZVALUES
+    for i, z in enumerate(ZVALUES):
+        assert np.array_equal(
+            volume[i], expected_section(z, 100, 50, 800, 600, 0.5))
+
+    # a finished export is not fetched again
+    before = section_requests(server)
+    progress, again = renderapi.volume.export_volume(
+        'volume_stack', path, scale=0.5, render=server.render)
+    assert section_requests(server) == before
+    assert np.array_equal(again, volume)
+
+
+def test_export_volume_tiled(server, tmpdir):
+    path = str(tmpdir.join('volume'))
+    bounds = (0, 0, 700, 500)
+    progress, volume = renderapi.volume.export_volume(
+        'volume_stack', path, zValues=[1, 3], bounds=bounds, scale=0.3,
+        tilesize=64, render=server.render)
+    assert volume.shape == (2, 150, 210)
+    for i, z in enumerate([1, 3]):
+        assert np.array_equal(volume[i], expected_section(z, *bounds + (0.3,)))
+
+
+def test_export_volume_fractional_bounds(server, tmpdir):
+    server.add_json('/zValues/', [2], stack='fractional_stack')
+    server.add_json('/bounds', {
+        'minX': 0.5, 'minY': 10.7, 'maxX': 100.4, 'maxY': 60.2,
+        'minZ': 2., 'maxZ': 2.}, stack='fractional_stack')
+    server.add_prefix('/z/', render_section, stack='fractional_stack')
+    path = str(tmpdir.join('volume'))
+    progress, volume = renderapi.volume.export_volume(
+        'fractional_stack', path, render=server.render)
+    # the box is rounded out to cover the right and bottom edges
+    assert progress['bounds'] == [0, 10, 101, 51]
+    assert volume.shape == (1, 51, 101)
+    assert np.array_equal(volume[0], expected_section(2, 0, 10, 101, 51, 1.))
+
+
+def test_export_volume_resume(server, tmpdir):
+    path = str(tmpdir.join('volume'))
+    bounds = (0, 0, 200, 100)
+    renderapi.volume.export_volume(
+        'volume_stack', path, zValues=ZVALUES, bounds=bounds,
+        layout='chunks', render=server.render)
+
+    # forget two sections, as if the export had been interrupted
+    progressfile = os.path.join(path, 'progress.json')
+    with open(progressfile, 'r') as f:
+        progress = json.load(f)
+    progress['done'] = [z for z in progress['done'] if z not in (1, 4)]
+    with open(progressfile, 'w') as f:
+        json.dump(progress, f)
+    os.remove(os.path.join(path, 'z_000004.npy'))
+
+    before = section_requests(server)
+    progress, chunks = renderapi.volume.export_volume(
+        'volume_stack', path, zValues=ZVALUES, bounds=bounds,
+        layout='chunks', render=server.render)
+    assert section_requests(server) - before == 2
+    assert sorted(progress['done']) == ZVALUES
+    assert len(chunks) == len(ZVALUES)
+    for z, chunk in zip(ZVALUES, chunks):
+        assert np.array_equal(chunk, expected_section(z, *bounds + (1.0,)))
+
+    # other parameters start the export over
+    before = section_requests(server)
+    progress, chunks = renderapi.volume.export_volume(
+        'volume_stack', path, zValues=ZVALUES, bounds=bounds, scale=0.5,
+        layout='chunks', render=server.render)
+    assert section_requests(server) - before == len(ZVALUES)
+    assert chunks[0].shape == (50, 100)
+
+
+def test_export_volume_errors(server, tmpdir):
+    path = str(tmpdir.join('volume'))
+    with pytest.raises(renderapi.errors.RenderError):
+        renderapi.volume.export_volume(
+            'volume_stack', path, zValues=[0], bounds=(0, 0, 10, 10),
+            layout='zarr', render=server.render)
+    with pytest.raises(renderapi.errors.RenderError):
+        renderapi.volume.load_volume(path)